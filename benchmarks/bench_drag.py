@@ -0,0 +1,131 @@
+"""拖动和鼠标移动事件的Tk调用次数对比：逐事件处理 vs 按显示帧合并
+
+在隐藏的Tk根窗口上按正常流程创建界面（CapsLockChecker，后端为FakeBackend），
+按1000Hz（高回报率鼠标）实时回放拖动和鼠标移动事件，统计每秒实际发生的after/geometry调用次数，
+以及界面自己统计的Tk调用（拖动时的geometry）。需要显示器，没有时跳过。
+
+用法: python benchmarks/bench_drag.py
+"""
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caps_lock_checker import CapsLockChecker, FakeBackend, load_tkinter
+
+
+def make_counting_root():
+    """返回统计after/after_cancel/geometry调用次数的隐藏Tk根窗口，没有显示器时返回None"""
+    tk = load_tkinter()
+
+    class CountingTk(tk.Tk):
+        calls = 0
+        geometry_calls = 0
+
+        def after(self, ms, func=None, *args):
+            self.calls += 1
+            return super().after(ms, func, *args)
+
+        def after_cancel(self, id):
+            self.calls += 1
+            return super().after_cancel(id)
+
+        def geometry(self, newGeometry=None):
+            if newGeometry is not None:
+                self.calls += 1
+                self.geometry_calls += 1
+            return super().geometry(newGeometry)
+
+    try:
+        root = CountingTk()
+    except Exception:
+        return None
+    root.withdraw()
+    return root
+
+
+class LegacyHandlers:
+    """改动前的处理方式：每个事件都调用geometry，鼠标移动时逐事件读时间戳"""
+
+    def __init__(self, root):
+        self.root = root
+        self.dragging = True
+        self.titlebar_visible = True
+        self.drag_offset = (10, 10)
+        self.last_mouse_move_time = 0
+        self.leave_hide_timer = None
+
+    def on_window_drag_motion(self, event):
+        if self.dragging:
+            new_x = event.x_root - self.drag_offset[0]
+            new_y = event.y_root - self.drag_offset[1]
+            self.root.geometry(f"+{new_x}+{new_y}")
+
+    def on_mouse_motion(self, event):
+        current_time = time.time()
+        if current_time - self.last_mouse_move_time > 0.05:
+            self.last_mouse_move_time = current_time
+        if self.leave_hide_timer:
+            self.root.after_cancel(self.leave_hide_timer)
+            self.leave_hide_timer = None
+
+
+def replay(app, root, handler_name, seconds=1, rate_hz=1000, rearm_leave_timer=False):
+    """按rate_hz实时回放鼠标事件，返回每秒Tk调用次数、geometry调用次数和界面统计的Tk调用次数
+
+    rearm_leave_timer模拟鼠标在窗口边缘反复进出：隐藏计时器被取消后立即重建。
+    """
+    handler = getattr(app, handler_name)
+    counter = app.renderer.counter if isinstance(app, CapsLockChecker) else None
+    counted = counter.total if counter is not None else 0
+    root.update()
+    root.calls = root.geometry_calls = 0
+    started = time.perf_counter()
+    for i in range(int(seconds * rate_hz)):
+        while time.perf_counter() - started < i / rate_hz:
+            root.update()
+        handler(SimpleNamespace(x_root=100 + i % 300, y_root=100 + i % 200, y=40))
+        if rearm_leave_timer and app.leave_hide_timer is None:
+            app.leave_hide_timer = root.after(500, lambda: None)
+    deadline = time.perf_counter() + 0.1
+    while time.perf_counter() < deadline:
+        root.update()
+    counted = f"{(counter.total - counted) / seconds:.0f}" if counter is not None else '-'
+    return root.calls / seconds, root.geometry_calls / seconds, counted
+
+
+def main():
+    root = make_counting_root()
+    if root is None:
+        print("没有显示器，无法创建Tk根窗口，跳过")
+        return 0
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # 界面的配置文件和日志写在临时目录中
+        try:
+            app = CapsLockChecker(root, backend=FakeBackend())
+            try:
+                app.dragging = True
+                app.titlebar_visible = False
+                app.drag_offset = (10, 10)
+                print(f"{'scenario':<24}{'tk calls/s':>12}{'geometry/s':>12}{'counted/s':>12}")
+                for label, target, handler, rearm in (
+                    ("drag, per-event", LegacyHandlers(root), 'on_window_drag_motion', False),
+                    ("drag, per-frame", app, 'on_window_drag_motion', False),
+                    ("motion, per-event", LegacyHandlers(root), 'on_mouse_motion', True),
+                    ("motion, per-frame", app, 'on_mouse_motion', True),
+                ):
+                    calls, geometry, counted = replay(target, root, handler, rearm_leave_timer=rearm)
+                    print(f"{label:<24}{calls:>12.0f}{geometry:>12.0f}{counted:>12}")
+            finally:
+                app.close_application()
+        finally:
+            os.chdir(cwd)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
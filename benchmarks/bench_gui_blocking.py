@@ -0,0 +1,142 @@
+"""验证界面线程阻塞时检测引擎仍能及时切换Caps Lock
+
+使用FakeBackend驱动CapsLockEngine，引擎的通知经过界面实际使用的TkNotifier，
+界面故意卡住：有显示器时在Tk主线程的回调中阻塞（跨线程的event_generate要等主线程处理），
+没有显示器时用event_generate一直阻塞到界面恢复的替身根窗口。
+另一个线程不断切换前台窗口，统计每次切换到Caps Lock状态改变的延迟；界面恢复后检查通知被合并送达。
+
+任一次切换超过1秒或界面恢复后没有收到通知时退出码为1。
+
+用法: python benchmarks/bench_gui_blocking.py [--fake-root]
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caps_lock_checker import DEFAULT_CONFIG, CapsLockEngine, FakeBackend, PolicyTable, TkNotifier, load_tkinter
+
+CONFIG = dict(DEFAULT_CONFIG, software_list=['CAXA'], metrics_interval=0, settle_time=0)
+SEQUENCE = '<<EngineState>>'
+
+
+class BlockedRoot:
+    """代替Tk根窗口：event_generate像界面卡住时跨线程调用Tk一样阻塞，直到release"""
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.calls = 0
+        self.delivered = 0
+
+    def event_generate(self, sequence, when=None):
+        self.calls += 1
+        self.released.wait()
+        self.delivered += 1
+
+    def release(self):
+        self.released.set()
+
+
+def make_tk_root():
+    """有显示器时返回隐藏的Tk根窗口，否则返回None"""
+    try:
+        root = load_tkinter().Tk()
+    except Exception:
+        return None
+    root.withdraw()
+    return root
+
+
+def drive_switches(backend, switches, latencies, errors):
+    """交替切换到CAXA和记事本窗口，等待引擎完成切换并记录延迟"""
+    for i in range(switches):
+        target = i % 2 == 0
+        hwnd = 1 if target else 2
+        start = time.perf_counter()
+        backend.set_foreground(hwnd)
+        while backend.caps_lock != target:
+            if time.perf_counter() - start > 1:
+                errors.append(f"第{i}次切换超时")
+                return
+            time.sleep(0)
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.005)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--switches', type=int, default=200)
+    parser.add_argument('--fake-root', action='store_true', help="不使用Tk，用阻塞的替身根窗口")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench")
+    backend = FakeBackend()
+    backend.add_window(1, "part.cxp - CAXA 3D")
+    backend.add_window(2, "notes.txt - 记事本")
+    backend.set_foreground(2)
+
+    root = None if args.fake_root else make_tk_root()
+    handled = []
+    if root is not None:
+        root.bind(SEQUENCE, lambda event: handled.append(time.perf_counter()))
+        kind = "Tk"
+    else:
+        root = BlockedRoot()
+        kind = "阻塞的替身根窗口"
+    notifier = TkNotifier(root, SEQUENCE)
+    engine = CapsLockEngine(backend, logger, notify=notifier)
+    engine.start(dict(CONFIG), PolicyTable.from_config(CONFIG))
+
+    latencies = []
+    errors = []
+    driver = threading.Thread(target=drive_switches, args=(backend, args.switches, latencies, errors))
+    blocked = []
+
+    def block_gui():
+        # 界面卡住：在主线程中等到所有切换完成才返回，期间不处理任何事件
+        blocked_since = time.perf_counter()
+        driver.start()
+        driver.join()
+        blocked.append(time.perf_counter() - blocked_since)
+
+    if isinstance(root, BlockedRoot):
+        block_gui()
+        queued = engine.states.qsize()
+        root.release()
+        deadline = time.perf_counter() + 2
+        while root.delivered < root.calls and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        generated, delivered = root.calls, root.delivered
+    else:
+        root.after(0, block_gui)
+        while not blocked:
+            root.update()
+        queued = engine.states.qsize()
+        deadline = time.perf_counter() + 2
+        while not handled and time.perf_counter() < deadline:
+            root.update()
+            time.sleep(0.01)
+        generated = delivered = len(handled)
+    notifier.stop()
+    engine.stop()
+    if not isinstance(root, BlockedRoot):
+        root.destroy()
+
+    latencies.sort()
+    print(f"通知方式: TkNotifier + {kind}")
+    print(f"界面阻塞 {blocked[0]:.2f}s 期间完成切换 {len(latencies)} 次")
+    if latencies:
+        print(f"延迟 p50={latencies[len(latencies) // 2] * 1000:.3f}ms "
+              f"max={latencies[-1] * 1000:.3f}ms")
+    print(f"状态队列积压 {queued} 条，界面恢复后收到合并的通知 {delivered} 次（发出 {generated} 次）")
+    for error in errors:
+        print(error)
+    return 1 if errors or not delivered else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""IPC接口的响应和推送延迟
+
+用FakeBackend驱动在独立线程中运行的CapsLockEngine，通过IPC接口：
+- 反复发送status，统计往返延迟
+- 订阅状态变化后切换前台窗口，统计从切换到收到推送的延迟
+- 一个只订阅不读取的客户端积压超过上限后被断开，不影响其他订阅者
+
+用法: python benchmarks/bench_ipc.py [--requests N] [--switches N]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caps_lock_checker import DEFAULT_CONFIG, CapsLockEngine, FakeBackend, IpcServer, PolicyTable, connect_ipc
+
+CONFIG = dict(DEFAULT_CONFIG, software_list=['CAXA'], metrics_interval=0, settle_time=0)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {name: round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 3)
+            for name, q in (('p50', 0.5), ('p99', 0.99), ('max', 1.0))}
+
+
+def request(connection, command):
+    connection.write(json.dumps({'cmd': command}).encode('utf-8') + b'\n')
+    connection.flush()
+    return json.loads(connection.readline())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--switches', type=int, default=1000)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench")
+    backend = FakeBackend()
+    backend.add_window(1, "part.cxp - CAXA 3D")
+    backend.add_window(2, "notes.txt - 记事本")
+    backend.set_foreground(2)
+    engine = CapsLockEngine(backend, logger)
+    engine.start(dict(CONFIG), PolicyTable.from_config(CONFIG))
+
+    if sys.platform == 'win32':
+        address = rf'\\.\pipe\caps_lock_checker-bench-{os.getpid()}'
+    else:
+        address = os.path.join(tempfile.mkdtemp(), 'ipc.sock')
+    server = IpcServer(engine, address, logger, max_buffer=4096)
+    server.start()
+    if not server.ready.wait(5) or not server.listening:
+        raise SystemExit("IPC接口启动失败")
+
+    try:
+        with connect_ipc(address) as connection:
+            latencies = []
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                request(connection, 'status')
+                latencies.append(time.perf_counter() - started)
+        print(f"status往返({args.requests}次): {percentiles(latencies)} ms")
+
+        # 只订阅不读取的客户端，积压超过max_buffer后应被断开
+        stalled = connect_ipc(address, timeout=None)
+        stalled.write(b'{"cmd": "subscribe"}\n')
+        stalled.flush()
+        with connect_ipc(address, timeout=5) as subscriber:
+            request(subscriber, 'subscribe')
+            latencies = []
+            for i in range(args.switches):
+                target = i % 2 == 0
+                started = time.perf_counter()
+                backend.set_foreground(1 if target else 2)
+                while True:
+                    event = json.loads(subscriber.readline())
+                    if event['event'] == 'caps' and event['caps_lock_on'] == target:
+                        break
+                latencies.append(time.perf_counter() - started)
+        print(f"切换到收到Caps Lock状态推送({args.switches}次): {percentiles(latencies)} ms")
+        stalled.close()
+        stats = server.stats()
+        print(f"IPC统计: {stats}")
+        if stats['dropped_subscribers'] < 1:
+            print("不读取的订阅者没有被断开")
+            return 1
+        return 0
+    finally:
+        server.stop()
+        engine.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
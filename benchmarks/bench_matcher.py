@@ -0,0 +1,112 @@
+"""软件列表匹配性能对比：线性子串扫描 vs 编译后的TitleMatcher
+
+先用小字母表随机生成大量互相重叠的子串/前缀/正则条目，和逐条匹配的朴素实现对比结果
+（条目少时的逐条匹配和自动机两条路径都检查），有不一致时退出码为1。
+
+用法: python benchmarks/bench_matcher.py
+"""
+import os
+import random
+import re
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caps_lock_checker import TitleMatcher
+
+
+def make_patterns(count, rng):
+    """生成类似CAD/CAM/PLM产品名的模式"""
+    products = []
+    for i in range(count):
+        name = ''.join(rng.choice(string.ascii_letters) for _ in range(rng.randint(4, 10)))
+        products.append(f"{name} {2000 + i % 30}")
+    return products
+
+
+def make_titles(patterns, rng, count=200):
+    """生成窗口标题，约一半命中"""
+    titles = []
+    for i in range(count):
+        doc = ''.join(rng.choice(string.ascii_lowercase) for _ in range(12))
+        if i % 2:
+            titles.append(f"{doc}.dwg - {rng.choice(patterns)} - [Drawing]")
+        else:
+            titles.append(f"{doc}.txt - 记事本")
+    return titles
+
+
+def naive_search(entries, title):
+    """逐条匹配，返回第一个命中的条目下标"""
+    for index, entry in enumerate(entries):
+        text, folded = entry, title
+        if text.startswith('i:'):
+            text, folded = text[2:].casefold(), title.casefold()
+            if text.startswith('re:'):
+                text, folded = entry[2:], title
+        if text.startswith('re:'):
+            hit = re.search(text[3:], folded, re.IGNORECASE if entry.startswith('i:') else 0)
+        elif text.startswith('^'):
+            hit = folded.startswith(text[1:])
+        else:
+            hit = text in folded
+        if hit:
+            return index
+    return None
+
+
+def check(rng, rounds=2000):
+    """与朴素实现对比，返回不一致的(条目, 标题, 结果, 应为)列表"""
+    def word(alphabet='abAB'):
+        return ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4)))
+
+    mismatches = []
+    fixed = [(['^b', '^abc'], ['abx', 'bx', 'abc']), (['re:(?i)solidworks', 'CAD'], ['SolidWorks 2024', 'x'])]
+    for _ in range(rounds):
+        entries = [rng.choice(('', '^', 'i:', 'i:^', 're:^', 'i:re:')) + word() for _ in range(rng.randint(1, 8))]
+        fixed.append((entries, [word() + word() for _ in range(10)]))
+    for entries, titles in fixed:
+        matcher = TitleMatcher(entries)
+        for title in titles:
+            want = naive_search(entries, title)
+            for linear in (True, False):
+                matcher._linear = linear
+                got = matcher.search(title)
+                if got != want:
+                    mismatches.append((entries, title, got, want))
+    return mismatches
+
+
+def main():
+    rng = random.Random(42)
+    mismatches = check(rng)
+    print(f"与朴素实现对比: {len(mismatches)}处不一致")
+    for entries, title, got, want in mismatches[:10]:
+        print(f"  {entries} {title!r}: 得到{got}，应为{want}")
+    if mismatches:
+        return 1
+    print(f"{'patterns':>10} {'linear (us/title)':>20} {'matcher (us/title)':>20} {'speedup':>10}")
+    for count in (10, 32, 100, 1000, 10000):
+        patterns = make_patterns(count, rng)
+        titles = make_titles(patterns, rng)
+        matcher = TitleMatcher(patterns)
+
+        def linear():
+            for title in titles:
+                any(software in title for software in patterns)
+
+        def compiled():
+            for title in titles:
+                matcher.matches(title)
+
+        number = max(1, 2000 // count)
+        linear_us = min(timeit.repeat(linear, number=number, repeat=3)) / number / len(titles) * 1e6
+        compiled_us = min(timeit.repeat(compiled, number=number, repeat=3)) / number / len(titles) * 1e6
+        print(f"{count:>10} {linear_us:>20.2f} {compiled_us:>20.2f} {linear_us / compiled_us:>9.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
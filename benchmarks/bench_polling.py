@@ -0,0 +1,162 @@
+"""轮询方式的自适应间隔和暂停：用FakeBackend和虚拟时钟检查，并统计空闲时的查询次数
+
+- 前台窗口轮询（PollingForegroundSource）：空闲时从poll_interval_min逐次翻倍退避到poll_interval_max，
+  有输入或切换窗口后立即收紧到最小间隔
+- 会话锁定、显示器关闭时不查询前台窗口，只按最大间隔检查是否恢复；恢复后一个最大间隔内发现窗口切换
+- 没有键盘钩子时引擎轮询Caps Lock状态，同样退避、收紧和暂停
+
+任一检查不满足时退出码为1。
+
+用法: python benchmarks/bench_polling.py
+"""
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caps_lock_checker import (DEFAULT_CONFIG, CapsLockEngine, FakeBackend, PolicyTable, PollingForegroundSource,
+                               VirtualLoop)
+
+MIN_INTERVAL = 100
+MAX_INTERVAL = 1000
+CAPS_INTERVAL = 250
+
+
+class CountingBackend(FakeBackend):
+    """记录查询前台窗口和Caps Lock状态的虚拟时间"""
+
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+        self.foreground_reads = []
+        self.caps_reads = []
+
+    def get_foreground_window(self):
+        self.foreground_reads.append(self.loop.now)
+        return super().get_foreground_window()
+
+    def get_caps_lock_state(self):
+        self.caps_reads.append(self.loop.now)
+        return super().get_caps_lock_state()
+
+
+def gaps_ms(times):
+    return [round((b - a) * 1000) for a, b in zip(times, times[1:])]
+
+
+def make_backend(loop):
+    backend = CountingBackend(loop)
+    backend.add_window(1, "part.cxp - CAXA 3D")
+    backend.add_window(2, "notes.txt - 记事本")
+    backend.set_foreground(2)
+    return backend
+
+
+def check_foreground():
+    """前台窗口轮询的退避、收紧和暂停，返回(检查名, 是否通过, 说明)列表"""
+    loop = VirtualLoop()
+    backend = make_backend(loop)
+    changes = []
+    source = PollingForegroundSource(backend, loop, MIN_INTERVAL, MAX_INTERVAL)
+    source.start(lambda hwnd: changes.append((loop.now, hwnd)))
+    results = []
+
+    loop.advance(5)
+    gaps = gaps_ms(backend.foreground_reads)
+    expected = [100, 200, 400, 800, 1000]  # 第一次查询还没有上次的输入时间，按有输入处理
+    results.append(("空闲时退避", gaps[:len(expected)] == expected and set(gaps[len(expected):]) <= {1000},
+                    f"间隔 {gaps}"))
+
+    backend.foreground_reads.clear()
+    backend.last_input_tick += 1
+    loop.advance(1.5)
+    gaps = gaps_ms(backend.foreground_reads)
+    results.append(("有输入后收紧", bool(gaps) and gaps[0] == MIN_INTERVAL, f"输入后的间隔 {gaps}"))
+
+    loop.advance(5)
+    backend.foreground_reads.clear()
+    switched_at = loop.now
+    backend.set_foreground(1)
+    loop.advance(1.5)
+    seen = [at for at, hwnd in changes if hwnd == 1]
+    gaps = gaps_ms(backend.foreground_reads)
+    results.append(("切换窗口后收紧", bool(seen) and seen[0] - switched_at <= MAX_INTERVAL / 1000
+                    and gaps[:1] == [MIN_INTERVAL], f"发现切换用时 {round((seen[0] - switched_at) * 1000) if seen else None}ms，"
+                    f"之后的间隔 {gaps}"))
+
+    for flag in ('session_paused', 'display_off'):
+        backend.foreground_reads.clear()
+        ticks = source.ticks
+        setattr(backend, flag, True)
+        loop.advance(10)
+        paused_ticks = source.ticks - ticks
+        results.append((f"{flag}时暂停", not backend.foreground_reads and paused_ticks <= 11 and source.stats()['paused'],
+                        f"10秒内查询前台窗口{len(backend.foreground_reads)}次，检查是否恢复{paused_ticks}次"))
+
+        backend.set_foreground(2 if backend.foreground == 1 else 1)
+        target = backend.foreground
+        setattr(backend, flag, False)
+        resumed_at = loop.now
+        loop.advance(2)
+        seen = [at for at, hwnd in changes if hwnd == target and at >= resumed_at]
+        results.append((f"{flag}恢复后", bool(seen) and seen[0] - resumed_at <= MAX_INTERVAL / 1000,
+                        f"恢复后发现切换用时 {round((seen[0] - resumed_at) * 1000) if seen else None}ms"))
+    source.stop()
+    return results
+
+
+def check_caps_polling():
+    """没有键盘钩子时引擎轮询Caps Lock的退避、收紧和暂停"""
+    loop = VirtualLoop()
+    backend = make_backend(loop)
+    config = dict(DEFAULT_CONFIG, software_list=['CAXA'], metrics_interval=0, settle_time=0, keyboard_hook=False,
+                  foreground_backend='polling', poll_interval_min=MIN_INTERVAL, poll_interval_max=MAX_INTERVAL,
+                  caps_poll_interval=CAPS_INTERVAL)
+    engine = CapsLockEngine(backend, logging.getLogger("bench"), loop=loop)
+    engine._prepare(config, PolicyTable.from_config(config))
+    backend.caps_reads.clear()  # 不计引擎创建时读取的初始状态
+    engine._start_sources()
+    results = []
+
+    loop.advance(60)
+    idle_reads = len(backend.caps_reads)
+    gaps = gaps_ms(backend.caps_reads)[1:]  # 启动时判定初始前台窗口也读取了一次
+    results.append(("Caps Lock空闲时退避", gaps[:4] == [250, 500, 1000, 1000] and idle_reads <= 63,
+                    f"60秒内查询{idle_reads}次（固定{CAPS_INTERVAL}ms时为{60000 // CAPS_INTERVAL}次），前几次间隔 {gaps[:4]}"))
+
+    backend.caps_reads.clear()
+    backend.press_caps_lock()
+    pressed_at = loop.now
+    loop.advance(2)
+    gaps = gaps_ms(backend.caps_reads)
+    seen = engine.caps_lock_on == backend.caps_lock
+    results.append(("按下Caps Lock后收紧", seen and gaps[:1] == [CAPS_INTERVAL],
+                    f"首次查询在按键后{round((backend.caps_reads[0] - pressed_at) * 1000)}ms，之后的间隔 {gaps}"))
+
+    for flag in ('session_paused', 'display_off'):
+        backend.caps_reads.clear()
+        setattr(backend, flag, True)
+        loop.advance(30)
+        results.append((f"Caps Lock在{flag}时暂停", not backend.caps_reads and engine.stats()['caps_polling']['paused'],
+                        f"30秒内查询{len(backend.caps_reads)}次"))
+        setattr(backend, flag, False)
+        backend.press_caps_lock()
+        resumed_at = loop.now
+        loop.advance(2)
+        results.append((f"Caps Lock在{flag}恢复后", engine.caps_lock_on == backend.caps_lock,
+                        f"恢复后首次查询用时{round((backend.caps_reads[0] - resumed_at) * 1000) if backend.caps_reads else None}ms"))
+    engine.stop_foreground_source()
+    return results
+
+
+def main():
+    failed = 0
+    for name, ok, detail in check_foreground() + check_caps_polling():
+        failed += not ok
+        print(f"{'ok' if ok else 'FAIL':<6}{name:<24}{detail}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
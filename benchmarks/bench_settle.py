@@ -0,0 +1,113 @@
+"""切换稳定（settle_time）和临时窗口过滤的效果：注入的切换次数和切换延迟
+
+用FakeBackend和虚拟时钟回放几段脚本化的窗口序列，对比不同settle_time下注入了多少次切换、
+省去了多少次，以及最终停留的窗口从激活到Caps Lock切换的延迟（虚拟时间）。
+每段脚本都检查"每次稳定的切换最多注入一次切换"。
+
+用法: python benchmarks/bench_settle.py
+"""
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caps_lock_checker import (DEFAULT_CONFIG, WS_EX_TOOLWINDOW, CapsLockEngine, FakeBackend, PolicyTable,
+                               VirtualLoop)
+
+CAD = 1  # 目标软件，Caps Lock应打开
+TOOLTIP = 90
+PALETTE = 91
+OTHERS = (2, 3, 4, 5)
+
+
+def make_backend():
+    backend = FakeBackend()
+    backend.add_window(CAD, "part.cxp - CAXA 3D")
+    for hwnd in OTHERS:
+        backend.add_window(hwnd, f"window {hwnd} - 记事本")
+    backend.add_window(TOOLTIP, "", window_class='tooltips_class32')
+    backend.add_window(PALETTE, "图层", ex_style=WS_EX_TOOLWINDOW)
+    backend.set_foreground(OTHERS[0])
+    return backend
+
+
+def alt_tab_burst():
+    """从记事本快速Alt-Tab经过几个窗口（每个停留60ms），最后停在CAXA，然后再快速切回记事本"""
+    steps = [(hwnd, 60) for hwnd in (3, CAD, 4, 5, 2, CAD)]
+    steps.append((CAD, 2000))
+    steps += [(hwnd, 60) for hwnd in (4, CAD, 5)]
+    steps.append((2, 2000))
+    return steps * 5
+
+
+def tooltip_flashes():
+    """在CAXA中工作时提示框和浮动工具面板反复出现"""
+    steps = [(CAD, 500)]
+    for _ in range(20):
+        steps += [(TOOLTIP, 30), (CAD, 300), (PALETTE, 200), (CAD, 400)]
+    steps.append((2, 1000))
+    return steps
+
+
+def slow_switching():
+    """正常速度的切换（每个窗口停留1秒以上），不应被合并"""
+    return [(hwnd, 1200) for hwnd in (CAD, 2, CAD, 3, CAD, 4, 5, CAD)] * 3
+
+
+def run(steps, settle_time):
+    backend = make_backend()
+    loop = VirtualLoop()
+    config = dict(DEFAULT_CONFIG, software_list=['CAXA'], metrics_interval=0, settle_time=settle_time)
+    engine = CapsLockEngine(backend, logging.getLogger("bench"), loop=loop)
+    engine._prepare(config, PolicyTable.from_config(config))
+    engine._start_sources()
+
+    toggle_times = []
+    toggle = backend.toggle_caps_lock
+
+    def recording_toggle():
+        toggle_times.append(loop.now)
+        return toggle()
+
+    backend.toggle_caps_lock = recording_toggle
+
+    settled = []  # (激活时间, 离开时间, 窗口)：停留超过settle_time的非临时窗口
+    for hwnd, dwell_ms in steps:
+        activated = loop.now
+        backend.set_foreground(hwnd)
+        loop.advance(dwell_ms / 1000)
+        if hwnd not in (TOOLTIP, PALETTE) and dwell_ms > settle_time:
+            settled.append((activated, loop.now, hwnd))
+
+    latencies = []
+    worst = 0
+    for activated, left, hwnd in settled:
+        toggles = [t for t in toggle_times if activated <= t < left]
+        worst = max(worst, len(toggles))
+        if toggles:
+            latencies.append((toggles[0] - activated) * 1000)
+    assert worst <= 1, f"settle_time={settle_time}: 一次稳定的切换注入了{worst}次切换"
+    stats = engine.stats()
+    return {
+        'toggles': stats['toggles'],
+        'suppressed': stats['suppressed_toggles'],
+        'ignored': stats['ignored_windows'],
+        'latency_ms': max(latencies) if latencies else 0.0,
+        'final_ok': backend.caps_lock == (steps[-1][0] == CAD),
+    }
+
+
+def main():
+    print(f"{'scenario':<18}{'settle(ms)':>11}{'toggles':>9}{'suppressed':>12}{'ignored':>9}"
+          f"{'latency(ms)':>13}{'final':>7}")
+    for name, steps in (("alt-tab burst", alt_tab_burst()), ("tooltip flashes", tooltip_flashes()),
+                        ("slow switching", slow_switching())):
+        for settle_time in (0, 50, 100, 200):
+            result = run(steps, settle_time)
+            print(f"{name:<18}{settle_time:>11}{result['toggles']:>9}{result['suppressed']:>12}"
+                  f"{result['ignored']:>9}{result['latency_ms']:>13.0f}{'ok' if result['final_ok'] else 'WRONG':>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""共享的切换规则快照：编译/映射耗时、进程内内存，以及多进程在重新发布期间读取
+
+- single: 不同规模software_list下，进程内编译PolicyTable与映射已发布的PolicySnapshot的耗时、
+  Python堆内存（tracemalloc）、快照文件大小和单次标题匹配耗时
+- shared: 多个进程（spawn启动，相当于各个会话的实例）各自映射同一个快照目录并不断查找，
+  主进程同时按间隔发布新版本（旧版本按保留数量删除）；每个进程检查每个版本的查找结果，
+  有任何不一致或映射失败时退出码为1
+
+用法:
+    python benchmarks/bench_snapshot.py
+    python benchmarks/bench_snapshot.py --processes 40 --generations 50 --patterns 20000
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caps_lock_checker import DEFAULT_CONFIG, PolicySnapshot, PolicySnapshotStore, PolicyTable
+
+LOGGER = logging.getLogger("bench")
+
+
+def make_config(patterns, generation):
+    """每个版本多两条优先级更高的规则，其余规则的排名在各版本之间不变"""
+    return dict(DEFAULT_CONFIG, software_list=patterns, process_list=['caxa.exe', 'sldworks.exe'],
+                rules=[f"on, 100, marker-{generation}", f"keep, 50, proc:gen{generation}.exe",
+                       "off, 10, i:re:^notepad"])
+
+
+def make_patterns(count, rng):
+    return [f"{''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(8))} {2000 + i % 30}"
+            for i in range(count)]
+
+
+def make_titles(patterns, rng, count=500):
+    titles = [f"{rng.choice(patterns)} - part{i}.cxp" for i in range(count // 2)]
+    titles += [f"无标题 - 记事本 {i}" for i in range(count // 4)]
+    titles += [f"Notepad++ {i}" for i in range(count - len(titles))]
+    return titles
+
+
+def per_call_us(func, items, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - started)
+    return round(best / len(items) * 1e6, 2)
+
+
+def heap_bytes(factory):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = factory()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, after - before
+
+
+def bench_single(rng, counts):
+    results = {}
+    for count in counts:
+        patterns = make_patterns(count, rng)
+        config = make_config(patterns, 1)
+        titles = make_titles(patterns, rng)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = PolicySnapshotStore(tmp, LOGGER)
+            started = time.perf_counter()
+            store.load(config)
+            publish_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            table = PolicyTable.from_config(config)
+            compile_ms = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            snapshot = PolicySnapshot.open(store.current.path)
+            open_ms = (time.perf_counter() - started) * 1000
+
+            del table
+            table, table_heap = heap_bytes(lambda: PolicyTable.from_config(config))
+            snapshot, snapshot_heap = heap_bytes(lambda: PolicySnapshot.open(store.current.path))
+            for title in titles:
+                assert snapshot.title_rank(title) == table.title_rank(title), title
+            results[f"software_list_{count}"] = {
+                'compile_ms': round(compile_ms, 2),
+                'compile_and_publish_ms': round(publish_ms, 2),
+                'map_snapshot_ms': round(open_ms, 2),
+                'table_heap_kb': round(table_heap / 1024, 1),
+                'snapshot_heap_kb': round(snapshot_heap / 1024, 1),
+                'snapshot_file_kb': round(snapshot.size / 1024, 1),
+                'title_rank_table_us': per_call_us(table.title_rank, titles),
+                'title_rank_snapshot_us': per_call_us(snapshot.title_rank, titles),
+            }
+    return results
+
+
+def private_memory_kb():
+    """Linux上本进程的私有内存和按比例分摊的内存(kB)，其他系统返回None"""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f.readlines()[1:])  # 第一行是地址范围
+    except OSError:
+        return None
+    private = sum(int(fields.get(name, '0 kB').split()[0]) for name in ('Private_Clean', 'Private_Dirty'))
+    return {'private_kb': private, 'pss_kb': int(fields.get('Pss', '0 kB').split()[0])}
+
+
+def reader(directory, samples, expected, stop, results):
+    """在子进程中不断映射当前版本并查找，检查每个版本的结果，直到stop置位"""
+    store = PolicySnapshotStore(directory, LOGGER)
+    generations = set()
+    lookups = errors = 0
+    first_error = None
+    snapshot = None
+    while not stop.is_set():
+        time.sleep(0.001)  # 让出CPU，避免读取进程挤占发布进程
+        if snapshot is None or store.changed():
+            snapshot = store.open_current() or snapshot
+            if snapshot is None:
+                continue
+            generations.add(snapshot.generation)
+        try:
+            marker = snapshot.condition(0)
+            generation = int(marker.rsplit('-', 1)[1])
+            checks = [
+                (snapshot.title_rank(f"x {marker} y"), 0),
+                (snapshot.action(0), 'on'),
+                (snapshot.process_rank(f"gen{generation}.exe"), 1),
+                (snapshot.action(1), 'keep'),
+            ]
+            checks += [(snapshot.title_rank(title), rank) for title, rank in zip(samples, expected)]
+            lookups += len(checks)
+            for got, want in checks:
+                if got != want:
+                    errors += 1
+                    first_error = first_error or f"第{snapshot.generation}版: 得到{got}，应为{want}"
+        except Exception as e:  # 映射的内存无效等
+            errors += 1
+            first_error = first_error or repr(e)
+    results.put({'generations': len(generations), 'lookups': lookups, 'errors': errors, 'first_error': first_error,
+                 'memory': private_memory_kb()})
+
+
+def bench_shared(rng, processes, generations, interval, pattern_count):
+    patterns = make_patterns(pattern_count, rng)
+    samples = make_titles(patterns, rng, 50) + ["marker-0 不存在的版本"]
+    table = PolicyTable.from_config(make_config(patterns, 1))
+    expected = [table.title_rank(title) for title in samples]
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        publisher = PolicySnapshotStore(tmp, LOGGER)
+        publisher.load(make_config(patterns, 1))
+        results = context.Queue()
+        stop = context.Event()
+        workers = [context.Process(target=reader, args=(tmp, samples, expected, stop, results))
+                   for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        publish_ms = []
+        for generation in range(2, generations + 1):
+            time.sleep(interval)
+            started = time.perf_counter()
+            publisher.load(make_config(patterns, generation))
+            publish_ms.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.5)
+        stop.set()
+        reports = [results.get(timeout=60) for _ in workers]
+        for worker in workers:
+            worker.join()
+        files_left = len([name for name in os.listdir(tmp) if name.endswith('.bin')])
+
+    errors = sum(report['errors'] for report in reports)
+    memory = [report['memory'] for report in reports if report['memory']]
+    return {
+        'processes': processes,
+        'generations_published': generations,
+        'publish_ms_max': round(max(publish_ms), 2) if publish_ms else None,
+        'snapshot_files_left': files_left,
+        'min_generations_seen': min(report['generations'] for report in reports),
+        'lookups': sum(report['lookups'] for report in reports),
+        'errors': errors,
+        'first_error': next((report['first_error'] for report in reports if report['first_error']), None),
+        'reader_private_kb_avg': round(sum(m['private_kb'] for m in memory) / len(memory)) if memory else None,
+        'reader_pss_kb_avg': round(sum(m['pss_kb'] for m in memory) / len(memory)) if memory else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共享的切换规则快照基准")
+    parser.add_argument('--only', nargs='+', choices=('single', 'shared'), default=('single', 'shared'))
+    parser.add_argument('--processes', type=int, default=16)
+    parser.add_argument('--generations', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.1, help="发布新版本的间隔(秒)")
+    parser.add_argument('--patterns', type=int, default=10000, help="shared中software_list的规模")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    report = {}
+    if 'single' in args.only:
+        report['single'] = bench_single(rng, (100, 10000, 100000))
+    if 'shared' in args.only:
+        report['shared'] = bench_shared(rng, args.processes, args.generations, args.interval, args.patterns)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if report.get('shared', {}).get('errors') else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+"""基准测试和长时间模拟运行（soak）套件，结果以JSON输出，便于不同版本之间对比
+
+全部使用FakeBackend和VirtualLoop，可在Linux上运行：
+- tick: 一次窗口切换判断（on_foreground_change）和一次Caps Lock核对（check_caps_lock）的耗时；
+  匹配缓存冷热两种情况使用完全相同的切换序列
+- config: 不同规模software_list下config.txt的解析（无缓存/磁盘缓存和已发布的规则快照/未变化）耗时
+- ui: 界面取状态刷新（drain_engine_states）、记录窗口位置和写回配置文件（save_window_position）的耗时，
+  界面在隐藏的Tk根窗口上按正常流程创建，没有显示器时跳过
+- soak: 用虚拟时钟模拟数十小时内上百万次窗口切换（含窗口销毁、进程退出和手动按键），
+  检查内存占用和每次切换的CPU时间保持平稳、各缓存不超过容量且定期清理了已销毁的窗口和已退出的进程，
+  不满足时退出码为1
+
+用法:
+    python benchmarks/bench_suite.py                      # 全部，结果输出到标准输出
+    python benchmarks/bench_suite.py --only tick config   # 只运行部分
+    python benchmarks/bench_suite.py --soak-switches 200000 --output result.json
+"""
+import argparse
+import gc
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caps_lock_checker import (DECISION_CACHE_PRUNE_INTERVAL, DEFAULT_CONFIG, CapsLockChecker, CapsLockEngine,
+                               ConfigStore, FakeBackend, GeometryPersister, PolicyTable, VirtualLoop, load_tkinter)
+
+LOGGER = logging.getLogger("bench")
+LOGGER.setLevel(logging.ERROR)
+
+
+def per_call(func, number):
+    """返回func平均每次调用的耗时(us)，取3轮中最快的一轮"""
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / number * 1e6, 3)
+
+
+def make_patterns(count, rng):
+    return [f"{''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(8))} {2000 + i % 30}"
+            for i in range(count)]
+
+
+def make_engine(software_list, process_list=(), settle_time=0, **overrides):
+    backend = FakeBackend()
+    loop = VirtualLoop()
+    config = dict(DEFAULT_CONFIG, software_list=list(software_list), process_list=list(process_list),
+                  metrics_interval=0, settle_time=settle_time, **overrides)
+    engine = CapsLockEngine(backend, LOGGER, loop=loop)
+    engine._prepare(config, PolicyTable.from_config(config))
+    engine._start_sources()
+    return backend, loop, engine
+
+
+def bench_tick(rng):
+    """一次窗口切换判断和一次状态核对的耗时"""
+    results = {}
+    for count in (10, 1000, 10000):
+        patterns = make_patterns(count, rng)
+
+        def setup(**overrides):
+            backend, loop, engine = make_engine(patterns, ['target.exe'], **overrides)
+            backend.add_window(1, f"part.dwg - {patterns[-1]}", 100)
+            backend.add_window(2, "notes.txt - 记事本", 200)
+            backend.add_process(100, r"C:\Program Files\Vendor\cad.exe")
+            backend.add_process(200, r"C:\Windows\notepad.exe")
+            backend.add_window(3, "drawing - Target", 300)
+            backend.add_process(300, r"C:\Tools\target.exe")
+            return engine
+
+        def switches(engine, hwnds):
+            # 在两个窗口之间来回切换，每次都切换Caps Lock；缓存冷热两种情况的切换序列完全相同
+            hwnds = itertools.cycle(hwnds)
+            return lambda: engine.on_foreground_change(next(hwnds))
+
+        warm = setup()
+        # 容量为1时两个窗口互相淘汰，每次切换都要完整匹配标题
+        cold = setup(decision_cache_size=1)
+        # 进程名命中的窗口与标题缓存命中的窗口交替，与switch_cached对比即是省去标题读取和匹配的效果
+        results[f"patterns_{count}"] = {
+            'switch_cached_us': per_call(switches(warm, (1, 2)), 20000),
+            'switch_uncached_us': per_call(switches(cold, (1, 2)), 5000),
+            'switch_process_match_us': per_call(switches(setup(), (3, 2)), 20000),
+            'check_caps_lock_us': per_call(warm.check_caps_lock, 20000),
+        }
+    return results
+
+
+def bench_config(rng):
+    """不同规模software_list下读取配置文件的耗时"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in (10, 1000, 10000, 100000):
+            path = os.path.join(tmp, f"config_{count}.txt")
+            cache_path = os.path.join(tmp, f"cache_{count}.json")
+            store = ConfigStore(path, cache_path, LOGGER, os.path.join(tmp, f"snapshot_{count}"))
+            config = dict(DEFAULT_CONFIG, software_list=make_patterns(count, rng), policy_snapshot=True)
+            store.write_config_file(config)
+
+            def parse_cold():
+                # 没有解析缓存和规则快照：解析、编译并发布快照
+                store.loaded_signature = None
+                for stale in (cache_path, store.snapshots.pointer_path):
+                    if os.path.exists(stale):
+                        os.remove(stale)
+                store.snapshots.current = None
+                store.load()
+
+            def parse_cached():
+                store.loaded_signature = None
+                store.load()
+
+            number = max(1, 2000 // count)
+            results[f"software_list_{count}"] = {
+                'file_bytes': os.path.getsize(path),
+                'load_no_cache_ms': round(per_call(parse_cold, number) / 1000, 3),
+                'load_disk_cache_ms': round(per_call(parse_cached, number) / 1000, 3),
+                'load_unchanged_us': per_call(store.load, 2000),
+                'changed_check_us': per_call(store.changed, 2000),
+            }
+    return results
+
+
+def make_app():
+    """在隐藏的Tk根窗口上按正常流程创建界面（后端为FakeBackend），没有显示器时返回None
+
+    配置文件和日志写在当前目录，调用前应切换到临时目录。
+    """
+    try:
+        root = load_tkinter().Tk()
+    except Exception:
+        return None
+    root.withdraw()
+    return CapsLockChecker(root, backend=FakeBackend())
+
+
+def bench_ui():
+    """界面状态刷新和窗口位置保存的耗时"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            app = make_app()
+            if app is None:
+                return {'skipped': "没有显示器，无法创建Tk根窗口"}
+            try:
+                return measure_ui(app)
+            finally:
+                app.close_application()
+        finally:
+            os.chdir(cwd)
+
+
+def measure_ui(app):
+    state = [False]
+
+    def drain_one():
+        state[0] = not state[0]
+        app.engine.states.put({'type': 'caps', 'caps_lock_on': state[0], 'hwnd': 1})
+        app.drain_engine_states()
+
+    def drain_burst():
+        # 界面卡住期间积压了100条状态，恢复后只按最新状态刷新一次
+        for i in range(100):
+            app.engine.states.put({'type': 'caps', 'caps_lock_on': bool(i % 2), 'hwnd': 1})
+        app.drain_engine_states()
+
+    results = {
+        'drain_one_state_us': per_call(drain_one, 20000),
+        'drain_burst_100_us': per_call(drain_burst, 2000),
+        'render_unchanged_us': per_call(app.update_status, 50000),
+    }
+    counter = app.renderer.counter
+    calls = counter.total
+    for _ in range(1000):
+        app.update_status()
+    results['render_unchanged_tk_calls'] = counter.total - calls
+
+    # 延迟写回的定时器设得很长，只测量记录几何信息本身
+    app.geometry_persister.flush()
+    app.geometry_persister = GeometryPersister(app.config_store, delay=60000, logger=LOGGER)
+    results['record_geometry_us'] = per_call(app.record_geometry, 20000)
+    app.geometry_persister.flush()
+
+    def save():
+        # 新的写回对象不知道文件中已有的位置，每次都会写入配置文件
+        app.geometry_persister = GeometryPersister(app.config_store, delay=60000, logger=LOGGER)
+        app.save_window_position()
+
+    results['save_window_position_ms'] = round(per_call(save, 50) / 1000, 3)
+    app.geometry_persister = GeometryPersister(app.config_store, logger=LOGGER)
+    return results
+
+
+def bench_soak(rng, switches, chunks=20, switch_interval_ms=200):
+    """模拟长时间运行，检查内存和每次切换的CPU时间是否保持平稳"""
+    patterns = make_patterns(1000, rng)
+    # 使用默认的settle_time，稳定和未稳定就被取代的切换都会出现
+    backend, loop, engine = make_engine(patterns[:500], ['target.exe'], DEFAULT_CONFIG['settle_time'])
+    live = []
+    next_hwnd = 1
+    next_pid = 1000
+
+    def open_window():
+        nonlocal next_hwnd, next_pid
+        hwnd, pid = next_hwnd, next_pid
+        next_hwnd += 1
+        next_pid += 1
+        if rng.random() < 0.3:
+            title = f"{hwnd}.dwg - {rng.choice(patterns)}"
+        else:
+            title = f"{hwnd}.txt - 记事本"
+        image = r"C:\Tools\target.exe" if rng.random() < 0.1 else r"C:\Windows\notepad.exe"
+        backend.add_window(hwnd, title, pid)
+        backend.add_process(pid, image)
+        live.append(hwnd)
+
+    def close_window():
+        hwnd = live.pop(rng.randrange(len(live)))
+        backend.exit_process(backend.get_window_pid(hwnd))
+        backend.close_window(hwnd)
+
+    for _ in range(50):
+        open_window()
+
+    chunk_size = max(1, switches // chunks)
+    samples = []
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for chunk in range(chunks):
+            cpu_start = time.process_time()
+            for i in range(chunk_size):
+                r = rng.random()
+                if r < 0.01:
+                    close_window()
+                    open_window()
+                elif r < 0.015:
+                    backend.press_caps_lock()
+                elif r < 0.02:
+                    # 窗口标题变化（如切换文档）
+                    hwnd = rng.choice(live)
+                    backend.windows[hwnd] = f"{rng.random():.6f} - {rng.choice(patterns)}"
+                backend.set_foreground(rng.choice(live))
+                # 间隔按指数分布：多数切换停留较久，也有快速连续的Alt-Tab
+                loop.advance(rng.expovariate(1000 / switch_interval_ms))
+            cpu = time.process_time() - cpu_start
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+            samples.append({
+                'chunk': chunk,
+                'virtual_hours': round(loop.now / 3600, 3),
+                'cpu_us_per_switch': round(cpu / chunk_size * 1e6, 3),
+                'traced_bytes': current,
+                'decision_cache_size': len(engine.decision_cache),
+                'process_cache_size': len(engine.process_cache),
+                'manual_overrides': len(engine.manual_overrides),
+            })
+    finally:
+        tracemalloc.stop()
+
+    # 停止切换，等定期清理运行一次：之后缓存中不应再有已销毁的窗口和已退出的进程
+    loop.advance(DECISION_CACHE_PRUNE_INTERVAL / 1000 + 1)
+    dead_windows = engine.decision_cache.prune(backend.is_window)
+    dead_processes = engine.process_cache.prune()
+    decision_stats = engine.decision_cache.stats()
+    process_stats = engine.process_cache.stats()
+    bounded = all(s['decision_cache_size'] <= decision_stats['max_size']
+                  and s['process_cache_size'] <= process_stats['max_size']
+                  and s['manual_overrides'] <= engine.config['manual_override_size'] for s in samples)
+
+    # 前20%视为预热（缓存填满），之后内存增长和CPU时间变化超过阈值视为不平稳
+    warm = samples[max(1, chunks // 5):]
+    memory_growth = warm[-1]['traced_bytes'] - warm[0]['traced_bytes']
+    head = statistics.median(s['cpu_us_per_switch'] for s in warm[:3])
+    tail = statistics.median(s['cpu_us_per_switch'] for s in warm[-3:])
+    memory_limit = max(256 * 1024, warm[0]['traced_bytes'] // 20)
+    stats = engine.stats()
+    return {
+        'switches': chunk_size * chunks,
+        'virtual_hours': samples[-1]['virtual_hours'],
+        'engine_switches': stats['switches'],
+        'engine_toggles': stats['toggles'],
+        'engine_suppressed_toggles': stats['suppressed_toggles'],
+        'memory_growth_bytes': memory_growth,
+        'memory_growth_limit_bytes': memory_limit,
+        'cpu_drift_ratio': round(tail / head, 3) if head else None,
+        'memory_flat': memory_growth <= memory_limit,
+        'cpu_flat': tail <= head * 1.5,
+        'decision_cache': decision_stats,
+        'process_cache': process_stats,
+        'dead_windows_left': dead_windows,
+        'dead_processes_left': dead_processes,
+        # 窗口和进程不断更替，两个缓存都应发生过淘汰，且始终不超过容量
+        'caches_bounded': bounded and decision_stats['evictions'] > 0 and process_stats['evictions'] > 0,
+        'caches_pruned': dead_windows == 0 and dead_processes == 0,
+        'samples': samples,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=('tick', 'config', 'ui', 'soak'))
+    parser.add_argument('--soak-switches', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="结果写入文件（默认输出到标准输出）")
+    args = parser.parse_args(argv)
+
+    sections = args.only or ('tick', 'config', 'ui', 'soak')
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+    }
+    for name in sections:
+        rng = random.Random(args.seed)
+        started = time.perf_counter()
+        if name == 'tick':
+            report['tick'] = bench_tick(rng)
+        elif name == 'config':
+            report['config'] = bench_config(rng)
+        elif name == 'ui':
+            report['ui'] = bench_ui()
+        else:
+            report['soak'] = bench_soak(rng, args.soak_switches)
+        print(f"{name}: {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    soak = report.get('soak')
+    checks = ('memory_flat', 'cpu_flat', 'caches_bounded', 'caches_pruned')
+    return 1 if soak and not all(soak[check] for check in checks) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
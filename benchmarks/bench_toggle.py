@@ -0,0 +1,115 @@
+"""注入切换的确认和重试：切换被吞掉、被拒绝和GetKeyState延迟反映新状态时的结果
+
+用FakeBackend和虚拟时钟，从记事本切换到CAXA一次，检查最终的Caps Lock状态、注入次数和统计：
+- drop: 前几次注入"成功"但状态不变（被其他钩子吞掉，本程序的键盘钩子看不到），应重新注入直到生效
+- block: 前几次注入被拒绝（SendInput返回0），应计入inject_blocked并重新注入
+- lag: GetKeyState在注入后一段时间才反映新状态；键盘钩子已看到注入的按键，即使延迟超过confirm_timeout
+  也不能重新注入，否则会多切换一次，把状态又切回去
+- key: 注入的切换尚未确认时用户按下Caps Lock，最终应为关闭，界面和手动选择都记为关闭
+
+默认配置和confirm_timeout=50下任一检查不满足（包括多注入一次）时退出码为1。
+
+用法: python benchmarks/bench_toggle.py
+"""
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caps_lock_checker import DEFAULT_CONFIG, CapsLockEngine, FakeBackend, PolicyTable, VirtualLoop
+
+LOGGER = logging.getLogger("bench")
+LOGGER.setLevel(logging.ERROR)  # 确认失败的警告是预期结果
+
+
+class LaggingBackend(FakeBackend):
+    """get_caps_lock_state返回lag毫秒之前的状态"""
+
+    def __init__(self, loop, lag=0):
+        super().__init__()
+        self.loop = loop
+        self.lag = lag / 1000
+        self.history = [(float('-inf'), False)]  # (时间, 状态)
+
+    def toggle_caps_lock(self):
+        sent = super().toggle_caps_lock()
+        self._record()
+        return sent
+
+    def press_caps_lock(self):
+        super().press_caps_lock()
+        self._record()
+
+    def _record(self):
+        if self.caps_lock != self.history[-1][1]:
+            self.history.append((self.loop.now, self.caps_lock))
+
+    def get_caps_lock_state(self):
+        visible = self.loop.now - self.lag
+        return [state for at, state in self.history if at <= visible][-1]
+
+
+def run(lag=0, drop=0, block=0, press_at=None, **overrides):
+    loop = VirtualLoop()
+    backend = LaggingBackend(loop, lag)
+    backend.add_window(1, "part.cxp - CAXA 3D")
+    backend.add_window(2, "notes.txt - 记事本")
+    backend.set_foreground(2)
+    config = dict(DEFAULT_CONFIG, software_list=['CAXA'], metrics_interval=0, settle_time=0, **overrides)
+    engine = CapsLockEngine(backend, LOGGER, loop=loop)
+    engine._prepare(config, PolicyTable.from_config(config))
+    engine._start_sources()
+    loop.advance(1)
+    backend.drop_toggles = drop
+    backend.block_toggles = block
+    backend.set_foreground(1)
+    if press_at is not None:
+        loop.advance(press_at / 1000)
+        backend.press_caps_lock()
+    loop.advance(5)
+    stats = engine.stats()
+    return {
+        'caps_lock': backend.caps_lock,
+        'shown': engine.caps_lock_on,
+        'override': engine.manual_overrides.get(1),
+        'injected': backend.toggle_count,
+        'retries': stats['toggle_retries'],
+        'by_hook': stats['confirmed_by_hook'],
+        'blocked': stats['inject_blocked'],
+        'failures': stats['confirm_failures'],
+    }
+
+
+def main():
+    retries = DEFAULT_CONFIG['toggle_retries']
+    # (名称, 参数, 期望的最终状态, 期望的注入次数, 期望的确认失败次数)
+    cases = [
+        ("normal", {}, True, 1, 0),
+        ("drop 1", {'drop': 1}, True, 2, 0),
+        (f"drop {retries}", {'drop': retries}, True, retries + 1, 0),
+        (f"drop {retries + 1}", {'drop': retries + 1}, False, retries + 1, 1),
+        ("block 1", {'block': 1}, True, 2, 0),
+        (f"block {retries + 1}", {'block': retries + 1}, False, retries + 1, 1),
+    ]
+    cases += [(f"lag {lag}ms", {'lag': lag}, True, 1, 0) for lag in (10, 50, 100, 150)]
+    cases.append(("key at 5ms", {'lag': 20, 'press_at': 5}, False, 1, 0))
+    # 延迟超过confirm_timeout：按时间判断会重新注入，键盘钩子看到了注入的按键则不应重新注入
+    cases += [(f"timeout 50 lag {lag}ms", {'lag': lag, 'confirm_timeout': 50}, True, 1, 0) for lag in (10, 50, 100, 150)]
+
+    failed = 0
+    print(f"{'case':<22}{'caps':>6}{'shown':>7}{'injected':>10}{'retries':>9}{'by_hook':>9}{'blocked':>9}{'failures':>10}")
+    for name, params, caps_lock, injected, failures in cases:
+        result = run(**params)
+        ok = (result['caps_lock'] == caps_lock and result['shown'] == caps_lock
+              and result['injected'] == injected and result['failures'] == failures
+              and result['override'] in (None if 'press_at' not in params else caps_lock,))
+        failed += not ok
+        print(f"{name:<22}{result['caps_lock']!s:>6}{result['shown']!s:>7}{result['injected']:>10}"
+              f"{result['retries']:>9}{result['by_hook']:>9}{result['blocked']:>9}{result['failures']:>10}"
+              f"  {'ok' if ok else 'FAIL'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
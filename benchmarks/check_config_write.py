@@ -0,0 +1,116 @@
+"""检查写回窗口位置时对配置文件的改写（ConfigStore.update_values）和几何字符串的解析（parse_geometry）
+
+- 只改写指定的键：注释行、行尾注释、未知的键和其他配置项原样保留，同一个键出现多次时全部改写，缺少的键追加在末尾
+- 先写临时文件再替换：写入中途失败时原文件不变，成功后不留下临时文件
+- 自己写入后不需要重新解析：变更检测认为文件未变化，已加载的配置同步更新
+- parse_geometry：多显示器时窗口在主显示器左侧或上方，Tk返回"+-x+-y"形式的负坐标
+
+任一检查不满足时退出码为1。
+
+用法: python benchmarks/check_config_write.py
+"""
+import logging
+import os
+import sys
+import tempfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caps_lock_checker import ConfigStore, parse_geometry
+
+LOGGER = logging.getLogger("bench")
+LOGGER.setLevel(logging.ERROR)  # 写入失败的错误日志是预期结果
+
+CONFIG_TEXT = """# 窗口设置
+window_width = 250          ; 窗口宽度
+window_x = 100
+future_option = 42          ; 新版本的配置项，旧版本不认识
+window_x = 120
+software_list = CAXA, ^AutoCAD
+#window_y = 5
+"""
+
+EXPECTED_TEXT = """# 窗口设置
+window_width = 300          ; 窗口宽度
+window_x = -1920
+future_option = 42          ; 新版本的配置项，旧版本不认识
+window_x = -1920
+software_list = CAXA, ^AutoCAD
+#window_y = 5
+window_y = -40
+"""
+
+
+def make_store(tmp):
+    path = os.path.join(tmp, "config.txt")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(CONFIG_TEXT)
+    return ConfigStore(path, os.path.join(tmp, "cache.json"), LOGGER, os.path.join(tmp, "snapshot"))
+
+
+def read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def check_update_values():
+    """返回(检查名, 是否通过, 说明)列表"""
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        store = make_store(tmp)
+        store.load()
+        store.update_values({'window_width': 300, 'window_x': -1920, 'window_y': -40})
+        text = read(store.path)
+        results.append(("保留注释和未知的键", text == EXPECTED_TEXT, f"改写后的内容:\n{text}" if text != EXPECTED_TEXT else ""))
+        left = [name for name in os.listdir(tmp) if name.endswith('.tmp')]
+        results.append(("不留下临时文件", not left, f"剩余 {left}" if left else ""))
+        results.append(("自己写入后不重新解析", not store.changed() and store.config['window_x'] == -1920,
+                        f"changed={store.changed()} window_x={store.config['window_x']}"))
+        reparsed, _ = ConfigStore(store.path, os.path.join(tmp, "other.json"), LOGGER,
+                                  os.path.join(tmp, "snapshot")).load()
+        values = {key: reparsed[key] for key in ('window_width', 'window_x', 'window_y', 'software_list')}
+        want = {'window_width': 300, 'window_x': -1920, 'window_y': -40, 'software_list': ['CAXA', '^AutoCAD']}
+        results.append(("改写后重新读取", values == want, f"{values}"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = make_store(tmp)
+        store.load()
+        failed = False
+        with mock.patch('os.fsync', side_effect=OSError("磁盘已满")):
+            try:
+                store.update_values({'window_x': 5})
+            except OSError:
+                failed = True
+        text = read(store.path)
+        results.append(("写入中途失败时原文件不变", failed and text == CONFIG_TEXT,
+                        f"抛出异常={failed}，文件{'未变' if text == CONFIG_TEXT else '被改动'}"))
+    return results
+
+
+def check_parse_geometry():
+    cases = [
+        ("250x150+100+200", (250, 150, 100, 200)),
+        ("250x150+-1920+-40", (250, 150, -1920, -40)),
+        ("250x150+0+-1", (250, 150, 0, -1)),
+        ("250x150", None),
+        ("+100+200", None),
+        ("250x150+1x+2", None),
+    ]
+    results = []
+    for text, want in cases:
+        got = parse_geometry(text)
+        results.append((f"parse_geometry {text}", got == want, f"得到{got}，应为{want}" if got != want else ""))
+    return results
+
+
+def main():
+    failed = 0
+    for name, ok, detail in check_update_values() + check_parse_geometry():
+        failed += not ok
+        print(f"{'ok' if ok else 'FAIL':<6}{name:<32}{detail}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
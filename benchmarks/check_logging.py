@@ -0,0 +1,133 @@
+"""检查日志的重复消息抑制（RateLimitFilter）和按时间轮转（AgeRotatingFileHandler），时间用假时钟推进
+
+- 相同的消息interval秒内只记录一次，之后的第一条附上省略的次数；级别或内容不同的消息互不影响；
+  记录的消息种类超过max_keys时清空重新计数
+- 日志文件打开超过max_age后下一条记录触发轮转，超过max_bytes同样轮转，最多保留backup_count个旧文件
+- 轮转时删除超过保留天数的旧日志（包括旧版本按天生成的log_*.txt），不删除其他文件
+
+任一检查不满足时退出码为1。
+
+用法: python benchmarks/check_logging.py
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caps_lock_checker import AgeRotatingFileHandler, RateLimitFilter
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_record(message, level=logging.WARNING):
+    return logging.LogRecord("check", level, __file__, 0, message, None, None)
+
+
+def check_rate_limit():
+    """返回(检查名, 是否通过, 说明)列表"""
+    results = []
+    clock = FakeClock()
+    limiter = RateLimitFilter(interval=10, max_keys=3, clock=clock)
+
+    passed = [limiter.filter(make_record("切换失败")) for _ in range(5)]
+    results.append(("interval内只记录一次", passed == [True, False, False, False, False], f"{passed}"))
+
+    other = [limiter.filter(make_record("切换失败", logging.ERROR)), limiter.filter(make_record("读取失败"))]
+    results.append(("级别或内容不同互不影响", other == [True, True], f"{other}"))
+
+    clock.now += 9.9
+    still = limiter.filter(make_record("切换失败"))
+    clock.now += 0.1
+    record = make_record("切换失败")
+    after = limiter.filter(record)
+    message = record.getMessage()
+    results.append(("超过interval后附上省略次数", not still and after and message == "切换失败（此前重复5次已省略）",
+                    f"9.9秒时{'记录' if still else '省略'}，10秒时{'记录' if after else '省略'}: {message}"))
+
+    record = make_record("切换失败")
+    clock.now += 10
+    limiter.filter(record)
+    results.append(("没有省略时不附加说明", record.getMessage() == "切换失败", record.getMessage()))
+
+    # 已有3种消息，第4种写入前清空，之前被抑制的消息可以立即再次记录
+    limiter.filter(make_record("新消息"))
+    again = limiter.filter(make_record("读取失败"))
+    results.append(("超过max_keys时清空", again and len(limiter._seen) <= 3, f"记录={again} 种类={len(limiter._seen)}"))
+    return results
+
+
+def listing(folder):
+    return sorted(os.listdir(folder))
+
+
+def check_rotation():
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        clock = FakeClock(time.time())
+        path = os.path.join(tmp, "app.log")
+        day = 86400
+        # 保留天数以外的旧日志、旧版本按天生成的日志，以及不相关的文件
+        for name, age_days in (("app.log.4", 40), ("log_20200101.txt", 40), ("log_recent.txt", 1), ("notes.txt", 40)):
+            old = os.path.join(tmp, name)
+            with open(old, 'w', encoding='utf-8') as f:
+                f.write("old\n")
+            os.utime(old, (clock.now - age_days * day, clock.now - age_days * day))
+
+        handler = AgeRotatingFileHandler(path, max_bytes=200, backup_count=2, max_age=day, retention_days=30, clock=clock)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        files = listing(tmp)
+        results.append(("打开时删除过期日志", files == ["log_recent.txt", "notes.txt"], f"{files}"))
+
+        handler.handle(make_record("第一天"))
+        clock.now += day - 1
+        handler.handle(make_record("第一天晚些时候"))
+        results.append(("max_age之前不轮转", listing(tmp) == ["app.log", "log_recent.txt", "notes.txt"],
+                        f"{listing(tmp)}"))
+
+        clock.now += 1
+        handler.handle(make_record("第二天"))
+        with open(path, encoding='utf-8') as f:
+            current = f.read()
+        with open(path + ".1", encoding='utf-8') as f:
+            previous = f.read()
+        results.append(("超过max_age后轮转", current == "第二天\n" and previous == "第一天\n第一天晚些时候\n",
+                        f"当前: {current!r} 上一个: {previous!r}"))
+
+        # RotatingFileHandler按字符数估算长度，用ASCII消息检查文件大小
+        for i in range(20):
+            handler.handle(make_record(f"day two, longer message number {i}"))
+        backups = [name for name in listing(tmp) if name.startswith("app.log.")]
+        size = os.path.getsize(path)
+        results.append(("超过max_bytes后轮转且只保留backup_count个", backups == ["app.log.1", "app.log.2"] and size <= 200,
+                        f"旧文件 {backups}，当前文件{size}字节"))
+
+        # 31天后轮转：当前文件和app.log.1在前一天还写过，log_recent.txt已超过保留天数
+        clock.now += 31 * day
+        for name in ("app.log", "app.log.1"):
+            os.utime(os.path.join(tmp, name), (clock.now - day, clock.now - day))
+        handler.handle(make_record("一个月后"))
+        files = listing(tmp)
+        results.append(("轮转时删除过期日志", files == ["app.log", "app.log.1", "app.log.2", "notes.txt"], f"{files}"))
+        handler.close()
+    return results
+
+
+def main():
+    failed = 0
+    for name, ok, detail in check_rate_limit() + check_rotation():
+        failed += not ok
+        print(f"{'ok' if ok else 'FAIL':<6}{name:<36}{detail}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""回放随附的诊断记录，检查切换决定与记录一致
+
+fixtures/sample.trace是用FakeBackend和虚拟时钟录制的两次运行：快速Alt-Tab、提示框和浮动面板、
+按进程名和keep规则匹配的窗口，以及用户在目标软件中手动关闭Caps Lock。按CONFIG回放后，
+每个前台窗口事件的切换次数都应与记录一致，有不一致时退出码为1。
+
+切换逻辑有意改变了决定时，用--regenerate重新录制并提交新的记录文件。
+
+用法:
+    python benchmarks/check_replay.py
+    python benchmarks/check_replay.py --regenerate
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caps_lock_checker import (DEFAULT_CONFIG, WS_EX_TOOLWINDOW, CapsLockEngine, FakeBackend, PolicyTable,
+                               TraceRecorder, VirtualLoop, replay_trace)
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'sample.trace')
+CONFIG = dict(DEFAULT_CONFIG, software_list=['CAXA'], process_list=['sldworks.exe'],
+              rules=['keep, 20, i:记事本'], metrics_interval=0, settle_time=100)
+LOGGER = logging.getLogger("bench")
+
+CAD, SOLIDWORKS, NOTEPAD, BROWSER, TOOLTIP, PALETTE = 1, 2, 3, 4, 90, 91
+
+
+class VirtualTraceRecorder(TraceRecorder):
+    """以虚拟时钟的时间记录"""
+
+    def __init__(self, path, loop):
+        self.loop = loop
+        super().__init__(path)
+
+    def _elapsed(self, event_time=None):
+        return self.loop.now
+
+
+def record_session(path, steps):
+    loop = VirtualLoop()
+    backend = FakeBackend()
+    backend.add_window(CAD, "part.cxp - CAXA 3D", pid=100)
+    backend.add_window(SOLIDWORKS, "assembly.sldasm", pid=200)
+    backend.add_window(NOTEPAD, "notes.txt - 记事本", pid=300)
+    backend.add_window(BROWSER, "新标签页 - Browser", pid=400)
+    backend.add_window(TOOLTIP, "", pid=100, window_class='tooltips_class32')
+    backend.add_window(PALETTE, "图层", pid=100, ex_style=WS_EX_TOOLWINDOW)
+    for pid, image in ((100, r'C:\CAXA\caxa.exe'), (200, r'C:\SOLIDWORKS\sldworks.exe'),
+                       (300, r'C:\Windows\notepad.exe'), (400, r'C:\Browser\browser.exe')):
+        backend.add_process(pid, image)
+    backend.set_foreground(BROWSER)
+    trace = VirtualTraceRecorder(path, loop)
+    engine = CapsLockEngine(backend, LOGGER, loop=loop, trace=trace)
+    engine._prepare(CONFIG, PolicyTable.from_config(CONFIG))
+    engine._start_sources()
+    loop.advance(0.5)
+    for hwnd, dwell_ms in steps:
+        if hwnd == 'key':
+            backend.press_caps_lock()
+        else:
+            backend.set_foreground(hwnd)
+        loop.advance(dwell_ms / 1000)
+    engine.stop_foreground_source()
+    engine.stop_keyboard_source()
+    trace.close()
+
+
+def regenerate(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    # 第一次运行：快速Alt-Tab经过几个窗口，停在CAXA后出现提示框和浮动面板，再切到按进程名匹配的SolidWorks
+    record_session(path, [(NOTEPAD, 60), (CAD, 60), (BROWSER, 60), (CAD, 1500), (TOOLTIP, 30), (CAD, 400),
+                          (PALETTE, 200), (CAD, 800), (SOLIDWORKS, 1200), (NOTEPAD, 1000), (BROWSER, 1000)])
+    # 第二次运行：在CAXA中手动关闭Caps Lock，切走再切回时沿用手动选择；记事本为keep规则
+    record_session(path, [(CAD, 1000), ('key', 500), (BROWSER, 1000), (CAD, 1000), (NOTEPAD, 800),
+                          (SOLIDWORKS, 800), (NOTEPAD, 800), (BROWSER, 1000)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放随附的诊断记录并检查切换决定")
+    parser.add_argument('--regenerate', action='store_true', help="重新录制fixtures/sample.trace")
+    args = parser.parse_args()
+    if args.regenerate:
+        regenerate(FIXTURE)
+
+    report = replay_trace(FIXTURE, CONFIG, PolicyTable.from_config(CONFIG), LOGGER)
+    recorded = sum(decision['recorded_toggles'] for decision in report['decisions'])
+    print(f"记录{report['records']}条（{report['sessions']}次运行），窗口切换{len(report['decisions'])}次，"
+          f"记录的切换{recorded}次，回放切换{report['toggles']}次，不一致{len(report['mismatches'])}处")
+    for decision in report['mismatches']:
+        print(f"  {decision['t']:.3f}s hwnd={decision['hwnd']} {decision['title']}: "
+              f"记录切换{decision['recorded_toggles']}次，回放切换{decision['replayed_toggles']}次")
+    if not recorded:
+        print("记录中没有切换，检查没有意义")
+        return 1
+    return 1 if report['mismatches'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,3475 @@
-import tkinter as tk
-from tkinter import ttk, Menu
-import win32api
-import win32con
-import win32gui
 import time
+
+_IMPORT_STARTED = time.perf_counter()  # 用于--profile-startup统计模块导入耗时
+import signal
 import logging
+import logging.handlers
 import os
-import datetime
+import ntpath
+import sys
+import re
+import json
+import math
+import mmap
+import heapq
+import itertools
+import queue
+import struct
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+
+IMPORT_TIMES = {'标准库': time.perf_counter() - _IMPORT_STARTED}  # 模块名 -> 导入耗时(秒)
+_IMPORT_STARTED = time.perf_counter()
+try:
+    import win32api
+    import win32con
+    import win32event
+    import win32gui
+    import win32process
+except ImportError:  # 非Windows环境（如在Linux上使用模拟后端）
+    win32api = win32con = win32event = win32gui = win32process = None
+IMPORT_TIMES['pywin32'] = time.perf_counter() - _IMPORT_STARTED
+
+# tkinter按需导入，无界面模式下不加载
+tk = None
+Menu = None
+
+
+def load_tkinter():
+    """导入tkinter（只在需要界面时调用）"""
+    global tk, Menu
+    if tk is None:
+        started = time.perf_counter()
+        import tkinter
+        tk = tkinter
+        Menu = tkinter.Menu
+        IMPORT_TIMES['tkinter'] = time.perf_counter() - started
+    return tk
+
+
+# WinEvent钩子常量
+EVENT_SYSTEM_FOREGROUND = 0x0003
+WINEVENT_OUTOFCONTEXT = 0x0000
+WINEVENT_SKIPOWNPROCESS = 0x0002
+OBJID_WINDOW = 0
+DESKTOP_SWITCHDESKTOP = 0x0100
+SPI_GETSCREENSAVERRUNNING = 0x0072
+# 显示器开关通知：PowerSettingRegisterNotification回调中的数据0为关闭，1为打开，2为变暗
+GUID_CONSOLE_DISPLAY_STATE = '{6FE69556-704A-47A0-8F24-C28D936FDA47}'
+DEVICE_NOTIFY_CALLBACK = 2
+PBT_POWERSETTINGCHANGE = 0x8013
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+
+# 低级键盘钩子常量
+WH_KEYBOARD_LL = 13
+HC_ACTION = 0
+WM_QUIT = 0x0012
+WM_KEYDOWN = 0x0100
+WM_SYSKEYDOWN = 0x0104
+VK_CAPITAL = 0x14
+# 本程序注入的按键事件在dwExtraInfo中带此标记，以便和用户按键区分
+INJECTED_EXTRA_INFO = 0x434C4B43
+INPUT_KEYBOARD = 1
+GWL_EXSTYLE = -20
+WS_EX_TOOLWINDOW = 0x00000080
+WS_EX_NOACTIVATE = 0x08000000
+KEYEVENTF_EXTENDEDKEY = 0x0001
+KEYEVENTF_KEYUP = 0x0002
+
+
+class Win32Backend:
+    """Win32后端，封装前台窗口、窗口标题和Caps Lock状态的查询与切换"""
+
+    def __init__(self):
+        self._send_toggle = None
+        self._display_off = False  # 由显示器状态通知回调更新
+        self._display_watch = None  # 注册后保存回调等对象，防止被回收；注册失败为()
+
+    def get_foreground_window(self):
+        return win32gui.GetForegroundWindow()
+
+    def get_window_text(self, hwnd):
+        return win32gui.GetWindowText(hwnd)
+
+    def is_window(self, hwnd):
+        return bool(win32gui.IsWindow(hwnd))
+
+    def get_window_pid(self, hwnd):
+        return win32process.GetWindowThreadProcessId(hwnd)[1]
+
+    def get_window_class(self, hwnd):
+        try:
+            return win32gui.GetClassName(hwnd)
+        except win32gui.error:
+            return ''
+
+    def get_window_ex_style(self, hwnd):
+        return win32gui.GetWindowLong(hwnd, GWL_EXSTYLE)
+
+    def open_process(self, pid):
+        """打开进程句柄，失败（如权限不足或进程已退出）返回None"""
+        try:
+            return win32api.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION | win32con.SYNCHRONIZE, False, pid)
+        except win32api.error:
+            return None
+
+    def get_process_image_name(self, handle):
+        import ctypes
+        from ctypes import wintypes
+
+        kernel32 = ctypes.windll.kernel32
+        kernel32.QueryFullProcessImageNameW.argtypes = [
+            wintypes.HANDLE, wintypes.DWORD, wintypes.LPWSTR, ctypes.POINTER(wintypes.DWORD)
+        ]
+        buffer = ctypes.create_unicode_buffer(1024)
+        size = wintypes.DWORD(len(buffer))
+        if not kernel32.QueryFullProcessImageNameW(int(handle), 0, buffer, ctypes.byref(size)):
+            return ''
+        return buffer.value
+
+    def is_process_alive(self, handle):
+        return win32event.WaitForSingleObject(handle, 0) == win32event.WAIT_TIMEOUT
+
+    def close_process(self, handle):
+        handle.Close()
+
+    def get_caps_lock_state(self):
+        return win32api.GetKeyState(win32con.VK_CAPITAL) & 1 != 0
+
+    def get_last_input_tick(self):
+        return win32api.GetLastInputInfo()
+
+    def is_session_paused(self):
+        """会话已锁定（无法切换到输入桌面）、屏幕保护正在运行或显示器已关闭"""
+        import ctypes
+
+        if self._display_watch is None:
+            self._display_watch = self._watch_display_state()
+        if self._display_off:
+            return True
+        user32 = ctypes.windll.user32
+        desktop = user32.OpenInputDesktop(0, False, DESKTOP_SWITCHDESKTOP)
+        if not desktop:
+            return True
+        try:
+            if not user32.SwitchDesktop(desktop):
+                return True
+        finally:
+            user32.CloseDesktop(desktop)
+        return bool(win32gui.SystemParametersInfo(SPI_GETSCREENSAVERRUNNING))
+
+    def _watch_display_state(self):
+        """注册显示器开关通知（系统在线程池中回调），失败时返回()，此后只按锁定和屏幕保护判断"""
+        import ctypes
+        from ctypes import wintypes
+
+        class GUID(ctypes.Structure):
+            _fields_ = [('Data1', wintypes.DWORD), ('Data2', wintypes.WORD), ('Data3', wintypes.WORD),
+                        ('Data4', ctypes.c_ubyte * 8)]
+
+        class POWERBROADCAST_SETTING(ctypes.Structure):
+            _fields_ = [('PowerSetting', GUID), ('DataLength', wintypes.DWORD), ('Data', ctypes.c_ubyte * 1)]
+
+        CALLBACK = ctypes.WINFUNCTYPE(wintypes.ULONG, ctypes.c_void_p, wintypes.ULONG, ctypes.c_void_p)
+
+        class DEVICE_NOTIFY_SUBSCRIBE_PARAMETERS(ctypes.Structure):
+            _fields_ = [('Callback', CALLBACK), ('Context', ctypes.c_void_p)]
+
+        def on_power_setting(context, kind, setting):
+            if kind == PBT_POWERSETTINGCHANGE and setting:
+                data = ctypes.cast(setting, ctypes.POINTER(POWERBROADCAST_SETTING)).contents
+                if data.DataLength >= 1:
+                    self._display_off = data.Data[0] == 0
+            return 0
+
+        guid = GUID()
+        params = DEVICE_NOTIFY_SUBSCRIBE_PARAMETERS(CALLBACK(on_power_setting), None)
+        handle = ctypes.c_void_p()
+        try:
+            ctypes.oledll.ole32.CLSIDFromString(GUID_CONSOLE_DISPLAY_STATE, ctypes.byref(guid))
+            error = ctypes.windll.powrprof.PowerSettingRegisterNotification(
+                ctypes.byref(guid), DEVICE_NOTIFY_CALLBACK, ctypes.byref(params), ctypes.byref(handle))
+        except (OSError, AttributeError):
+            return ()
+        if error:
+            return ()
+        return (guid, params, handle)
+
+    def toggle_caps_lock(self):
+        """在一次SendInput调用中注入Caps Lock的按下和抬起，返回实际插入输入流的事件数（应为2）
+
+        两个事件一起插入，中间不会混入其他输入；返回值小于2说明被拦截（如目标窗口权限更高）。
+        """
+        if self._send_toggle is None:
+            self._send_toggle = self._build_send_toggle()
+        return self._send_toggle()
+
+    @staticmethod
+    def _build_send_toggle():
+        import ctypes
+        from ctypes import wintypes
+
+        class KEYBDINPUT(ctypes.Structure):
+            _fields_ = [('wVk', wintypes.WORD), ('wScan', wintypes.WORD), ('dwFlags', wintypes.DWORD),
+                        ('time', wintypes.DWORD), ('dwExtraInfo', ctypes.c_size_t)]
+
+        class MOUSEINPUT(ctypes.Structure):
+            # 只用于让联合体的大小与系统定义一致
+            _fields_ = [('dx', wintypes.LONG), ('dy', wintypes.LONG), ('mouseData', wintypes.DWORD),
+                        ('dwFlags', wintypes.DWORD), ('time', wintypes.DWORD), ('dwExtraInfo', ctypes.c_size_t)]
+
+        class INPUTUNION(ctypes.Union):
+            _fields_ = [('ki', KEYBDINPUT), ('mi', MOUSEINPUT)]
+
+        class INPUT(ctypes.Structure):
+            _fields_ = [('type', wintypes.DWORD), ('union', INPUTUNION)]
+
+        inputs = (INPUT * 2)()
+        for item, flags in zip(inputs, (KEYEVENTF_EXTENDEDKEY, KEYEVENTF_EXTENDEDKEY | KEYEVENTF_KEYUP)):
+            item.type = INPUT_KEYBOARD
+            item.union.ki = KEYBDINPUT(VK_CAPITAL, 0, flags, 0, INJECTED_EXTRA_INFO)
+        send_input = ctypes.windll.user32.SendInput
+        send_input.argtypes = [wintypes.UINT, ctypes.c_void_p, ctypes.c_int]
+        send_input.restype = wintypes.UINT
+        size = ctypes.sizeof(INPUT)
+        return lambda: send_input(len(inputs), ctypes.byref(inputs), size)
+
+
+class FakeBackend:
+    """进程内模拟后端，用于在Linux上驱动和测试检测逻辑"""
+
+    def __init__(self):
+        self.windows = {}  # hwnd -> 窗口标题
+        self.window_pids = {}  # hwnd -> pid
+        self.window_classes = {}  # hwnd -> 窗口类名
+        self.window_ex_styles = {}  # hwnd -> 扩展样式
+        self.processes = {}  # pid -> 进程映像路径（仅包含仍在运行的进程）
+        self.foreground = 0
+        self.caps_lock = False
+        self.toggle_count = 0
+        self.on_foreground = None  # 前台窗口切换时的通知回调
+        self.on_caps_key = None  # Caps Lock被按下时的通知回调，参数为是否本程序注入
+        self.last_input_tick = 0
+        self.session_paused = False  # 会话锁定或屏幕保护
+        self.display_off = False
+        self.drop_toggles = 0  # 之后这么多次注入的按键被"其他钩子吞掉"：返回成功但状态不变
+        self.block_toggles = 0  # 之后这么多次注入被拒绝：SendInput返回0
+
+    def add_window(self, hwnd, title, pid=0, window_class='', ex_style=0):
+        self.windows[hwnd] = title
+        self.window_pids[hwnd] = pid
+        self.window_classes[hwnd] = window_class
+        self.window_ex_styles[hwnd] = ex_style
+
+    def add_process(self, pid, image_path):
+        self.processes[pid] = image_path
+
+    def exit_process(self, pid):
+        """模拟进程退出"""
+        self.processes.pop(pid, None)
+
+    def set_foreground(self, hwnd, title=None):
+        """模拟切换前台窗口"""
+        if title is not None:
+            self.windows[hwnd] = title
+        self.foreground = hwnd
+        if self.on_foreground:
+            self.on_foreground(hwnd)
+
+    def close_window(self, hwnd):
+        """模拟窗口被销毁"""
+        self.windows.pop(hwnd, None)
+        self.window_pids.pop(hwnd, None)
+        self.window_classes.pop(hwnd, None)
+        self.window_ex_styles.pop(hwnd, None)
+
+    def press_caps_lock(self):
+        """模拟用户手动按下Caps Lock"""
+        self.caps_lock = not self.caps_lock
+        self.last_input_tick += 1
+        if self.on_caps_key:
+            self.on_caps_key(False)
+
+    def get_foreground_window(self):
+        return self.foreground
+
+    def get_window_text(self, hwnd):
+        return self.windows.get(hwnd, '')
+
+    def is_window(self, hwnd):
+        return hwnd in self.windows
+
+    def get_window_pid(self, hwnd):
+        return self.window_pids.get(hwnd, 0)
+
+    def get_window_class(self, hwnd):
+        return self.window_classes.get(hwnd, '')
+
+    def get_window_ex_style(self, hwnd):
+        return self.window_ex_styles.get(hwnd, 0)
+
+    def open_process(self, pid):
+        # 句柄记录打开时的映像路径，进程退出后PID复用也不会混淆
+        if pid not in self.processes:
+            return None
+        return (pid, self.processes[pid])
+
+    def get_process_image_name(self, handle):
+        return handle[1]
+
+    def is_process_alive(self, handle):
+        return self.processes.get(handle[0]) == handle[1]
+
+    def close_process(self, handle):
+        pass
+
+    def get_caps_lock_state(self):
+        return self.caps_lock
+
+    def get_last_input_tick(self):
+        return self.last_input_tick
+
+    def is_session_paused(self):
+        return self.session_paused or self.display_off
+
+    def toggle_caps_lock(self):
+        self.toggle_count += 1
+        if self.block_toggles > 0:
+            self.block_toggles -= 1
+            return 0
+        if self.drop_toggles > 0:
+            self.drop_toggles -= 1
+            return 2
+        self.caps_lock = not self.caps_lock
+        # 送达的注入按键像真实的键盘钩子一样被看到
+        if self.on_caps_key:
+            self.on_caps_key(True)
+        return 2
+
+
+class EngineLoop:
+    """检测引擎的事件循环：定时器加线程安全的任务投递，运行在引擎线程中"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._timers = []  # 堆: [到期时间, 序号, 回调]
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._wakeup = threading.Event()
+        self._running = False
+
+    def call_later(self, delay_ms, callback):
+        """delay_ms毫秒后在引擎线程中执行回调，返回可用于cancel的句柄"""
+        timer = [self.clock() + delay_ms / 1000, next(self._counter), callback]
+        with self._lock:
+            heapq.heappush(self._timers, timer)
+        self._wake()
+        return timer
+
+    def cancel(self, handle):
+        handle[2] = None
+
+    def call_soon(self, callback, *args):
+        """从任意线程投递任务到引擎线程"""
+        with self._lock:
+            self._ready.append((callback, args))
+        self._wake()
+
+    def run(self):
+        self._running = True
+        while self._running:
+            self._run_once()
+
+    def stop(self):
+        self.call_soon(self._set_stopped)
+
+    def _set_stopped(self):
+        self._running = False
+
+    def _run_once(self):
+        self._run_pending()
+        with self._lock:
+            if self._ready:
+                timeout = 0
+            elif self._timers:
+                timeout = max(0, self._timers[0][0] - self.clock())
+            else:
+                timeout = None
+        if self._running and timeout != 0:
+            self._wait(timeout)
+
+    def _run_pending(self):
+        """执行已投递的任务和已到期的定时器"""
+        with self._lock:
+            ready = list(self._ready)
+            self._ready.clear()
+        for callback, args in ready:
+            self._invoke(callback, *args)
+
+        now = self.clock()
+        while True:
+            with self._lock:
+                if not self._timers or self._timers[0][0] > now:
+                    break
+                timer = heapq.heappop(self._timers)
+            if timer[2] is not None:
+                self._invoke(timer[2])
+
+    def _invoke(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            logging.getLogger(__name__).exception("引擎任务执行失败")
+
+    def _wait(self, timeout):
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+    def _wake(self):
+        self._wakeup.set()
+
+
+class VirtualLoop(EngineLoop):
+    """使用虚拟时钟的事件循环，不真正等待，由调用方推进时间（用于测试和回放）"""
+
+    def __init__(self, start=0.0):
+        self.now = start
+        super().__init__(clock=lambda: self.now)
+
+    def advance(self, seconds):
+        """把虚拟时间推进seconds秒，依次执行期间到期的所有任务"""
+        deadline = self.now + seconds
+        while True:
+            self._run_pending()
+            with self._lock:
+                if self._ready:
+                    continue
+                next_due = self._timers[0][0] if self._timers else None
+            if next_due is None or next_due > deadline:
+                break
+            self.now = max(self.now, next_due)
+        self.now = deadline
+
+    def run(self):
+        raise RuntimeError("VirtualLoop需要通过advance推进时间")
+
+
+class Win32MessageLoop(EngineLoop):
+    """在等待定时器的同时分发Windows消息，WinEvent钩子回调依赖消息循环"""
+
+    def __init__(self, clock=time.monotonic):
+        super().__init__(clock)
+        self._event = win32event.CreateEvent(None, False, False, None)
+
+    def _wait(self, timeout):
+        timeout_ms = win32event.INFINITE if timeout is None else int(timeout * 1000)
+        win32event.MsgWaitForMultipleObjects([self._event], False, timeout_ms, win32event.QS_ALLINPUT)
+        win32gui.PumpWaitingMessages()
+
+    def _wake(self):
+        win32event.SetEvent(self._event)
+
+
+class AdaptivePollInterval:
+    """自适应轮询间隔：有输入或刚切换窗口时收紧到最小间隔，前台窗口稳定时按倍数退避到最大间隔"""
+
+    def __init__(self, min_interval=100, max_interval=1000, backoff=2.0):
+        self.min_interval = max(1, min_interval)
+        self.max_interval = max(self.min_interval, max_interval)
+        self.backoff = backoff
+        self.current = self.min_interval
+
+    def on_activity(self):
+        self.current = self.min_interval
+
+    def on_idle(self):
+        self.current = min(self.max_interval, self.current * self.backoff)
+
+
+class PollingForegroundSource:
+    """轮询前台窗口，仅在窗口变化时回调（事件钩子不可用时的后备方案）
+
+    轮询间隔自适应：用户有输入或刚切换窗口后按最小间隔轮询，前台窗口稳定时逐步退避；
+    会话锁定、屏幕保护运行或显示器关闭时暂停检测，只按最大间隔检查是否已恢复。
+    """
+
+    def __init__(self, backend, scheduler, min_interval=100, max_interval=1000):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.interval = AdaptivePollInterval(min_interval, max_interval)
+        self.callback = None
+        self.last_hwnd = None
+        self.last_input = None
+        self.paused = False
+        self.ticks = 0
+        self._timer = None
+
+    def start(self, callback):
+        self.callback = callback
+        self.last_hwnd = None
+        self._tick()
+
+    def _tick(self):
+        self.ticks += 1
+        self.paused = self.backend.is_session_paused()
+        if self.paused:
+            self._timer = self.scheduler.call_later(self.interval.max_interval, self._tick)
+            return
+        hwnd = self.backend.get_foreground_window()
+        last_input = self.backend.get_last_input_tick()
+        if hwnd != self.last_hwnd:
+            self.last_hwnd = hwnd
+            self.interval.on_activity()
+            self.callback(hwnd)
+        elif last_input != self.last_input:
+            self.interval.on_activity()
+        else:
+            self.interval.on_idle()
+        self.last_input = last_input
+        self._timer = self.scheduler.call_later(self.interval.current, self._tick)
+
+    def stats(self):
+        """当前的有效轮询间隔和频率"""
+        interval = self.interval.max_interval if self.paused else self.interval.current
+        return {
+            'paused': self.paused,
+            'interval_ms': interval,
+            'rate_hz': round(1000 / interval, 2),
+            'ticks': self.ticks,
+        }
+
+    def stop(self):
+        if self._timer is not None:
+            self.scheduler.cancel(self._timer)
+            self._timer = None
+
+
+class WinEventForegroundSource:
+    """基于SetWinEventHook(EVENT_SYSTEM_FOREGROUND)的事件驱动前台窗口检测
+
+    钩子以WINEVENT_OUTOFCONTEXT方式安装，回调由安装线程的消息循环分发，
+    空闲时没有任何定时唤醒。
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.callback = None
+        self._hook = None
+        self._proc = None
+
+    def start(self, callback):
+        import ctypes
+        from ctypes import wintypes
+
+        user32 = ctypes.windll.user32
+        proc_type = ctypes.WINFUNCTYPE(
+            None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+            wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD
+        )
+        user32.SetWinEventHook.restype = wintypes.HANDLE
+        user32.SetWinEventHook.argtypes = [
+            wintypes.DWORD, wintypes.DWORD, wintypes.HMODULE, proc_type,
+            wintypes.DWORD, wintypes.DWORD, wintypes.DWORD
+        ]
+        user32.UnhookWinEvent.argtypes = [wintypes.HANDLE]
+
+        self.callback = callback
+        # 回调对象必须保持引用，否则会被垃圾回收导致崩溃
+        self._proc = proc_type(self._on_event)
+        self._hook = user32.SetWinEventHook(
+            EVENT_SYSTEM_FOREGROUND, EVENT_SYSTEM_FOREGROUND, None, self._proc,
+            0, 0, WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS
+        )
+        if not self._hook:
+            self._proc = None
+            raise OSError("SetWinEventHook调用失败")
+        # 钩子只报告之后的切换，先上报一次当前前台窗口
+        callback(self.backend.get_foreground_window())
+
+    def _on_event(self, hook, event, hwnd, id_object, id_child, thread_id, event_time):
+        if id_object == OBJID_WINDOW and hwnd:
+            import ctypes
+            # event_time是事件发生时的GetTickCount毫秒数，换算到perf_counter时间轴
+            delay = max(0, (ctypes.windll.kernel32.GetTickCount() - event_time) & 0xFFFFFFFF) / 1000
+            self.callback(hwnd, time.perf_counter() - delay)
+
+    def stop(self):
+        if self._hook:
+            import ctypes
+            ctypes.windll.user32.UnhookWinEvent(self._hook)
+            self._hook = None
+            self._proc = None
+
+
+class FakeForegroundSource:
+    """模拟事件源，FakeBackend.set_foreground的通知被投递到引擎线程"""
+
+    def __init__(self, backend, scheduler):
+        self.backend = backend
+        self.scheduler = scheduler
+
+    def start(self, callback):
+        self.backend.on_foreground = lambda hwnd: self.scheduler.call_soon(callback, hwnd, time.perf_counter())
+        callback(self.backend.get_foreground_window())
+
+    def stop(self):
+        self.backend.on_foreground = None
+
+
+class LowLevelKeyboardSource:
+    """WH_KEYBOARD_LL低级键盘钩子，在独立线程中运行，只关注Caps Lock的按下
+
+    钩子回调只做判断并把事件投递到引擎线程，尽快返回，避免拖慢系统键盘输入。
+    本程序注入的按键带有INJECTED_EXTRA_INFO标记，会被区分出来。
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.callback = None
+        self._thread = None
+        self._thread_id = None
+        self._proc = None
+        self._key_down = False
+        self._started = threading.Event()
+        self._error = None
+
+    def start(self, callback):
+        self.callback = callback
+        self._thread = threading.Thread(target=self._run, name="caps-lock-keyboard-hook", daemon=True)
+        self._thread.start()
+        self._started.wait(2)
+        if self._error:
+            raise OSError(self._error)
+
+    def _run(self):
+        import ctypes
+        from ctypes import wintypes
+
+        class KBDLLHOOKSTRUCT(ctypes.Structure):
+            _fields_ = [
+                ('vkCode', wintypes.DWORD),
+                ('scanCode', wintypes.DWORD),
+                ('flags', wintypes.DWORD),
+                ('time', wintypes.DWORD),
+                ('dwExtraInfo', ctypes.c_size_t),
+            ]
+
+        user32 = ctypes.windll.user32
+        kernel32 = ctypes.windll.kernel32
+        proc_type = ctypes.WINFUNCTYPE(ctypes.c_ssize_t, ctypes.c_int, wintypes.WPARAM, wintypes.LPARAM)
+        user32.SetWindowsHookExW.restype = wintypes.HHOOK
+        user32.SetWindowsHookExW.argtypes = [ctypes.c_int, proc_type, wintypes.HINSTANCE, wintypes.DWORD]
+        user32.CallNextHookEx.restype = ctypes.c_ssize_t
+        user32.CallNextHookEx.argtypes = [wintypes.HHOOK, ctypes.c_int, wintypes.WPARAM, wintypes.LPARAM]
+        kernel32.GetModuleHandleW.restype = wintypes.HMODULE
+
+        def on_key(n_code, w_param, l_param):
+            if n_code == HC_ACTION:
+                info = ctypes.cast(l_param, ctypes.POINTER(KBDLLHOOKSTRUCT)).contents
+                if info.vkCode == VK_CAPITAL:
+                    down = w_param in (WM_KEYDOWN, WM_SYSKEYDOWN)
+                    # 按住不放时的自动重复不算新的按键
+                    if down and not self._key_down:
+                        injected = info.dwExtraInfo == INJECTED_EXTRA_INFO
+                        self.scheduler.call_soon(self.callback, injected, time.perf_counter())
+                    self._key_down = down
+            return user32.CallNextHookEx(None, n_code, w_param, l_param)
+
+        self._thread_id = kernel32.GetCurrentThreadId()
+        # 回调对象必须保持引用，否则会被垃圾回收导致崩溃
+        self._proc = proc_type(on_key)
+        hook = user32.SetWindowsHookExW(WH_KEYBOARD_LL, self._proc, kernel32.GetModuleHandleW(None), 0)
+        if not hook:
+            self._error = f"SetWindowsHookExW调用失败: {ctypes.GetLastError()}"
+            self._started.set()
+            return
+        self._started.set()
+        msg = wintypes.MSG()
+        while user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+            user32.TranslateMessage(ctypes.byref(msg))
+            user32.DispatchMessageW(ctypes.byref(msg))
+        user32.UnhookWindowsHookEx(hook)
+        self._proc = None
+
+    def stop(self):
+        if self._thread is not None:
+            import ctypes
+            ctypes.windll.user32.PostThreadMessageW(self._thread_id, WM_QUIT, 0, 0)
+            self._thread.join(2)
+            self._thread = None
+
+
+class FakeKeyboardSource:
+    """模拟键盘事件源，FakeBackend的按键通知（用户按键和送达的注入）被投递到引擎线程"""
+
+    def __init__(self, backend, scheduler):
+        self.backend = backend
+        self.scheduler = scheduler
+
+    def start(self, callback):
+        self.backend.on_caps_key = lambda injected: self.scheduler.call_soon(callback, injected, time.perf_counter())
+
+    def stop(self):
+        self.backend.on_caps_key = None
+
+
+def create_keyboard_source(enabled, backend, scheduler):
+    """创建Caps Lock按键事件源，不可用时返回None（退回到轮询GetKeyState）"""
+    if not enabled:
+        return None
+    if isinstance(backend, FakeBackend):
+        return FakeKeyboardSource(backend, scheduler)
+    if sys.platform == 'win32':
+        return LowLevelKeyboardSource(scheduler)
+    return None
+
+
+def create_foreground_source(kind, backend, scheduler, min_interval=100, max_interval=1000, logger=None):
+    """根据配置创建前台窗口事件源，事件钩子不可用时回退到轮询"""
+    if kind != 'polling' and isinstance(backend, FakeBackend):
+        return FakeForegroundSource(backend, scheduler)
+    if kind in ('auto', 'winevent') and sys.platform == 'win32':
+        return WinEventForegroundSource(backend)
+    if kind == 'winevent' and logger:
+        logger.warning("当前平台不支持WinEvent钩子，改用轮询检测")
+    return PollingForegroundSource(backend, scheduler, min_interval, max_interval)
+
+
+NO_RANK = 0xFFFFFFFF  # 快照中表示"未命中"的排名
+
+
+class _AhoCorasick:
+    """Aho-Corasick自动机，扫描一遍文本即可找出所有命中的模式"""
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [None]  # 每个状态命中的最小条目下标（build后包括失败链上的输出）
+        self._terminal = [None]  # 恰好在该状态结束的最小条目下标，前缀匹配只看它
+
+    def __len__(self):
+        return len(self._goto) - 1
+
+    def add(self, word, index):
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(None)
+                self._terminal.append(None)
+                self._goto[state][ch] = nxt
+            state = nxt
+        if self._out[state] is None or index < self._out[state]:
+            self._out[state] = index
+            self._terminal[state] = index
+
+    def build(self):
+        """按广度优先计算失败指针，并把失败链上的输出合并到每个状态"""
+        goto, fail, out = self._goto, self._fail, self._out
+        queue = list(goto[0].values())
+        for state in queue:
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[nxt] = target if target != nxt else 0
+                inherited = out[fail[nxt]]
+                if inherited is not None and (out[nxt] is None or inherited < out[nxt]):
+                    out[nxt] = inherited
+
+    def search(self, text):
+        """返回文本中命中的最小条目下标，未命中返回None"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        best = None
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            hit = out[state]
+            if hit is not None and (best is None or hit < best):
+                best = hit
+                if best == 0:
+                    break
+        return best
+
+    def tables(self, rank_of):
+        """导出为平铺的数组：每个状态的转移按字符排序存放，输出的条目下标换成rank_of中的排名"""
+        start = array('I', [0])
+        keys = array('I')
+        targets = array('I')
+        out = array('I')
+        terminal = array('I')
+        for state, goto in enumerate(self._goto):
+            for ch in sorted(goto):
+                keys.append(ord(ch))
+                targets.append(goto[ch])
+            start.append(len(keys))
+            for outputs, table in ((self._out, out), (self._terminal, terminal)):
+                hit = outputs[state]
+                table.append(NO_RANK if hit is None else rank_of[hit])
+        return start, array('I', self._fail), out, terminal, keys, targets
+
+    def search_prefix(self, text):
+        """只沿字典树从文本开头匹配，返回命中的最小前缀条目下标
+
+        不能用out：build合并进来的失败链输出对应的条目并不从文本开头开始。
+        """
+        goto, out = self._goto, self._terminal
+        state = 0
+        best = None
+        for ch in text:
+            state = goto[state].get(ch)
+            if state is None:
+                break
+            hit = out[state]
+            if hit is not None and (best is None or hit < best):
+                best = hit
+        return best
+
+
+def _wrap_regex(regex):
+    """把正则包成非捕获组，以便与其他条目用|合并"""
+    return f'(?i:{regex.pattern})' if regex.flags & re.IGNORECASE else f'(?:{regex.pattern})'
+
+
+def _combine_regexes(regexes):
+    """把(下标, 正则)列表合并为一个正则，用于一次判断是否有正则条目命中
+
+    列表为空或无法合并时返回None，调用方改为逐个匹配。
+    """
+    if not regexes:
+        return None
+    try:
+        return re.compile('|'.join(_wrap_regex(regex) for _, regex in regexes))
+    except re.error:
+        return None
+
+
+def _search_regexes(regexes, regex_any, text):
+    """返回命中的正则条目中最小的下标（或排名），未命中返回None"""
+    if not regexes or (regex_any is not None and not regex_any.search(text)):
+        return None
+    return min((index for index, regex in regexes if regex.search(text)), default=None)
+
+
+TITLE_MATCHER_LINEAR_MAX = 32  # 普通和前缀条目不超过这么多时逐条用str的方法匹配，比纯Python的自动机快
+
+
+class TitleMatcher:
+    r"""将software_list编译为单次扫描的窗口标题匹配器
+
+    条目语法：
+        CAXA          区分大小写的子串匹配（默认）
+        i:caxa        不区分大小写
+        ^SolidWorks   标题前缀匹配
+        re:AutoCAD \d{4}  正则匹配
+    前缀可组合，如 i:^autocad、i:re:caxa.*2024。
+    普通条目和前缀条目分别构建Aho-Corasick自动机，匹配耗时只与标题长度有关，
+    与条目数量无关；条目很少时逐条匹配更快。正则条目合并为一个正则。
+    """
+
+    def __init__(self, entries):
+        self.entries = []
+        self.positions = []  # 每个有效条目在entries参数中的位置
+        self.errors = []  # 编译失败的条目: (条目, 错误信息)
+        self._substr = _AhoCorasick()
+        self._substr_icase = _AhoCorasick()
+        self._prefix = _AhoCorasick()
+        self._prefix_icase = _AhoCorasick()
+        self._regexes = []
+        self._regex_separate = False  # 有条目不能合并进一个正则，只能逐个匹配
+        self._plain = []  # 普通和前缀条目: (下标, 匹配文本, 是否前缀, 是否不区分大小写)
+        for position, entry in enumerate(entries):
+            if self._add(entry):
+                self.positions.append(position)
+        for automaton in (self._substr, self._substr_icase, self._prefix, self._prefix_icase):
+            automaton.build()
+        self._regex_any = None if self._regex_separate else _combine_regexes(self._regexes)
+        # 条目很少时逐条匹配；自动机仍然构建，规则快照需要它的表
+        self._linear = len(self._plain) <= TITLE_MATCHER_LINEAR_MAX
+
+    def _add(self, entry):
+        text = entry
+        icase = False
+        if text.startswith('i:'):
+            icase = True
+            text = text[2:]
+        if not text:
+            return False
+        index = len(self.entries)
+        if text.startswith('re:'):
+            try:
+                regex = re.compile(text[3:], re.IGNORECASE if icase else 0)
+            except re.error as e:
+                self.errors.append((entry, str(e)))
+                return False
+            try:
+                re.compile(_wrap_regex(regex))
+            except re.error:
+                # 如(?i)这样的全局标志只能写在整个正则的开头，包成组后无效；条目本身有效，改为逐个匹配
+                self._regex_separate = True
+            self._regexes.append((index, regex))
+        else:
+            prefix = text.startswith('^')
+            needle = text[1:] if prefix else text
+            if icase:
+                needle = needle.casefold()
+            if prefix:
+                automaton = self._prefix_icase if icase else self._prefix
+            else:
+                automaton = self._substr_icase if icase else self._substr
+            automaton.add(needle, index)
+            self._plain.append((index, needle, prefix, icase))
+        self.entries.append(entry)
+        return True
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, title):
+        """返回标题命中的条目中在列表里最靠前的下标，未命中返回None"""
+        if self._linear:
+            return self._search_linear(title)
+        hits = [self._substr.search(title), self._prefix.search_prefix(title)]
+        if len(self._substr_icase) or len(self._prefix_icase):
+            folded = title.casefold()
+            hits.append(self._substr_icase.search(folded))
+            hits.append(self._prefix_icase.search_prefix(folded))
+        hits.append(_search_regexes(self._regexes, self._regex_any, title))
+        hits = [hit for hit in hits if hit is not None]
+        return min(hits) if hits else None
+
+    def _search_linear(self, title):
+        hit = None
+        folded = None
+        for index, needle, prefix, icase in self._plain:
+            if icase:
+                if folded is None:
+                    folded = title.casefold()
+                text = folded
+            else:
+                text = title
+            if text.startswith(needle) if prefix else needle in text:
+                hit = index
+                break
+        regex_hit = _search_regexes(self._regexes, self._regex_any, title)
+        if regex_hit is not None and (hit is None or regex_hit < hit):
+            return regex_hit
+        return hit
+
+    def matches(self, title):
+        """标题是否命中任一条目"""
+        return self.search(title) is not None
+
+
+# 切换规则的动作
+POLICY_ON = 'on'  # 打开Caps Lock
+POLICY_OFF = 'off'  # 关闭Caps Lock
+POLICY_KEEP = 'keep'  # 不处理，保持当前状态，不注入按键
+POLICY_ACTIONS = (POLICY_ON, POLICY_OFF, POLICY_KEEP)
+
+
+class PolicyTable:
+    """把切换规则编译为查找表：前台窗口 -> 打开/关闭/不处理Caps Lock
+
+    规则为(动作, 优先级, 条件)，条件以proc:开头时按进程映像名匹配，否则按TitleMatcher的语法匹配窗口标题。
+    所有规则按(优先级从高到低, 书写顺序)排名，命中的规则中排名最靠前的生效，都不命中时使用默认动作。
+    进程规则编译为字典；标题规则按排名顺序编译进一个TitleMatcher，它返回的最小下标就是排名最靠前的标题规则，
+    因此每次切换只需一次字典查询和（必要时）一次标题扫描。
+    """
+
+    def __init__(self, rules, default_action=POLICY_OFF):
+        self.errors = []  # 无效的规则: (规则, 错误信息)
+        ranked = sorted(enumerate(rules), key=lambda item: (-item[1][1], item[0]))
+        self.actions = []  # 排名 -> 动作，最后一项为默认动作
+        self.conditions = []
+        self._process_ranks = {}
+        title_entries = []
+        title_ranks = []
+        for _, (action, priority, condition) in ranked:
+            rank = len(self.actions)
+            self.actions.append(action)
+            self.conditions.append(condition)
+            if condition.startswith('proc:'):
+                self._process_ranks.setdefault(condition[5:].strip().lower(), rank)
+            else:
+                title_entries.append(condition)
+                title_ranks.append(rank)
+        self.actions.append(default_action)
+        self.no_match = len(self.actions) - 1
+        self.title_matcher = TitleMatcher(title_entries)
+        self.errors += self.title_matcher.errors
+        self._title_ranks = [title_ranks[position] for position in self.title_matcher.positions]
+        # 排名最靠前的标题规则；进程规则命中的排名比它还靠前时，不必再读取窗口标题
+        self.best_title_rank = self._title_ranks[0] if self._title_ranks else self.no_match
+
+    @classmethod
+    def from_config(cls, config):
+        """由配置编译：rule条目，加上process_list和software_list（相当于优先级0的on规则）
+
+        同为优先级0时process_list排在software_list之前：动作相同，进程名命中后就不必再读取和扫描窗口标题。
+        """
+        rules = []
+        errors = []
+        for text in config['rules']:
+            parts = [part.strip() for part in text.split(',', 2)]
+            if len(parts) != 3 or parts[0].lower() not in POLICY_ACTIONS or not parts[2]:
+                errors.append((text, "格式应为: 动作(on/off/keep), 优先级, 条件"))
+                continue
+            try:
+                priority = int(parts[1])
+            except ValueError:
+                errors.append((text, f"优先级不是整数: {parts[1]}"))
+                continue
+            rules.append((parts[0].lower(), priority, parts[2]))
+        rules += [(POLICY_ON, 0, f'proc:{name}') for name in config['process_list']]
+        rules += [(POLICY_ON, 0, entry) for entry in config['software_list']]
+        default_action = config['default_action']
+        if default_action not in POLICY_ACTIONS:
+            errors.append((default_action, "default_action应为on/off/keep，已使用off"))
+            default_action = POLICY_OFF
+        table = cls(rules, default_action)
+        table.errors = errors + table.errors
+        return table
+
+    def __len__(self):
+        return self.no_match
+
+    @property
+    def has_process_rules(self):
+        return bool(self._process_ranks)
+
+    def process_rank(self, process_name):
+        """进程名命中的规则排名，未命中返回no_match"""
+        return self._process_ranks.get(process_name, self.no_match)
+
+    def title_rank(self, title):
+        """窗口标题命中的规则排名，未命中返回no_match"""
+        index = self.title_matcher.search(title)
+        return self.no_match if index is None else self._title_ranks[index]
+
+    def needs_title(self, rank):
+        """已知排名为rank时，标题规则是否还可能排名更靠前"""
+        return self.best_title_rank < rank
+
+    def action(self, rank):
+        return self.actions[rank]
+
+    def condition(self, rank):
+        """排名为rank的规则的条件，默认动作返回None"""
+        return self.conditions[rank] if rank < self.no_match else None
+
+
+POLICY_SNAPSHOT_MAGIC = b'CLKPOL01'
+POLICY_SNAPSHOT_FORMAT = 3
+POLICY_SNAPSHOT_BYTEORDER = 1 if sys.byteorder == 'little' else 2  # 数组按本机字节序存放
+# 魔数, 格式版本, 字节序, 版本号, 规则摘要, 数据长度, 数据的CRC32, 段数；之后是段表(偏移, 长度)和各段数据
+POLICY_SNAPSHOT_HEADER = struct.Struct('<8sIIQ16sQII')
+POLICY_SNAPSHOT_SECTION = struct.Struct('<QQ')
+_AUTOMATA = ('substr', 'substr_icase', 'prefix', 'prefix_icase')
+_AUTOMATON_TABLES = ('start', 'fail', 'out', 'terminal', 'keys', 'targets')
+_SNAPSHOT_BLOBS = ('actions', 'conditions', 'processes', 'regexes', 'errors')  # 其余各段为uint32数组
+_SNAPSHOT_SECTIONS = (
+    'meta', 'actions', 'condition_offsets', 'conditions', 'process_offsets', 'processes', 'process_ranks',
+    'regex_ranks', 'regex_flags', 'regex_offsets', 'regexes', 'error_offsets', 'errors',
+) + tuple(f'{name}_{table}' for name in _AUTOMATA for table in _AUTOMATON_TABLES)
+
+
+def _pack_strings(strings):
+    """把字符串列表编码为(偏移数组, UTF-8数据)"""
+    offsets = array('I', [0])
+    blob = bytearray()
+    for text in strings:
+        blob += text.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+class _MappedStrings:
+    """快照中的字符串表，按下标读取时才解码"""
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def raw(self, index):
+        return bytes(self._blob[self._offsets[index]:self._offsets[index + 1]])
+
+    def __getitem__(self, index):
+        return self.raw(index).decode('utf-8')
+
+
+class _MappedAutomaton:
+    """映射在快照中的Aho-Corasick自动机：按字符在排好序的转移表中二分查找，不在进程内重建字典"""
+
+    def __init__(self, start, fail, out, terminal, keys, targets):
+        self._start = start
+        self._fail = fail
+        self._out = out
+        self._terminal = terminal
+        self._keys = keys
+        self._targets = targets
+
+    def __len__(self):
+        return len(self._fail) - 1
+
+    def search(self, text):
+        """返回文本中命中的最小排名，未命中返回NO_RANK"""
+        start, fail, out, keys, targets = self._start, self._fail, self._out, self._keys, self._targets
+        state = 0
+        best = NO_RANK
+        for ch in text:
+            code = ord(ch)
+            while True:
+                end = start[state + 1]
+                i = bisect_left(keys, code, start[state], end)
+                if i < end and keys[i] == code:
+                    state = targets[i]
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            hit = out[state]
+            if hit < best:
+                best = hit
+                if best == 0:
+                    break
+        return best
+
+    def search_prefix(self, text):
+        """只沿字典树从文本开头匹配，返回命中的最小排名，未命中返回NO_RANK"""
+        start, out, keys, targets = self._start, self._terminal, self._keys, self._targets
+        state = 0
+        best = NO_RANK
+        for ch in text:
+            code = ord(ch)
+            end = start[state + 1]
+            i = bisect_left(keys, code, start[state], end)
+            if i == end or keys[i] != code:
+                break
+            state = targets[i]
+            if out[state] < best:
+                best = out[state]
+        return best
+
+
+class PolicySnapshot:
+    """PolicyTable编译结果的只读二进制快照，用mmap映射后直接在映射的内存上查找，接口与PolicyTable相同
+
+    同一主机上的多个实例映射同一个文件，自动机等查找表只在系统页缓存中保留一份，
+    各实例不必再编译software_list。自动机的输出直接存放规则排名，标题规则不再经过下标到排名的转换。
+    """
+
+    def __init__(self, buffer, path=None):
+        if len(buffer) < POLICY_SNAPSHOT_HEADER.size:
+            raise ValueError("快照文件不完整")
+        magic, version, byteorder, generation, key, length, crc, count = POLICY_SNAPSHOT_HEADER.unpack_from(buffer)
+        if magic != POLICY_SNAPSHOT_MAGIC or version != POLICY_SNAPSHOT_FORMAT or count != len(_SNAPSHOT_SECTIONS):
+            raise ValueError(f"快照格式不符: {magic!r} 版本{version}")
+        if byteorder != POLICY_SNAPSHOT_BYTEORDER:
+            raise ValueError("快照的字节序与本机不同")
+        if len(buffer) != POLICY_SNAPSHOT_HEADER.size + length:
+            raise ValueError("快照文件不完整")
+        view = memoryview(buffer)
+        if zlib.crc32(view[POLICY_SNAPSHOT_HEADER.size:]) != crc:
+            raise ValueError("快照校验失败")
+        self.path = path
+        self.generation = generation
+        self.key = key
+        self.size = len(buffer)
+        sections = {}
+        for index, name in enumerate(_SNAPSHOT_SECTIONS):
+            offset, size = POLICY_SNAPSHOT_SECTION.unpack_from(
+                buffer, POLICY_SNAPSHOT_HEADER.size + index * POLICY_SNAPSHOT_SECTION.size)
+            section = view[offset:offset + size]
+            sections[name] = section if name in _SNAPSHOT_BLOBS else section.cast('I')
+        self.no_match, self.best_title_rank = sections['meta']
+        self._actions = sections['actions']
+        self._conditions = _MappedStrings(sections['condition_offsets'], sections['conditions'])
+        self._processes = _MappedStrings(sections['process_offsets'], sections['processes'])
+        self._process_ranks = sections['process_ranks']
+        self._automata = [_MappedAutomaton(*(sections[f'{name}_{table}'] for table in _AUTOMATON_TABLES))
+                          for name in _AUTOMATA]
+        self._has_icase = any(len(automaton) for automaton in self._automata[1::2])
+        patterns = _MappedStrings(sections['regex_offsets'], sections['regexes'])
+        self._regexes = [(rank, re.compile(patterns[i], flags))
+                         for i, (rank, flags) in enumerate(zip(sections['regex_ranks'], sections['regex_flags']))]
+        self._regex_any = _combine_regexes(self._regexes)
+        errors = _MappedStrings(sections['error_offsets'], sections['errors'])
+        self.errors = [(errors[i], errors[i + 1]) for i in range(0, len(errors), 2)]
+
+    @classmethod
+    def open(cls, path):
+        """只读映射快照文件；文件不完整或格式不符时抛出ValueError"""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, path)
+
+    @staticmethod
+    def serialize(table, generation, key):
+        """把PolicyTable的编译结果写成快照文件内容"""
+        matcher = table.title_matcher
+        rank_of = table._title_ranks
+        process_names = sorted(table._process_ranks, key=lambda name: name.encode('utf-8'))
+        sections = {
+            'meta': array('I', [table.no_match, table.best_title_rank]),
+            'actions': bytes(POLICY_ACTIONS.index(action) for action in table.actions),
+            'process_ranks': array('I', [table._process_ranks[name] for name in process_names]),
+            'regex_ranks': array('I', [rank_of[index] for index, _ in matcher._regexes]),
+            'regex_flags': array('I', [regex.flags & re.IGNORECASE for _, regex in matcher._regexes]),
+        }
+        sections['condition_offsets'], sections['conditions'] = _pack_strings(table.conditions)
+        sections['process_offsets'], sections['processes'] = _pack_strings(process_names)
+        sections['regex_offsets'], sections['regexes'] = _pack_strings(regex.pattern for _, regex in matcher._regexes)
+        sections['error_offsets'], sections['errors'] = _pack_strings(
+            itertools.chain.from_iterable(table.errors))
+        for name in _AUTOMATA:
+            tables = getattr(matcher, f'_{name}').tables(rank_of)
+            sections.update(zip((f'{name}_{table_name}' for table_name in _AUTOMATON_TABLES), tables))
+
+        table_size = len(_SNAPSHOT_SECTIONS) * POLICY_SNAPSHOT_SECTION.size
+        body = bytearray(table_size)
+        for index, name in enumerate(_SNAPSHOT_SECTIONS):
+            body += bytes(-(POLICY_SNAPSHOT_HEADER.size + len(body)) % 8)  # 各段按8字节对齐
+            data = sections[name]
+            data = data.tobytes() if isinstance(data, array) else data
+            POLICY_SNAPSHOT_SECTION.pack_into(body, index * POLICY_SNAPSHOT_SECTION.size,
+                                              POLICY_SNAPSHOT_HEADER.size + len(body), len(data))
+            body += data
+        header = POLICY_SNAPSHOT_HEADER.pack(POLICY_SNAPSHOT_MAGIC, POLICY_SNAPSHOT_FORMAT, POLICY_SNAPSHOT_BYTEORDER,
+                                             generation, key, len(body), zlib.crc32(body), len(_SNAPSHOT_SECTIONS))
+        return header + bytes(body)
+
+    def __len__(self):
+        return self.no_match
+
+    @property
+    def has_process_rules(self):
+        return len(self._processes) > 0
+
+    def process_rank(self, process_name):
+        """进程名命中的规则排名，未命中返回no_match（在按字节排序的进程名表中二分查找）"""
+        if not process_name:
+            return self.no_match
+        key = process_name.encode('utf-8')
+        names = self._processes
+        lo, hi = 0, len(names)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if names.raw(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(names) and names.raw(lo) == key:
+            return self._process_ranks[lo]
+        return self.no_match
+
+    def title_rank(self, title):
+        """窗口标题命中的规则排名，未命中返回no_match"""
+        substr, substr_icase, prefix, prefix_icase = self._automata
+        best = min(substr.search(title), prefix.search_prefix(title))
+        if self._has_icase:
+            folded = title.casefold()
+            best = min(best, substr_icase.search(folded), prefix_icase.search_prefix(folded))
+        hit = _search_regexes(self._regexes, self._regex_any, title)
+        if hit is not None:
+            best = min(best, hit)
+        return min(best, self.no_match)
+
+    def needs_title(self, rank):
+        return self.best_title_rank < rank
+
+    def action(self, rank):
+        return POLICY_ACTIONS[self._actions[rank]]
+
+    def condition(self, rank):
+        return self._conditions[rank] if rank < self.no_match else None
+
+
+DECISION_CACHE_PRUNE_INTERVAL = 60000  # 引擎定期清理匹配缓存中已销毁窗口（和进程名缓存中已退出进程）的间隔(ms)
+
+
+class DecisionCache:
+    """以(hwnd, 窗口标题)为键缓存匹配结果的LRU缓存，容量有上限
+
+    写入是O(1)的：缓存满时只淘汰最久未使用的条目；已销毁窗口的条目由引擎定期调用prune清理。
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max(1, max_size)
+        self._entries = OrderedDict()
+        self._titles = {}  # hwnd -> 该窗口已缓存的标题集合，按窗口清理时不必扫描全部条目
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, hwnd, title):
+        """返回缓存的匹配结果，未命中返回None"""
+        key = (hwnd, title)
+        decision = self._entries.get(key)
+        if decision is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return decision
+
+    def put(self, hwnd, title, decision):
+        """写入匹配结果，缓存满时淘汰最久未使用的条目"""
+        key = (hwnd, title)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        else:
+            while len(self._entries) >= self.max_size:
+                (old_hwnd, old_title), _ = self._entries.popitem(last=False)
+                self._forget(old_hwnd, old_title)
+                self.evictions += 1
+            self._titles.setdefault(hwnd, set()).add(title)
+        self._entries[key] = decision
+
+    def _forget(self, hwnd, title):
+        titles = self._titles[hwnd]
+        titles.discard(title)
+        if not titles:
+            del self._titles[hwnd]
+
+    def prune(self, is_window):
+        """清理已销毁窗口的条目（每个窗口只调用一次is_window），返回清理的条目数"""
+        dead = [hwnd for hwnd in self._titles if not is_window(hwnd)]
+        removed = 0
+        for hwnd in dead:
+            removed += self.discard_window(hwnd)
+        return removed
+
+    def discard_window(self, hwnd):
+        """移除指定窗口的所有条目，返回移除的条目数"""
+        titles = self._titles.pop(hwnd, ())
+        for title in titles:
+            del self._entries[(hwnd, title)]
+        self.evictions += len(titles)
+        return len(titles)
+
+    def reset(self, max_size=None):
+        """清空缓存（配置重新加载后调用），统计计数保留"""
+        self._entries.clear()
+        self._titles.clear()
+        if max_size is not None:
+            self.max_size = max(1, max_size)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class ProcessNameCache:
+    """PID到进程映像名（小写文件名）的缓存
+
+    缓存项持有进程句柄，查询时先检查进程是否已退出，已退出则淘汰，
+    避免PID被新进程复用后得到错误的名称。
+    """
+
+    def __init__(self, backend, max_size=128):
+        self.backend = backend
+        self.max_size = max(1, max_size)
+        self._entries = OrderedDict()  # pid -> (映像名, 进程句柄)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, pid):
+        """返回进程映像名，无法查询时返回None"""
+        entry = self._entries.get(pid)
+        if entry is not None:
+            if self.backend.is_process_alive(entry[1]):
+                self._entries.move_to_end(pid)
+                self.hits += 1
+                return entry[0]
+            self._evict(pid)
+        self.misses += 1
+        if not pid:
+            return None
+        handle = self.backend.open_process(pid)
+        if handle is None:
+            return None
+        name = ntpath.basename(self.backend.get_process_image_name(handle)).lower()
+        while len(self._entries) >= self.max_size:
+            self._evict(next(iter(self._entries)))
+        self._entries[pid] = (name, handle)
+        return name
+
+    def _evict(self, pid):
+        name, handle = self._entries.pop(pid)
+        self.backend.close_process(handle)
+        self.evictions += 1
+
+    def prune(self):
+        """淘汰已退出进程的条目并关闭句柄（句柄会让已退出的进程对象一直留在内核中），返回淘汰的条目数"""
+        dead = [pid for pid, (_, handle) in self._entries.items() if not self.backend.is_process_alive(handle)]
+        for pid in dead:
+            self._evict(pid)
+        return len(dead)
+
+    def clear(self):
+        for pid in list(self._entries):
+            self._evict(pid)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+TK_CALL_REPORT_INTERVAL = 60000  # 界面定期记录Tk调用频率的间隔(ms)
+
+
+class TkCallCounter:
+    """统计Tk调用次数，用于确认空闲时的重绘开销"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.total = 0
+        self._last_total = 0
+        self._last_time = clock()
+
+    def add(self, count=1):
+        self.total += count
+
+    def rate(self):
+        """返回自上次调用以来的每秒Tk调用次数"""
+        now = self.clock()
+        elapsed = now - self._last_time
+        calls = self.total - self._last_total
+        self._last_total = self.total
+        self._last_time = now
+        return calls / elapsed if elapsed > 0 else 0.0
+
+
+class FrameCoalescer:
+    """把高频界面事件合并到显示帧：每帧每类事件最多处理一次，且只处理最新的一次
+
+    schedule为Tk的after，所有类型的事件共用一个定时器。
+    """
+
+    def __init__(self, schedule, frame_ms=16):
+        self.schedule = schedule
+        self.frame_ms = frame_ms
+        self._pending = {}  # 事件类型 -> (处理函数, 参数)
+        self._scheduled = False
+
+    def submit(self, key, handler, *args):
+        """提交事件，同类型的旧事件被新事件覆盖"""
+        self._pending[key] = (handler, args)
+        if not self._scheduled:
+            self._scheduled = True
+            self.schedule(self.frame_ms, self.flush)
+
+    def discard(self, key):
+        """丢弃尚未处理的某类事件"""
+        self._pending.pop(key, None)
+
+    def flush(self):
+        """立即处理所有待处理事件"""
+        self._scheduled = False
+        pending, self._pending = self._pending, {}
+        for handler, args in pending.values():
+            handler(*args)
+
+
+class IndicatorRenderer:
+    """在单个Canvas上绘制"Caps Lock ON/OFF"，只有显示内容变化时才调用Tk"""
+
+    def __init__(self, canvas, font=("Arial", 22, "bold"), counter=None, coalescer=None):
+        self.canvas = canvas
+        self.counter = counter if counter is not None else TkCallCounter()
+        self.coalescer = coalescer
+        self._background = None
+        self._status_text = None
+        self._size = None
+        self._caps_item = canvas.create_text(0, 0, text="Caps Lock", anchor='w', fill="white", font=font)
+        self._status_item = canvas.create_text(0, 0, text="", anchor='center', fill="white", font=font)
+        # 固定文本宽度，以及状态文本的固定宽度（4个字符，足够容纳"OFF"），确保ON/OFF切换时文本不动
+        x1, _, x2, _ = canvas.bbox(self._caps_item)
+        self._caps_width = x2 - x1
+        from tkinter import font as tkfont
+        self._status_width = tkfont.Font(root=canvas, font=font).measure("0") * 4
+        self.counter.add(4)
+        canvas.bind("<Configure>", self._on_configure)
+
+    def render(self, caps_lock_on, color_on, color_off):
+        """按状态绘制，与上次绘制相同时不做任何Tk调用"""
+        background = color_on if caps_lock_on else color_off
+        status_text = "ON" if caps_lock_on else "OFF"
+        if background != self._background:
+            self.canvas.configure(bg=background)
+            self._background = background
+            self.counter.add()
+        if status_text != self._status_text:
+            self.canvas.itemconfigure(self._status_item, text=status_text)
+            self._status_text = status_text
+            self.counter.add()
+
+    def _on_configure(self, event):
+        """画布尺寸变化时重新居中文本（拖动调整大小时每帧最多布局一次）"""
+        if self.coalescer is not None:
+            self.coalescer.submit('layout', self._layout, event.width, event.height)
+        else:
+            self._layout(event.width, event.height)
+
+    def _layout(self, width, height):
+        size = (width, height)
+        if size == self._size:
+            return
+        self._size = size
+        left = (width - (self._caps_width + 5 + self._status_width)) / 2
+        middle = height / 2
+        self.canvas.coords(self._caps_item, left, middle)
+        self.canvas.coords(self._status_item, left + self._caps_width + 5 + self._status_width / 2, middle)
+        self.counter.add(2)
+
+
+class RateLimitFilter(logging.Filter):
+    """相同的日志消息在interval秒内只记录一次，下一次记录时附上省略的次数"""
+
+    def __init__(self, interval=10, max_keys=1000, clock=time.monotonic):
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self.clock = clock
+        self._seen = {}  # (级别, 消息内容) -> [上次记录时间, 省略次数]
+
+    def filter(self, record):
+        message = record.getMessage()
+        key = (record.levelno, message)
+        now = self.clock()
+        seen = self._seen.get(key)
+        if seen is not None and now - seen[0] < self.interval:
+            seen[1] += 1
+            return False
+        if seen is not None and seen[1]:
+            record.msg = f"{message}（此前重复{seen[1]}次已省略）"
+            record.args = None
+        if len(self._seen) >= self.max_keys:
+            self._seen.clear()
+        self._seen[key] = [now, 0]
+        return True
+
+
+class AgeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """按大小和时间轮转的日志文件，轮转时删除超过保留天数的旧日志"""
+
+    def __init__(self, filename, max_bytes=1048576, backup_count=5, max_age=86400, retention_days=30, clock=time.time):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.max_age = max_age
+        self.retention_days = retention_days
+        self.clock = clock
+        try:
+            self._opened_at = os.path.getmtime(filename)
+        except OSError:
+            self._opened_at = clock()
+        self.prune_old_logs()
+
+    def shouldRollover(self, record):
+        if self.clock() - self._opened_at >= self.max_age and os.path.exists(self.baseFilename):
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._opened_at = self.clock()
+        self.prune_old_logs()
+
+    def prune_old_logs(self):
+        """删除日志目录中超过保留天数的日志文件（包括旧版本按天生成的log_*.txt）"""
+        folder = os.path.dirname(self.baseFilename)
+        base = os.path.basename(self.baseFilename)
+        deadline = self.clock() - self.retention_days * 86400
+        for name in os.listdir(folder):
+            if not (name.startswith(base) or (name.startswith('log_') and name.endswith('.txt'))):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                if path != self.baseFilename and os.path.getmtime(path) < deadline:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class LogPipeline:
+    """异步日志管道：调用线程只把记录放入队列，由后台监听线程限流后写入轮转日志文件"""
+
+    def __init__(self, log_folder='logs', filename='caps_lock_checker.log'):
+        os.makedirs(log_folder, exist_ok=True)
+        self.file_handler = AgeRotatingFileHandler(os.path.join(log_folder, filename))
+        self.file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        self.queue = queue.SimpleQueue()
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        # 在调用线程中过滤重复消息，被省略的消息不会进入队列
+        self.queue_handler.addFilter(RateLimitFilter())
+        self.listener = logging.handlers.QueueListener(self.queue, self.file_handler)
+
+    def start(self):
+        root_logger = logging.getLogger()
+        root_logger.addHandler(self.queue_handler)
+        root_logger.setLevel(logging.INFO)
+        self.listener.start()
+
+    def apply_config(self, config):
+        """按配置设置日志级别和轮转参数"""
+        logging.getLogger().setLevel(getattr(logging, config['log_level'], logging.INFO))
+        self.file_handler.maxBytes = config['log_max_bytes']
+        self.file_handler.backupCount = config['log_backup_count']
+        self.file_handler.retention_days = config['log_retention_days']
+
+    def stop(self):
+        """写完队列中剩余的日志后停止监听线程"""
+        self.listener.stop()
+        logging.getLogger().removeHandler(self.queue_handler)
+        self.file_handler.close()
+
+
+class LatencyHistogram:
+    """固定内存的对数分桶延迟直方图，覆盖1µs~100s，相对误差约4%"""
+
+    MIN_SECONDS = 1e-6
+    BUCKETS_PER_OCTAVE = 16
+    BUCKET_COUNT = 27 * BUCKETS_PER_OCTAVE + 1
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        if seconds <= self.MIN_SECONDS:
+            index = 0
+        else:
+            index = min(self.BUCKET_COUNT - 1,
+                        1 + int(math.log2(seconds / self.MIN_SECONDS) * self.BUCKETS_PER_OCTAVE))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent):
+        """返回百分位数（秒），取所在分桶的上界"""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for index, bucket in enumerate(self.counts):
+            seen += bucket
+            if seen >= target:
+                return min(self.max, self.MIN_SECONDS * 2 ** (index / self.BUCKETS_PER_OCTAVE))
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 4) if self.count else 0.0,
+            'p50_ms': round(self.percentile(50) * 1000, 4),
+            'p95_ms': round(self.percentile(95) * 1000, 4),
+            'p99_ms': round(self.percentile(99) * 1000, 4),
+            'max_ms': round(self.max * 1000, 4),
+        }
+
+
+class SwitchMetrics:
+    """切换延迟统计：前台切换事件 → 判定 → 按键注入 → GetKeyState确认"""
+
+    STAGES = ('event_to_decision', 'decision_to_inject', 'inject_to_confirm', 'event_to_confirm', 'tick')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.switches = 0
+        self.toggles = 0
+        self.left_alone = 0
+        self.ignored_windows = 0
+        self.suppressed_toggles = 0
+        self.toggle_retries = 0
+        self.confirmed_by_hook = 0
+        self.inject_blocked = 0
+        self.confirm_failures = 0
+        self.started_at = time.time()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.histograms[stage].record(seconds)
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'uptime_s': round(time.time() - self.started_at, 1),
+                'switches': self.switches,
+                'toggles': self.toggles,
+                'left_alone': self.left_alone,
+                'ignored_windows': self.ignored_windows,
+                'suppressed_toggles': self.suppressed_toggles,
+                'toggle_retries': self.toggle_retries,
+                'confirmed_by_hook': self.confirmed_by_hook,
+                'inject_blocked': self.inject_blocked,
+                'confirm_failures': self.confirm_failures,
+                'latency': {stage: histogram.snapshot() for stage, histogram in self.histograms.items()},
+            }
+
+
+def format_stats(stats):
+    """把引擎统计格式化为便于阅读的文本"""
+    lines = [
+        f"运行时间: {stats['uptime_s']:.0f}秒",
+        f"窗口切换: {stats['switches']}次，切换Caps Lock: {stats['toggles']}次，"
+        f"按规则不处理: {stats['left_alone']}次，忽略临时窗口: {stats['ignored_windows']}次，"
+        f"未稳定的切换省去切换: {stats['suppressed_toggles']}次",
+        f"重新注入: {stats['toggle_retries']}次，按键盘钩子确认: {stats['confirmed_by_hook']}次，"
+        f"注入被拒绝: {stats['inject_blocked']}次，最终状态不一致: {stats['confirm_failures']}次",
+        f"检测方式: {stats['source']}",
+    ]
+    if 'polling' in stats:
+        polling = stats['polling']
+        state = "已暂停（会话锁定或屏幕保护）" if polling['paused'] else f"{polling['rate_hz']}次/秒"
+        lines.append(f"轮询间隔: {polling['interval_ms']:.0f}ms，{state}，累计{polling['ticks']}次")
+    lines += [
+        "",
+        "延迟(ms)            次数     p50      p95      p99      max",
+    ]
+    for stage, latency in stats['latency'].items():
+        lines.append(f"{stage:<18}{latency['count']:>6}{latency['p50_ms']:>9.3f}{latency['p95_ms']:>9.3f}"
+                     f"{latency['p99_ms']:>9.3f}{latency['max_ms']:>9.3f}")
+    cache = stats['decision_cache']
+    lines.append("")
+    lines.append(f"匹配缓存: {cache['size']}/{cache['max_size']}，命中{cache['hits']}，"
+                 f"未命中{cache['misses']}，淘汰{cache['evictions']}")
+    cache = stats['process_cache']
+    lines.append(f"进程名缓存: {cache['size']}/{cache['max_size']}，命中{cache['hits']}，"
+                 f"未命中{cache['misses']}，淘汰{cache['evictions']}")
+    return "\n".join(lines)
+
+
+def process_uptime():
+    """进程已运行的秒数（包括PyInstaller单文件解包和解释器初始化），无法获取时返回None"""
+    if win32process is not None:
+        try:
+            created = win32process.GetProcessTimes(win32api.GetCurrentProcess())['CreationTime']
+            return time.time() - created.timestamp()
+        except Exception:
+            return None
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupProfiler:
+    """记录启动各阶段的耗时和关键时间点（平时也记录，开销只是几次计时；--profile-startup时输出）"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        uptime = process_uptime()
+        # 进程创建到开始记录之间的时间：解包、解释器初始化和模块导入
+        self.before_main = uptime
+        self.phases = []  # (阶段名, 耗时秒)
+        self.events = {}  # 时间点名 -> 距开始记录的秒数
+        self._last = self.started
+
+    def mark(self, name):
+        """结束一个阶段，记录距上一个阶段结束的耗时"""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def event(self, name, when=None):
+        """记录一个时间点（同名只记录第一次）"""
+        if name not in self.events:
+            self.events[name] = (time.perf_counter() if when is None else when) - self.started
+
+    def report(self):
+        return {
+            'before_main_ms': round(self.before_main * 1000, 1) if self.before_main is not None else None,
+            'imports_ms': {name: round(seconds * 1000, 3) for name, seconds in IMPORT_TIMES.items()},
+            'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in self.phases},
+            'events_ms': {name: round(seconds * 1000, 3) for name, seconds in self.events.items()},
+        }
+
+    def publish(self, report, logger, path=os.path.join('logs', 'startup_profile.json')):
+        """把启动耗时报告写入日志、文件和标准输出（--noconsole打包时没有标准输出）"""
+        text = format_startup_report(report)
+        logger.info(f"启动耗时\n{text}")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logger.warning(f"写入启动耗时报告失败: {e}")
+        if sys.stdout is not None:
+            print(text, flush=True)
+
+
+def format_startup_report(report):
+    """把启动耗时报告格式化为便于阅读的文本"""
+    lines = []
+    if report['before_main_ms'] is not None:
+        lines.append(f"进程创建到main: {report['before_main_ms']:.1f}ms（含解包、解释器初始化和模块导入）")
+    lines.append("导入耗时(ms):")
+    lines += [f"  {name:<20}{ms:>10.3f}" for name, ms in report['imports_ms'].items()]
+    lines.append("启动阶段(ms):")
+    lines += [f"  {name:<20}{ms:>10.3f}" for name, ms in report['phases_ms'].items()]
+    lines.append("时间点(距main开始, ms):")
+    lines += [f"  {name:<20}{ms:>10.3f}" for name, ms in report['events_ms'].items()]
+    return "\n".join(lines)
+
+
+# 默认配置
+DEFAULT_CONFIG = {
+    'color_caps_on': '#fa6666',
+    'color_caps_off': '#4CAF50',
+    'color_titlebar': '#2c3e50',
+    'window_width': 250,
+    'window_height': 150,
+    'window_x': -1,
+    'window_y': -1,
+    'always_on_top': 0,
+    'geometry_save_delay': 1000,  # 拖动或调整大小后延迟写回窗口位置的时间(ms)
+    'foreground_backend': 'auto',  # 前台窗口检测方式: auto / winevent / polling
+    'poll_interval_min': 100,  # 轮询检测的最小间隔(ms)，有输入或刚切换窗口时使用，仅polling方式
+    'poll_interval_max': 1000,  # 轮询检测的最大间隔(ms)，前台窗口稳定时逐步退避到此值
+    'settle_time': 100,  # 前台窗口保持这么久(ms)才按规则切换，快速Alt-Tab经过的窗口不切换；0表示立即切换
+    'ignore_tool_windows': True,  # 忽略工具窗口（WS_EX_TOOLWINDOW / WS_EX_NOACTIVATE）
+    # 忽略的窗口类：提示框、菜单、任务栏和Alt-Tab切换界面
+    'ignore_classes': ['tooltips_class32', '#32768', 'Shell_TrayWnd', 'TaskSwitcherWnd', 'MultitaskingViewFrame',
+                       'XamlExplorerHostIslandWindow', 'ForegroundStaging'],
+    'caps_poll_interval': 250,  # 无键盘钩子时Caps Lock状态同步的最小间隔(ms)，空闲时退避到poll_interval_max
+    'keyboard_hook': True,  # 通过低级键盘钩子跟踪Caps Lock按键
+    'caps_reconcile_interval': 5000,  # 有键盘钩子时核对Caps Lock实际状态的间隔(ms)
+    'confirm_interval': 2,  # 注入切换后读取GetKeyState确认状态的间隔(ms)
+    # 注入后这么久(ms)状态仍未改变、且键盘钩子没看到注入的按键才重新注入；
+    # 没有键盘钩子时应大于GetKeyState反映新状态的最大延迟，否则会多切换一次
+    'confirm_timeout': 200,
+    'toggle_retries': 2,  # 注入一直未生效时重新注入的次数，0表示不重新注入
+    'manual_override_size': 256,  # 记住用户手动切换的窗口数量上限
+    'decision_cache_size': 256,  # 窗口匹配结果缓存容量
+    'config_watch_interval': 2000,  # 配置文件变更检查间隔(ms)，0表示不自动重新加载
+    'metrics_interval': 300,  # 统计数据写入logs/metrics.json的间隔(秒)，0表示不写入
+    'log_level': 'INFO',  # 日志级别: DEBUG / INFO / WARNING / ERROR
+    'log_max_bytes': 1048576,  # 单个日志文件大小上限(字节)，超过后轮转
+    'log_backup_count': 5,  # 保留的轮转日志文件数量
+    'log_retention_days': 30,  # 日志文件保留天数
+    'software_list': ['CAXA'],  # 默认检测软件列表（按窗口标题匹配）
+    'process_list': [],  # 按进程映像名匹配的软件列表，如 caxa.exe, sldworks.exe
+    'default_action': 'off',  # 没有规则命中时的动作: on / off / keep
+    'rules': [],  # 切换规则"动作, 优先级, 条件"，配置文件中每条写一行rule = ...
+    'policy_snapshot': False,  # 编译好的切换规则写成快照文件，同一目录下运行的多个实例共享映射
+}
+
+# 使用字典映射处理配置键值，提高效率
+CONFIG_HANDLERS = {
+    'color_caps_on': str,
+    'color_caps_off': str,
+    'color_titlebar': str,
+    'window_width': int,
+    'window_height': int,
+    'window_x': int,
+    'window_y': int,
+    'always_on_top': lambda v: v.strip().lower() in ['true', '1', 'yes', 'on'],
+    'geometry_save_delay': int,
+    'foreground_backend': lambda v: v.strip().lower(),
+    'poll_interval_min': int,
+    'poll_interval_max': int,
+    'caps_poll_interval': int,
+    'keyboard_hook': lambda v: v.strip().lower() in ['true', '1', 'yes', 'on'],
+    'settle_time': int,
+    'ignore_tool_windows': lambda v: v.strip().lower() in ['true', '1', 'yes', 'on'],
+    'ignore_classes': lambda v: [name.strip() for name in v.split(',') if name.strip()],
+    'caps_reconcile_interval': int,
+    'confirm_interval': int,
+    'confirm_timeout': int,
+    'toggle_retries': int,
+    'manual_override_size': int,
+    'decision_cache_size': int,
+    'config_watch_interval': int,
+    'metrics_interval': int,
+    'log_level': lambda v: v.strip().upper(),
+    'log_max_bytes': int,
+    'log_backup_count': int,
+    'log_retention_days': int,
+    'software_list': lambda v: [sw.strip() for sw in v.split(',') if sw.strip()],  # 解析软件列表
+    'process_list': lambda v: [name.strip().lower() for name in v.split(',') if name.strip()],
+    'default_action': lambda v: v.strip().lower(),
+    'policy_snapshot': lambda v: v.strip().lower() in ['true', '1', 'yes', 'on'],
+}
+
+CONFIG_CACHE_VERSION = 2
+POLICY_SNAPSHOT_POINTER = 'current'  # 指针文件，内容为当前版本快照的文件名
+POLICY_SNAPSHOT_KEEP = 3  # 保留的旧版本快照数量，其他实例可能还映射着它们
+POLICY_SNAPSHOT_LOCK_TIMEOUT = 10  # 后台线程等待其他实例发布快照的最长时间(秒)，超过后在进程内编译
+
+
+class PolicySnapshotStore:
+    """切换规则快照目录：版本化的快照文件，加一个指向当前版本的指针文件
+
+    规则变化时由一个实例（持有发布锁）编译并写入新版本文件，再用os.replace原子替换指针文件；
+    已映射旧版本的实例不受影响，其他实例按指针文件的(mtime, size, inode)发现新版本，只需读取文件头。
+    """
+
+    def __init__(self, directory='.policy_snapshot', logger=None):
+        self.directory = directory
+        self.pointer_path = os.path.join(directory, POLICY_SNAPSHOT_POINTER)
+        self.lock_path = os.path.join(directory, 'publish.lock')
+        self.logger = logger or logging.getLogger(__name__)
+        self.current = None  # 最近一次映射的PolicySnapshot
+        self.loaded_signature = None
+
+    @staticmethod
+    def rules_key(config):
+        """决定编译结果的配置项的摘要，快照的规则摘要与它一致才能直接使用"""
+        import hashlib
+
+        rules = [POLICY_SNAPSHOT_FORMAT, config['rules'], config['software_list'], config['process_list'],
+                 config['default_action']]
+        return hashlib.blake2b(json.dumps(rules, ensure_ascii=False).encode('utf-8'), digest_size=16).digest()
+
+    def signature(self):
+        """返回指针文件的(mtime, size, inode)，不存在返回None"""
+        try:
+            st = os.stat(self.pointer_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def changed(self):
+        return self.signature() != self.loaded_signature
+
+    def load(self, config, cancel=None, wait=False):
+        """返回与config的切换规则一致的快照；没有时编译并发布新版本
+
+        其他实例正在发布时：wait为True则等待它完成（最长POLICY_SNAPSHOT_LOCK_TIMEOUT秒，cancel置位时提前放弃），
+        只应在后台线程中这样调用；否则直接在进程内编译。无法使用快照目录时同样退回到进程内编译，返回PolicyTable。
+        """
+        key = self.rules_key(config)
+        snapshot = self._open_current(key)
+        if snapshot is not None:
+            return snapshot
+        try:
+            lock = self._acquire_lock()
+            if lock is None and wait:
+                lock, snapshot = self._wait_for(key, cancel)
+        except OSError as e:
+            self.logger.warning(f"无法使用切换规则快照目录，改为进程内编译: {e}")
+            return PolicyTable.from_config(config)
+        if snapshot is not None:
+            return snapshot
+        if lock is None:
+            return PolicyTable.from_config(config)
+        try:
+            # 等锁期间其他实例可能已经发布
+            snapshot = self._open_current(key)
+            if snapshot is not None:
+                return snapshot
+            table = PolicyTable.from_config(config)
+            try:
+                return self._publish(table, key)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"发布切换规则快照失败，使用进程内编译的规则: {e}")
+                return table
+        finally:
+            self._release_lock(lock)
+
+    def refresh(self, key):
+        """指针文件变化时映射新版本（规则摘要须一致），返回新的快照；没有新版本返回None"""
+        if not self.changed():
+            return None
+        previous = self.current
+        snapshot = self._open_current(key)
+        return snapshot if snapshot is not previous else None
+
+    def open_current(self):
+        """映射指针文件指向的当前版本快照（已映射的版本不重复映射），没有或无法映射时返回None"""
+        signature = self.signature()
+        if signature is None:
+            return None
+        try:
+            with open(self.pointer_path, 'r', encoding='utf-8') as f:
+                name = f.read().strip()
+            if not name or os.path.basename(name) != name:
+                raise ValueError(f"指针文件内容无效: {name!r}")
+            snapshot = self.current
+            if snapshot is None or os.path.basename(snapshot.path) != name:
+                snapshot = PolicySnapshot.open(os.path.join(self.directory, name))
+        except (OSError, ValueError) as e:
+            self.logger.debug(f"无法映射切换规则快照: {e}")
+            return None
+        self.current = snapshot
+        self.loaded_signature = signature
+        return snapshot
+
+    def _open_current(self, key):
+        """当前版本的规则摘要与key一致时返回它"""
+        snapshot = self.open_current()
+        return snapshot if snapshot is not None and snapshot.key == key else None
+
+    def _publish(self, table, key):
+        generation = (self.current.generation if self.current is not None else 0) + 1
+        name = f'policy-{generation:06d}-{key.hex()[:12]}-{os.getpid()}.bin'
+        path = os.path.join(self.directory, name)
+        data = PolicySnapshot.serialize(table, generation, key)
+        for target, content in ((path, data), (self.pointer_path, name.encode('utf-8'))):
+            tmp_path = f'{target}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, target)
+        snapshot = PolicySnapshot.open(path)
+        self.current = snapshot
+        self.loaded_signature = self.signature()
+        self.logger.info(f"已发布切换规则快照: {name}（{len(data)}字节）")
+        self._prune(name)
+        return snapshot
+
+    def _prune(self, current_name):
+        """删除较旧的版本，保留最近POLICY_SNAPSHOT_KEEP个（Windows上仍被映射的文件删除失败，下次再删）"""
+        try:
+            names = sorted(name for name in os.listdir(self.directory)
+                           if name.startswith('policy-') and name.endswith('.bin') and name != current_name)
+        except OSError:
+            return
+        for name in names[:-POLICY_SNAPSHOT_KEEP]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def _acquire_lock(self):
+        """获取发布锁，返回持有锁的文件描述符；已被其他实例持有时返回None
+
+        用操作系统的文件锁而不是锁文件是否存在来判断：持有锁的进程崩溃或被结束时锁随之释放，
+        发布耗时再长也不会被其他实例当作失效的锁抢走。
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR)
+        try:
+            if sys.platform == 'win32':
+                import msvcrt
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            os.close(fd)
+            if sys.platform != 'win32' and not isinstance(e, BlockingIOError):
+                raise
+            return None
+        return fd
+
+    def _release_lock(self, fd):
+        """释放发布锁；锁文件保留，避免与正在打开它的实例竞争"""
+        try:
+            if sys.platform == 'win32':
+                import msvcrt
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _wait_for(self, key, cancel=None):
+        """等待其他实例发布，返回(发布锁, 快照)：对方发布了一致的快照时返回快照，
+        对方释放了锁（包括进程退出）但没有发布时取得锁返回；超时或cancel置位返回(None, None)"""
+        cancel = cancel or threading.Event()
+        deadline = time.monotonic() + POLICY_SNAPSHOT_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            if cancel.wait(0.02):
+                return None, None
+            snapshot = self._open_current(key)
+            if snapshot is not None:
+                return None, snapshot
+            fd = self._acquire_lock()
+            if fd is not None:
+                return fd, None
+        return None, None
+
+
+class ConfigStore:
+    """config.txt的读取、编译和变更检测
+
+    用os.stat得到的(mtime, size, inode)判断文件是否变化：未变化时直接复用上次的结果，
+    解析结果还会缓存到磁盘，启动时文件未变化即可跳过解析；编译好的切换规则由PolicySnapshotStore共享。
+    """
+
+    def __init__(self, path='config.txt', cache_path='.config_cache.json', logger=None, snapshot_dir='.policy_snapshot'):
+        self.path = path
+        self.cache_path = cache_path
+        self.logger = logger or logging.getLogger(__name__)
+        self.snapshots = PolicySnapshotStore(snapshot_dir, self.logger)
+        self._lock = threading.Lock()  # 保护配置文件的读写和已加载的结果
+        self._load_lock = threading.Lock()  # 同一时间只编译一次
+        self.loaded_signature = None
+        self.config = None
+        self.policy = None
+
+    def signature(self):
+        """返回配置文件的(mtime, size, inode)，文件不存在返回None"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def changed(self):
+        """配置文件变化，或者正在使用的规则快照发布了新版本"""
+        if self.signature() != self.loaded_signature:
+            return True
+        return isinstance(self.policy, PolicySnapshot) and self.snapshots.changed()
+
+    def load(self, cancel=None, wait=False):
+        """读取并编译配置，返回(config, policy)
+
+        wait为True时其他实例正在发布规则快照则等待它完成（cancel置位时放弃），只应在后台线程中这样调用；
+        界面线程中调用时直接在进程内编译。
+        """
+        with self._load_lock:
+            with self._lock:
+                if not os.path.exists(self.path):
+                    # 配置文件不存在，生成默认配置文件
+                    self.write_config_file(self._defaults())
+                    self.logger.info("配置文件不存在，已生成默认配置")
+                signature = self.signature()
+                if signature is not None and signature == self.loaded_signature:
+                    if isinstance(self.policy, PolicySnapshot):
+                        snapshot = self.snapshots.refresh(self.policy.key)
+                        if snapshot is not None:
+                            self.logger.info(f"切换规则快照已更新为第{snapshot.generation}版")
+                            self.policy = snapshot
+                    return self.config, self.policy
+                config = self._load_cache(signature)
+                if config is None:
+                    config, ok = self._parse()
+                    if ok:
+                        self._save_cache(signature, config)
+                    elif self.config is not None:
+                        # 文件可能正被复制或占用：保留当前配置，不记录签名，下次检查时重试
+                        self.logger.warning("配置文件读取失败，继续使用当前配置，稍后重试")
+                        return self.config, self.policy
+                    else:
+                        # 启动时读取失败只能使用默认配置，同样不记录签名
+                        signature = None
+
+            # 编译切换规则，检测时只需一次查表；等待快照时不占用_lock，保存窗口位置不会被卡住
+            if not config['software_list'] and not config['process_list'] and not config['rules']:
+                config['software_list'] = ['CAXA']
+            if config['policy_snapshot']:
+                policy = self.snapshots.load(config, cancel, wait)
+            else:
+                policy = PolicyTable.from_config(config)
+            for entry, error in policy.errors:
+                self.logger.warning(f"切换规则无效，已忽略: {entry} ({error})")
+            with self._lock:
+                self.config, self.policy = config, policy
+                self.loaded_signature = signature
+            return config, policy
+
+    def reload_if_changed(self):
+        """文件变化时重新读取，返回新的(config, policy)；未变化返回None"""
+        if not self.changed():
+            return None
+        return self.load()
+
+    def _defaults(self):
+        config = dict(DEFAULT_CONFIG)
+        config['software_list'] = list(DEFAULT_CONFIG['software_list'])
+        config['rules'] = []
+        return config
+
+    def _parse(self):
+        """逐行解析配置文件，返回(config, 是否成功)"""
+        config = self._defaults()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+
+            for line in lines:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+
+                if '=' in line:
+                    key, value = line.split('=', 1)
+                    key = key.strip()
+                    value = value.strip()
+
+                    # 处理注释
+                    if ';' in value:
+                        value = value.split(';')[0].strip()
+
+                    if key == 'rule':
+                        # 规则可以写多行，按书写顺序全部保留
+                        config['rules'].append(value)
+                    elif key in CONFIG_HANDLERS:
+                        try:
+                            config[key] = CONFIG_HANDLERS[key](value)
+                        except ValueError:
+                            # 只忽略这一项，不影响后面的配置项
+                            self.logger.warning(f"配置项{key}的值无效，使用默认值: {value}")
+
+            self.logger.info("配置文件读取成功")
+            self.logger.debug(f"配置内容: {config}")
+            return config, True
+        except Exception as e:
+            self.logger.error(f"读取配置文件失败: {str(e)}", exc_info=True)
+            return config, False
+
+    def _load_cache(self, signature):
+        """签名一致时返回缓存的解析结果"""
+        if signature is None:
+            return None
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cache.get('version') != CONFIG_CACHE_VERSION or cache.get('signature') != list(signature):
+            return None
+        config = self._defaults()
+        config.update({key: value for key, value in cache.get('config', {}).items() if key in DEFAULT_CONFIG})
+        self.logger.info("配置文件未变化，使用缓存的配置")
+        return config
+
+    def _save_cache(self, signature, config):
+        if signature is None:
+            return
+        try:
+            tmp_path = self.cache_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': CONFIG_CACHE_VERSION, 'signature': list(signature), 'config': config},
+                          f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            self.logger.warning(f"写入配置缓存失败: {e}")
+
+    def update_values(self, values):
+        """只改写配置文件中指定的键，其余内容（包括注释）保持不变
+
+        先写临时文件再原子替换，写入过程中崩溃也不会留下不完整的配置文件。
+        """
+        with self._lock:
+            unchanged_since_load = self.signature() == self.loaded_signature
+            lines = []
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    lines = f.readlines()
+
+            updated = set()
+            new_lines = []
+            for line in lines:
+                stripped = line.strip()
+                if stripped and not stripped.startswith('#') and '=' in stripped:
+                    key, value = stripped.split('=', 1)
+                    key = key.strip()
+                    if key in values:
+                        # 同一个键出现多次时全部改写（读取时以最后一次为准）；保留原有注释和它前面的空白
+                        comment = ''
+                        if ';' in value:
+                            head, comment = value.split(';', 1)
+                            comment = f"{head[len(head.rstrip()):]};{comment}"
+                        new_lines.append(f'{key} = {values[key]}{comment}\n')
+                        updated.add(key)
+                        continue
+                new_lines.append(line if line.endswith('\n') else line + '\n')
+            for key, value in values.items():
+                if key not in updated:
+                    new_lines.append(f'{key} = {value}\n')
+
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(new_lines)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+            # 自己写入引起的变化不需要重新解析；写入前文件已被别人修改则留给变更检测处理
+            if unchanged_since_load and self.config is not None:
+                self.config = dict(self.config, **values)
+                self.loaded_signature = self.signature()
+                self._save_cache(self.loaded_signature, self.config)
+
+    def write_config_file(self, config):
+        """将配置写入文件"""
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                f.write('# Caps Lock 检测器配置文件\n')
+                f.write('# 颜色设置\n')
+                f.write(f"color_caps_on = {config['color_caps_on']}\n")
+                f.write(f"color_caps_off = {config['color_caps_off']}\n")
+                f.write(f"color_titlebar = {config['color_titlebar']}\n")
+                f.write('\n# 窗口设置\n')
+                f.write(f"window_width = {config['window_width']}\n")
+                f.write(f"window_height = {config['window_height']}\n")
+                f.write(f"window_x = {config['window_x']}\n")
+                f.write(f"window_y = {config['window_y']}\n")
+                f.write(f"geometry_save_delay = {config['geometry_save_delay']}\n")
+                f.write('\n# 其他设置\n')
+                f.write(f"always_on_top = {'true' if config['always_on_top'] else 'false'}\n")
+                f.write('\n# 检测设置\n')
+                f.write(f"foreground_backend = {config['foreground_backend']}\n")
+                f.write(f"poll_interval_min = {config['poll_interval_min']}\n")
+                f.write(f"poll_interval_max = {config['poll_interval_max']}\n")
+                f.write(f"settle_time = {config['settle_time']}\n")
+                f.write(f"ignore_tool_windows = {'true' if config['ignore_tool_windows'] else 'false'}\n")
+                f.write(f"ignore_classes = {','.join(config['ignore_classes'])}\n")
+                f.write(f"caps_poll_interval = {config['caps_poll_interval']}\n")
+                f.write(f"keyboard_hook = {'true' if config['keyboard_hook'] else 'false'}\n")
+                f.write(f"caps_reconcile_interval = {config['caps_reconcile_interval']}\n")
+                f.write(f"confirm_interval = {config['confirm_interval']}\n")
+                f.write(f"confirm_timeout = {config['confirm_timeout']}\n")
+                f.write(f"toggle_retries = {config['toggle_retries']}\n")
+                f.write(f"manual_override_size = {config['manual_override_size']}\n")
+                f.write(f"decision_cache_size = {config['decision_cache_size']}\n")
+                f.write(f"config_watch_interval = {config['config_watch_interval']}\n")
+                f.write(f"metrics_interval = {config['metrics_interval']}\n")
+                f.write('\n# 日志设置\n')
+                f.write(f"log_level = {config['log_level']}\n")
+                f.write(f"log_max_bytes = {config['log_max_bytes']}\n")
+                f.write(f"log_backup_count = {config['log_backup_count']}\n")
+                f.write(f"log_retention_days = {config['log_retention_days']}\n")
+                f.write('\n# 软件列表\n')
+                f.write(f"software_list = {','.join(config['software_list'])}\n")  # 写入软件列表
+                f.write(f"process_list = {','.join(config['process_list'])}\n")
+                f.write('\n# 切换规则: rule = 动作(on/off/keep), 优先级, 条件（proc:进程名 或 窗口标题条件）\n')
+                f.write('# 优先级高的规则先生效；keep表示不处理，切换到该软件时不改变Caps Lock\n')
+                f.write(f"default_action = {config['default_action']}\n")
+                f.write('# 多个实例（如终端服务器上的各个会话）共享编译好的规则快照\n')
+                f.write(f"policy_snapshot = {'true' if config['policy_snapshot'] else 'false'}\n")
+                for rule in config['rules']:
+                    f.write(f"rule = {rule}\n")
+            self.logger.info("默认配置文件已生成")
+        except Exception as e:
+            self.logger.error(f"写入配置文件失败: {str(e)}")
+
+
+def parse_geometry(geometry):
+    """解析Tk的"宽x高+x+y"几何字符串，返回(宽, 高, x, y)，格式不符返回None"""
+    match = re.fullmatch(r'(\d+)x(\d+)\+(-?\d+)\+(-?\d+)', geometry)
+    if match is None:
+        return None
+    return tuple(int(value) for value in match.groups())
+
+
+class GeometryPersister:
+    """窗口位置和大小的延迟写回
+
+    拖动或调整大小时只记录最新的几何信息，delay毫秒内没有新变化才由后台线程写入配置文件；
+    与上次写入的内容相同时跳过。退出时调用flush立即写入一次。
+    """
+
+    def __init__(self, config_store, written=None, delay=1000, logger=None):
+        self.config_store = config_store
+        self.delay = delay / 1000
+        self.logger = logger or logging.getLogger(__name__)
+        self._written = written  # 配置文件中当前的(宽, 高, x, y)
+        self._pending = None
+        self._deadline = 0
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="caps-lock-geometry", daemon=True)
+        self._thread.start()
+
+    def update(self, geometry):
+        """记录最新的几何信息，重新开始计时"""
+        with self._cond:
+            self._pending = geometry
+            self._deadline = time.monotonic() + self.delay
+            self._cond.notify()
+
+    def flush(self):
+        """停止后台线程，并立即写入尚未写入的几何信息"""
+        with self._cond:
+            self._stopped = True
+            pending, self._pending = self._pending, None
+            self._cond.notify()
+        self._thread.join(2)
+        if pending is not None:
+            self._write(pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and (self._pending is None or time.monotonic() < self._deadline):
+                    timeout = None if self._pending is None else self._deadline - time.monotonic()
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                pending, self._pending = self._pending, None
+            self._write(pending)
+
+    def _write(self, geometry):
+        if geometry == self._written:
+            return
+        width, height, x, y = geometry
+        try:
+            self.config_store.update_values({'window_width': width, 'window_height': height,
+                                             'window_x': x, 'window_y': y})
+            self._written = geometry
+            self.logger.info(f"窗口位置已保存: {width}x{height}+{x}+{y}")
+        except Exception as e:
+            self.logger.error(f"保存窗口位置失败: {str(e)}", exc_info=True)
+
+
+class ConfigReloader:
+    """在后台线程中检查配置文件变化并重新读取、编译，只把完成的结果交给引擎线程
+
+    解析和编译上万条规则要几百毫秒，放在引擎线程中会推迟这期间的所有切换。
+    多次请求在一次读取完成前会合并为一次。
+    """
+
+    def __init__(self, config_store, on_loaded, logger=None):
+        self.config_store = config_store
+        self.on_loaded = on_loaded  # 在后台线程中以(config, policy)调用，应转交给引擎线程
+        self.logger = logger or logging.getLogger(__name__)
+        self._pending = None  # None: 没有请求，False: 变化时才重新读取，True: 强制重新读取
+        self._stopped = threading.Event()  # 也用来中止对其他实例发布规则快照的等待
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="caps-lock-config", daemon=True)
+        self._thread.start()
+
+    def request(self, force=False):
+        """请求一次检查（force为True时不论文件是否变化都重新读取），可从任意线程调用"""
+        with self._cond:
+            self._pending = bool(self._pending) or force
+            self._cond.notify()
+
+    def stop(self, timeout=2):
+        """停止后台线程，尚未开始的请求被丢弃"""
+        with self._cond:
+            self._stopped.set()
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped.is_set() and self._pending is None:
+                    self._cond.wait()
+                if self._stopped.is_set():
+                    return
+                force, self._pending = self._pending, None
+            try:
+                if not force:
+                    if not self.config_store.changed():
+                        continue
+                    self.logger.info("检测到配置文件变化，自动重新加载")
+                previous = self.config_store.config, self.config_store.policy
+                config, policy = self.config_store.load(self._stopped, wait=True)
+            except Exception as e:
+                self.logger.error(f"重新加载配置失败: {str(e)}", exc_info=True)
+                continue
+            if not force and config is previous[0] and policy is previous[1]:
+                continue  # 读取失败，沿用的配置无需再交给引擎
+            if not self._stopped.is_set():
+                self.on_loaded(config, policy)
+
+
+# 诊断记录文件格式：文件头后是连续的定长记录头加变长负载，只追加写入
+TRACE_MAGIC = b'CLKTRC01'
+TRACE_RECORD = struct.Struct('<BBdQIH')  # 类型, 标志, 时间(秒), hwnd, pid, 负载长度
+TRACE_SESSION = 0  # 一次运行的开始，时间为墙上时钟，之后记录的时间相对于本次运行开始
+TRACE_FOREGROUND = 1  # 前台窗口事件，负载为"标题\0进程名\0窗口类\0扩展样式"，标志位0为当时的Caps Lock状态
+TRACE_KEY = 2  # Caps Lock按键，标志位0表示本程序注入
+TRACE_CAPS = 3  # 核对时发现的Caps Lock状态变化，标志位0为新状态
+TRACE_TOGGLE = 4  # 引擎决定切换，标志位0为目标状态
+TRACE_FLUSH_INTERVAL = 1000  # 引擎定期把诊断记录交给写入线程的间隔(ms)
+
+
+class TraceRecorder:
+    """把引擎观察到的输入和切换决定记录到只追加的二进制文件，用于复现和回放
+
+    记录先编码进内存缓冲，攒够batch_size条或定期由引擎调用flush交给写入线程，引擎线程不做磁盘IO；
+    写入线程积压超过max_pending批时丢弃新的批次并计数，内存占用有上限。
+    """
+
+    def __init__(self, path, batch_size=256, max_pending=64):
+        self.path = path
+        self.batch_size = batch_size
+        self.records = 0
+        self.dropped = 0
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._chunks = queue.Queue(max_pending)
+        self._start = time.perf_counter()
+        self._file = open(path, 'a+b')
+        self._file.seek(0)
+        magic = self._file.read(len(TRACE_MAGIC))
+        if not magic:
+            self._file.write(TRACE_MAGIC)
+        elif magic != TRACE_MAGIC:
+            self._file.close()
+            raise ValueError(f"不是诊断记录文件: {path}")
+        self._thread = threading.Thread(target=self._run, name="caps-lock-trace", daemon=True)
+        self._thread.start()
+        self.record(TRACE_SESSION, time.time())
+
+    def record(self, kind, t, hwnd=0, pid=0, flags=0, payload=b''):
+        self._buffer += TRACE_RECORD.pack(kind, flags, t, hwnd, pid, len(payload))
+        self._buffer += payload
+        self._buffered += 1
+        self.records += 1
+        if self._buffered >= self.batch_size:
+            self.flush()
+
+    def _elapsed(self, event_time=None):
+        return (time.perf_counter() if event_time is None else event_time) - self._start
+
+    def foreground(self, hwnd, pid, title, process_name, caps_lock_on, event_time, window_class='', ex_style=0):
+        payload = f"{title}\0{process_name or ''}\0{window_class}\0{ex_style}".encode('utf-8', 'replace')[:0xFFFF]
+        self.record(TRACE_FOREGROUND, self._elapsed(event_time), hwnd, pid, int(caps_lock_on), payload)
+
+    def key(self, injected, event_time):
+        self.record(TRACE_KEY, self._elapsed(event_time), flags=int(injected))
+
+    def caps(self, caps_lock_on):
+        self.record(TRACE_CAPS, self._elapsed(), flags=int(caps_lock_on))
+
+    def toggle(self, hwnd, desired_status):
+        self.record(TRACE_TOGGLE, self._elapsed(), hwnd, flags=int(desired_status))
+
+    def flush(self):
+        """把缓冲的记录交给写入线程（不等待写盘）"""
+        if not self._buffered:
+            return
+        try:
+            self._chunks.put_nowait(bytes(self._buffer))
+        except queue.Full:
+            self.dropped += self._buffered
+        self._buffer.clear()
+        self._buffered = 0
+
+    def close(self):
+        """写入剩余记录并关闭文件"""
+        self.flush()
+        self._chunks.put(None)
+        self._thread.join(5)
+
+    def stats(self):
+        return {'path': self.path, 'records': self.records, 'dropped': self.dropped}
+
+    def _run(self):
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is None:
+                    return
+                self._file.write(chunk)
+                self._file.flush()
+        finally:
+            self._file.close()
+
+
+def read_trace(path):
+    """逐条读取诊断记录，返回(类型, 时间, hwnd, pid, 标志, 负载)；末尾不完整的记录被忽略"""
+    with open(path, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"不是诊断记录文件: {path}")
+        while True:
+            header = f.read(TRACE_RECORD.size)
+            if len(header) < TRACE_RECORD.size:
+                return
+            kind, flags, t, hwnd, pid, length = TRACE_RECORD.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield kind, t, hwnd, pid, flags, payload
+
+
+def open_trace(path, logger):
+    """打开诊断记录文件，失败时记录错误并返回None（不影响正常运行）"""
+    if not path:
+        return None
+    try:
+        trace = TraceRecorder(path)
+    except (OSError, ValueError) as e:
+        logger.error(f"打开诊断记录文件失败: {e}")
+        return None
+    logger.info(f"诊断记录写入: {path}")
+    return trace
+
+
+class CapsLockEngine:
+    """Caps Lock自动切换引擎，在独立线程中运行，不依赖Tk
+
+    检测和切换都在引擎线程中完成，状态变化放入线程安全的队列states，
+    再调用notify通知界面来取，因此切换延迟与界面是否响应无关。
+    """
+
+    def __init__(self, backend, logger, notify=None, config_store=None, loop=None, trace=None):
+        self.backend = backend
+        self.logger = logger
+        self.notify = notify
+        self.config_store = config_store
+        if loop is None:
+            loop = Win32MessageLoop() if isinstance(backend, Win32Backend) else EngineLoop()
+        self.loop = loop
+        self.trace = trace  # TraceRecorder，记录观察到的输入和切换决定
+        self.states = queue.Queue()
+        self.config = None
+        self.policy = None
+        self.decision_cache = DecisionCache()
+        self.process_cache = ProcessNameCache(backend)
+        self.foreground_source = None
+        self.keyboard_source = None
+        self.manual_overrides = OrderedDict()  # hwnd -> 用户在该窗口手动选择的Caps Lock状态
+        self.caps_check_timer = None
+        self.caps_interval = None  # 无键盘钩子时轮询Caps Lock的自适应间隔
+        self.caps_last_input = None
+        self.caps_paused = False
+        self.config_watch_timer = None
+        self.config_reloader = None  # 有config_store时在后台线程中重新读取配置
+        self.pending_toggle = None  # 已注入、尚未确认生效的目标状态
+        self.toggle_delivered = False  # 键盘钩子已看到最近一次注入的按键
+        self.confirm_timer = None
+        self.settle_hwnd = None  # 等待稳定的前台窗口
+        self.settle_timer = None
+        self.ignore_classes = frozenset()
+        self.metrics = SwitchMetrics()
+        self.metrics_path = os.path.join('logs', 'metrics.json')
+        self.caps_lock_on = backend.get_caps_lock_state()
+        self.last_hwnd = None
+        # 对外公开的状态快照，只整体替换，其他线程（如IPC接口）可以直接读取
+        self.status = {'caps_lock_on': self.caps_lock_on, 'hwnd': None, 'action': None, 'rule': None}
+        self.watchers = []  # 状态变化时在引擎线程中以(事件类型, 状态快照)调用，不能阻塞
+        self.first_tick_at = None  # 首次检测完成的perf_counter时间
+        self.thread = None
+
+    def start(self, config, policy):
+        """在新线程中启动引擎"""
+        self._prepare(config, policy)
+        self.thread = threading.Thread(target=self._run, name="caps-lock-engine", daemon=True)
+        self.thread.start()
+
+    def run(self, config, policy):
+        """在当前线程中运行引擎，直到调用stop"""
+        self._prepare(config, policy)
+        self._run()
+
+    def stop(self, timeout=2):
+        """停止引擎"""
+        self.loop.stop()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def _prepare(self, config, policy):
+        self.config = config
+        self.policy = policy
+        self.ignore_classes = frozenset(config['ignore_classes'])
+        self.decision_cache.reset(config['decision_cache_size'])
+        self.caps_interval = self._caps_poll_interval(config)
+
+    @staticmethod
+    def _caps_poll_interval(config):
+        """Caps Lock轮询从caps_poll_interval开始，和前台窗口轮询一样退避到poll_interval_max"""
+        return AdaptivePollInterval(config['caps_poll_interval'],
+                                    max(config['caps_poll_interval'], config['poll_interval_max']))
+
+    def update_config(self, config, policy):
+        """在引擎线程中一次性替换配置和切换规则"""
+        self.loop.call_soon(self._apply_config, config, policy)
+
+    def _apply_config(self, config, policy):
+        source_keys = ('foreground_backend', 'poll_interval_min', 'poll_interval_max')
+        restart = any(config[key] != self.config[key] for key in source_keys)
+        restart_keyboard = config['keyboard_hook'] != self.config['keyboard_hook']
+        self.config = config
+        self.policy = policy
+        self.ignore_classes = frozenset(config['ignore_classes'])
+        # 切换规则可能已变化，之前缓存的匹配结果全部作废
+        self.decision_cache.reset(config['decision_cache_size'])
+        self.caps_interval = self._caps_poll_interval(config)
+        if restart:
+            self.start_foreground_source()
+        if restart_keyboard:
+            self.start_keyboard_source()
+        self.set_status('config')
+
+    def _start_sources(self):
+        self.start_foreground_source()
+        self.start_keyboard_source()
+        if self.config_store is not None:
+            self.config_reloader = ConfigReloader(
+                self.config_store, lambda config, policy: self.loop.call_soon(self._reload_config, config, policy),
+                self.logger)
+        self.check_caps_lock()
+        self.schedule_config_watch()
+        self.schedule_metrics_dump()
+        self.loop.call_later(DECISION_CACHE_PRUNE_INTERVAL, self._periodic_cache_prune)
+        if self.trace is not None:
+            self.loop.call_later(TRACE_FLUSH_INTERVAL, self._periodic_trace_flush)
+
+    def _run(self):
+        self._start_sources()
+        self.first_tick_at = time.perf_counter()
+        try:
+            self.loop.run()
+        finally:
+            self.stop_foreground_source()
+            self.stop_keyboard_source()
+            if self.config_reloader is not None:
+                self.config_reloader.stop()
+            if self.config['metrics_interval'] > 0:
+                self.dump_metrics()
+            if self.trace is not None:
+                self.trace.close()
+                self.logger.info(f"诊断记录统计: {self.trace.stats()}")
+            self.process_cache.clear()
+            self.logger.info(f"窗口匹配缓存统计: {self.decision_cache.stats()}")
+
+    def stats(self):
+        """返回切换延迟、计数和缓存统计（可从任意线程调用）"""
+        stats = self.metrics.snapshot()
+        stats['source'] = type(self.foreground_source).__name__ if self.foreground_source else None
+        if isinstance(self.foreground_source, PollingForegroundSource):
+            stats['polling'] = self.foreground_source.stats()
+        if self.keyboard_source is None and self.caps_interval is not None:
+            interval = self.caps_interval.max_interval if self.caps_paused else self.caps_interval.current
+            stats['caps_polling'] = {'paused': self.caps_paused, 'interval_ms': interval}
+        stats['decision_cache'] = self.decision_cache.stats()
+        stats['process_cache'] = self.process_cache.stats()
+        return stats
+
+    def _periodic_cache_prune(self):
+        """清理匹配缓存中已销毁窗口的条目和进程名缓存中已退出的进程"""
+        try:
+            self.decision_cache.prune(self.backend.is_window)
+            self.process_cache.prune()
+        finally:
+            self.loop.call_later(DECISION_CACHE_PRUNE_INTERVAL, self._periodic_cache_prune)
+
+    def _periodic_trace_flush(self):
+        self.trace.flush()
+        self.loop.call_later(TRACE_FLUSH_INTERVAL, self._periodic_trace_flush)
+
+    def schedule_metrics_dump(self):
+        """按metrics_interval安排下一次统计数据写入"""
+        if self.config['metrics_interval'] > 0:
+            self.loop.call_later(self.config['metrics_interval'] * 1000, self._periodic_metrics_dump)
+
+    def _periodic_metrics_dump(self):
+        try:
+            self.dump_metrics()
+        finally:
+            self.schedule_metrics_dump()
+
+    def dump_metrics(self):
+        """把统计数据写入metrics文件（先写临时文件再替换）"""
+        try:
+            os.makedirs(os.path.dirname(self.metrics_path), exist_ok=True)
+            tmp_path = self.metrics_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.stats(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.metrics_path)
+        except OSError as e:
+            self.logger.warning(f"写入统计数据失败: {e}")
+
+    def schedule_config_watch(self):
+        """按config_watch_interval安排下一次配置文件变更检查"""
+        if self.config_store is not None and self.config['config_watch_interval'] > 0:
+            self.config_watch_timer = self.loop.call_later(self.config['config_watch_interval'], self.watch_config)
+
+    def watch_config(self):
+        """请求后台线程检查配置文件，变化时由它重新读取，再在引擎线程中一次性替换"""
+        try:
+            self.config_reloader.request()
+        finally:
+            self.schedule_config_watch()
+
+    def reload_config(self):
+        """在后台线程中重新读取配置文件，完成后在引擎线程中应用，界面随后按新配置刷新（可从任意线程调用）"""
+        self.config_reloader.request(force=True)
+
+    def _reload_config(self, config, policy):
+        self._apply_config(config, policy)
+        if self.notify is not None:
+            self.states.put({'type': 'config', 'config': config})
+            self.notify()
+
+    def request_quit(self):
+        """请求退出：有界面时交给界面关闭（保存窗口位置等），否则直接停止引擎（可从任意线程调用）"""
+        if self.notify is None:
+            self.loop.stop()
+            return
+        self.states.put({'type': 'quit'})
+        self.notify()
+
+    def start_foreground_source(self):
+        """启动（或按新配置重启）前台窗口事件源"""
+        self.stop_foreground_source()
+        self.foreground_source = create_foreground_source(
+            self.config['foreground_backend'], self.backend, self.loop,
+            self.config['poll_interval_min'], self.config['poll_interval_max'], self.logger
+        )
+        try:
+            self.foreground_source.start(self.on_foreground_change)
+        except OSError as e:
+            self.logger.warning(f"前台窗口事件钩子安装失败，改用轮询检测: {e}")
+            self.foreground_source = PollingForegroundSource(
+                self.backend, self.loop, self.config['poll_interval_min'], self.config['poll_interval_max']
+            )
+            self.foreground_source.start(self.on_foreground_change)
+        self.logger.info(f"前台窗口检测方式: {type(self.foreground_source).__name__}")
+
+    def stop_foreground_source(self):
+        """停止前台窗口事件源"""
+        if self.foreground_source is not None:
+            self.foreground_source.stop()
+            self.foreground_source = None
+
+    def start_keyboard_source(self):
+        """启动（或按新配置重启）Caps Lock按键事件源"""
+        self.stop_keyboard_source()
+        self.keyboard_source = create_keyboard_source(self.config['keyboard_hook'], self.backend, self.loop)
+        if self.keyboard_source is None:
+            return
+        try:
+            self.keyboard_source.start(self.on_caps_key)
+        except OSError as e:
+            self.logger.warning(f"键盘钩子安装失败，改用轮询Caps Lock状态: {e}")
+            self.keyboard_source = None
+
+    def stop_keyboard_source(self):
+        """停止Caps Lock按键事件源"""
+        if self.keyboard_source is not None:
+            self.keyboard_source.stop()
+            self.keyboard_source = None
+
+    def on_caps_key(self, injected, event_time):
+        """键盘钩子报告Caps Lock被按下
+
+        本程序注入的按键只记为已送达（不会再重新注入）；用户的按键会翻转跟踪的状态，并记为用户在当前窗口的手动选择，
+        之后切换回该窗口时沿用用户的选择，不再按规则强制切换。
+        注入的切换尚未确认时用户按键排在它之后：钩子已看到注入时翻转的是注入后的状态，没看到说明注入被更早的钩子吞掉；
+        等待中的确认和重试随之取消。
+        """
+        if self.trace is not None:
+            self.trace.key(injected, event_time)
+        if injected:
+            if self.pending_toggle is not None:
+                self.toggle_delivered = True
+            return
+        if self.pending_toggle is not None:
+            caps_lock_on = not (self.pending_toggle if self.toggle_delivered else self.caps_lock_on)
+            self.cancel_pending_toggle()
+        else:
+            caps_lock_on = not self.caps_lock_on
+        # 切换尚未稳定时用户看到的已是新窗口，手动选择记在新窗口上
+        hwnd = self.settle_hwnd or self.last_hwnd
+        if hwnd:
+            self.manual_overrides[hwnd] = caps_lock_on
+            self.manual_overrides.move_to_end(hwnd)
+            while len(self.manual_overrides) > self.config['manual_override_size']:
+                self.manual_overrides.popitem(last=False)
+        self.publish(caps_lock_on)
+
+    def on_foreground_change(self, hwnd, event_time=None):
+        """前台窗口切换事件：忽略临时窗口，前台稳定settle_time后再按规则切换
+
+        event_time为切换事件发生时的perf_counter时间，用于统计切换延迟。
+        快速Alt-Tab经过的窗口在稳定前就被下一次切换取代，不会注入按键，取代时计入省去的切换次数。
+        """
+        if event_time is None:
+            event_time = time.perf_counter()
+        if self.trace is not None:
+            pid = self.backend.get_window_pid(hwnd)
+            self.trace.foreground(hwnd, pid, self.backend.get_window_text(hwnd), self.process_cache.lookup(pid),
+                                  self.backend.get_caps_lock_state(), event_time,
+                                  self.backend.get_window_class(hwnd), self.backend.get_window_ex_style(hwnd))
+        if self.is_transient_window(hwnd):
+            self.metrics.count('ignored_windows')
+            return
+        if hwnd == self.settle_hwnd:
+            return
+        if self.settle_timer is not None:
+            self.loop.cancel(self.settle_timer)
+            self.settle_timer = None
+            self.count_suppressed(self.settle_hwnd)
+            self.settle_hwnd = None
+        if hwnd == self.last_hwnd:
+            return
+        if self.config['settle_time'] <= 0:
+            self.switch_to(hwnd, event_time)
+            return
+        self.settle_hwnd = hwnd
+        self.settle_timer = self.loop.call_later(self.config['settle_time'],
+                                                 lambda: self.on_settled(hwnd, event_time))
+
+    def is_transient_window(self, hwnd):
+        """是否为不参与切换的窗口：无前台窗口、工具窗口、提示框和菜单等"""
+        if not hwnd:
+            return True
+        if self.config['ignore_tool_windows'] and \
+                self.backend.get_window_ex_style(hwnd) & (WS_EX_TOOLWINDOW | WS_EX_NOACTIVATE):
+            return True
+        return bool(self.ignore_classes) and self.backend.get_window_class(hwnd) in self.ignore_classes
+
+    def on_settled(self, hwnd, event_time):
+        """前台窗口已稳定settle_time：确认它仍在前台后按规则切换"""
+        self.settle_timer = None
+        self.settle_hwnd = None
+        foreground = self.backend.get_foreground_window()
+        if foreground != hwnd and not self.is_transient_window(foreground):
+            # 前台已经变了（新窗口的事件随后会到），放弃这次切换
+            self.count_suppressed(hwnd)
+            return
+        self.switch_to(hwnd, event_time)
+
+    def count_suppressed(self, hwnd):
+        """未稳定就被取代的切换：按规则本应切换时计入省去的切换次数"""
+        current_status, desired_status, _ = self.decide(hwnd)
+        if current_status != desired_status:
+            self.metrics.count('suppressed_toggles')
+
+    def decide(self, hwnd):
+        """按切换规则和用户的手动选择决定目标状态，返回(当前状态, 目标状态, 命中规则的排名)"""
+        # 先按进程映像名查表（PID缓存命中时只是一次字典查询），标题规则可能排名更靠前时再匹配窗口标题
+        rank = self.policy.no_match
+        if self.policy.has_process_rules:
+            rank = self.policy.process_rank(self.process_cache.lookup(self.backend.get_window_pid(hwnd)))
+        if self.policy.needs_title(rank):
+            window_title = self.backend.get_window_text(hwnd)
+            title_rank = self.decision_cache.get(hwnd, window_title)
+            if title_rank is None:
+                title_rank = self.policy.title_rank(window_title)
+                self.decision_cache.put(hwnd, window_title, title_rank)
+            rank = min(rank, title_rank)
+        action = self.policy.action(rank)
+        # 上一次注入的按键可能还没被系统处理，按它生效后的状态判断，避免重复切换
+        if self.pending_toggle is not None:
+            current_status = self.pending_toggle
+        else:
+            current_status = self.backend.get_caps_lock_state()
+        if action == POLICY_KEEP:
+            desired_status = current_status
+        else:
+            desired_status = action == POLICY_ON
+        if hwnd in self.manual_overrides:
+            if self.backend.is_window(hwnd):
+                desired_status = self.manual_overrides[hwnd]
+            else:
+                del self.manual_overrides[hwnd]
+        return current_status, desired_status, rank
+
+    def switch_to(self, hwnd, event_time):
+        """前台窗口已确定：按规则打开、关闭或不处理Caps Lock
+
+        规则为keep（不处理）时保持当前状态，不注入任何按键。
+        """
+        started = time.perf_counter()
+        current_status, desired_status, rank = self.decide(hwnd)
+        action = self.policy.action(rank)
+        decided = time.perf_counter()
+        self.metrics.record('event_to_decision', decided - event_time)
+        self.metrics.count('switches')
+        if current_status == desired_status and action == POLICY_KEEP:
+            self.metrics.count('left_alone')
+        self.last_hwnd = hwnd
+        self.set_status('window', hwnd=hwnd, action=action, rule=self.policy.condition(rank))
+        if current_status != desired_status:
+            if self.trace is not None:
+                self.trace.toggle(hwnd, desired_status)
+            self.inject_toggle()
+            injected = time.perf_counter()
+            self.metrics.record('decision_to_inject', injected - decided)
+            self.metrics.count('toggles')
+            # 界面在确认生效后再更新，而不是假定注入一定成功
+            self.confirm_toggle(desired_status, event_time, injected)
+        else:
+            self.publish(desired_status)
+        self.metrics.record('tick', time.perf_counter() - started)
+
+    def inject_toggle(self):
+        """注入一次Caps Lock切换（按下和抬起在同一次SendInput中）"""
+        self.toggle_delivered = False
+        if self.backend.toggle_caps_lock() < 2:
+            self.metrics.count('inject_blocked')
+
+    def cancel_pending_toggle(self):
+        """放弃等待中的切换确认和重试"""
+        if self.confirm_timer is not None:
+            self.loop.cancel(self.confirm_timer)
+        self.confirm_timer = None
+        self.pending_toggle = None
+
+    def confirm_attempts(self):
+        """每次注入后最多检查几次（按confirm_interval检查，共confirm_timeout毫秒）"""
+        return max(1, math.ceil(self.config['confirm_timeout'] / max(1, self.config['confirm_interval'])))
+
+    def confirm_toggle(self, desired_status, event_time, injected, attempts=None, retries=None):
+        """读取GetKeyState确认切换已生效，未生效时稍后再查，不阻塞引擎线程
+
+        检查attempts次（默认按confirm_timeout计算）仍未生效时：键盘钩子已看到注入的按键说明已经送达，
+        只是GetKeyState还没反映，不再注入（否则会多切换一次）；钩子没看到时重新注入，最多retries次（默认toggle_retries）。
+        都失败则计为状态不一致，按实际状态更新界面。没有键盘钩子时只能按时间判断。
+        """
+        if attempts is None:
+            attempts = self.confirm_attempts()
+        if retries is None:
+            retries = self.config['toggle_retries']
+        interval = max(1, self.config['confirm_interval'])
+        self.cancel_pending_toggle()
+        self.pending_toggle = desired_status
+        if self.backend.get_caps_lock_state() == desired_status:
+            confirmed = time.perf_counter()
+            self.metrics.record('inject_to_confirm', confirmed - injected)
+            self.metrics.record('event_to_confirm', confirmed - event_time)
+            self.pending_toggle = None
+            self.publish(desired_status)
+        elif attempts > 1:
+            self.confirm_timer = self.loop.call_later(interval, lambda: self.confirm_toggle(
+                desired_status, event_time, injected, attempts - 1, retries))
+        elif self.toggle_delivered:
+            self.metrics.count('confirmed_by_hook')
+            self.logger.debug("GetKeyState尚未反映切换，键盘钩子已看到注入的按键，不再重新注入")
+            self.pending_toggle = None
+            self.publish(desired_status)
+        elif retries > 0:
+            self.metrics.count('toggle_retries')
+            self.logger.debug("Caps Lock切换未生效，重新注入")
+            self.inject_toggle()
+            self.confirm_timer = self.loop.call_later(interval, lambda: self.confirm_toggle(
+                desired_status, event_time, injected, None, retries - 1))
+        else:
+            self.pending_toggle = None
+            self.metrics.count('confirm_failures')
+            self.logger.warning("Caps Lock切换后状态未确认")
+            self.publish(self.backend.get_caps_lock_state())
+
+    def check_caps_lock(self):
+        """定期核对Caps Lock实际状态
+
+        有键盘钩子时状态由按键事件跟踪，这里只做低频核对；没有钩子时轮询，间隔和前台窗口轮询一样自适应：
+        有输入或状态变化后为caps_poll_interval，空闲时退避到poll_interval_max。
+        会话锁定、屏幕保护运行或显示器关闭时不读取状态，只按最大间隔检查是否已恢复。
+        """
+        self.caps_paused = self.backend.is_session_paused()
+        if self.caps_paused:
+            self.caps_check_timer = self.loop.call_later(self.caps_interval.max_interval, self.check_caps_lock)
+            return
+        started = time.perf_counter()
+        caps_lock_on = self.backend.get_caps_lock_state()
+        changed = caps_lock_on != self.caps_lock_on
+        if self.pending_toggle is None:
+            # 切换确认期间状态以确认结果为准
+            if self.trace is not None and changed:
+                self.trace.caps(caps_lock_on)
+            self.publish(caps_lock_on)
+        self.metrics.record('tick', time.perf_counter() - started)
+        if self.keyboard_source is not None:
+            interval = self.config['caps_reconcile_interval']
+        else:
+            last_input = self.backend.get_last_input_tick()
+            if changed or last_input != self.caps_last_input:
+                self.caps_interval.on_activity()
+            else:
+                self.caps_interval.on_idle()
+            self.caps_last_input = last_input
+            interval = self.caps_interval.current
+        self.caps_check_timer = self.loop.call_later(interval, self.check_caps_lock)
+
+    def publish(self, caps_lock_on):
+        """状态变化时放入队列并通知界面（无界面时不入队）"""
+        if caps_lock_on == self.caps_lock_on:
+            return
+        self.caps_lock_on = caps_lock_on
+        self.set_status('caps', caps_lock_on=caps_lock_on, hwnd=self.last_hwnd)
+        if self.notify is None:
+            return
+        self.states.put({'type': 'caps', 'caps_lock_on': caps_lock_on, 'hwnd': self.last_hwnd})
+        self.notify()
+
+    def set_status(self, event, **changes):
+        """替换状态快照并通知watchers"""
+        self.status = dict(self.status, **changes)
+        for watcher in self.watchers:
+            watcher(event, self.status)
+
+
+class TkNotifier:
+    """把引擎线程的通知转成Tk虚拟事件
+
+    跨线程调用Tk会等待主线程处理，因此由单独的线程代为发送，
+    界面卡住时只会阻塞这个线程，引擎线程只是设置一个标志。
+    """
+
+    def __init__(self, root, sequence):
+        self.root = root
+        self.sequence = sequence
+        self._pending = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="caps-lock-notifier", daemon=True)
+        self._thread.start()
+
+    def __call__(self):
+        self._pending.set()
+
+    def stop(self):
+        self._stopped = True
+        self._pending.set()
+
+    def _run(self):
+        while True:
+            self._pending.wait()
+            if self._stopped:
+                return
+            self._pending.clear()
+            try:
+                self.root.event_generate(self.sequence, when='tail')
+            except RuntimeError:
+                # 主线程尚未进入mainloop，稍后重试
+                self._pending.set()
+                time.sleep(0.05)
+            except tk.TclError:
+                return
+
+
+IPC_COMMANDS = ('status', 'subscribe', 'reload', 'quit')
+IPC_MAX_LINE = 4096  # 请求行长度上限(字节)
+IPC_MAX_BUFFER = 65536  # 订阅者未读取的数据超过该大小(字节)时断开
+
+
+def default_ipc_address():
+    """本机IPC地址：Windows上为命名管道，其他系统为Unix套接字
+
+    按用户（Windows上还按登录会话）区分，终端服务器上每个会话各有一个实例。
+    """
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        session_id = wintypes.DWORD()
+        ctypes.windll.kernel32.ProcessIdToSessionId(os.getpid(), ctypes.byref(session_id))
+        user = re.sub(r'[^\w.-]', '_', os.environ.get('USERNAME', 'user'))
+        return rf'\\.\pipe\caps_lock_checker-{user}-{session_id.value}'
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(runtime_dir, f'caps_lock_checker-{os.getuid()}.sock')
+
+
+def connect_ipc(address=None, timeout=1.0):
+    """连接正在运行的实例的IPC接口，返回按行读写的文件对象；没有实例在运行时返回None"""
+    address = address or default_ipc_address()
+    try:
+        if sys.platform == 'win32':
+            import io
+
+            pipe = open(address, 'r+b', buffering=0)
+            return io.BufferedRWPair(pipe, pipe)
+        import socket
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        with sock:  # 关闭文件对象时才真正关闭套接字
+            sock.settimeout(timeout)
+            sock.connect(address)
+            return sock.makefile('rwb')
+    except OSError:
+        return None
+
+
+def send_ipc_command(command, address=None, timeout=1.0):
+    """把命令交给正在运行的实例并返回响应；没有实例在运行（或没有响应）时返回None"""
+    connection = connect_ipc(address, timeout)
+    if connection is None:
+        return None
+    try:
+        with connection:
+            connection.write(json.dumps({'cmd': command}).encode('utf-8') + b'\n')
+            connection.flush()
+            line = connection.readline()
+        return json.loads(line) if line else None
+    except (OSError, ValueError):
+        return None
+
+
+def run_ipc_client(command, address=None):
+    """命令行：把命令交给正在运行的实例并输出响应，subscribe时持续输出状态变化直到按Ctrl+C
+
+    返回退出码；没有实例在运行时返回None。
+    """
+    if command != 'subscribe':
+        response = send_ipc_command(command, address)
+        if response is None:
+            return None
+        print(json.dumps(response, ensure_ascii=False))
+        return 0 if response.get('ok') else 1
+    connection = connect_ipc(address, timeout=None)
+    if connection is None:
+        return None
+    try:
+        with connection:
+            connection.write(json.dumps({'cmd': command}).encode('utf-8') + b'\n')
+            connection.flush()
+            for line in connection:
+                print(line.decode('utf-8').rstrip(), flush=True)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"连接已断开: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+class IpcServer:
+    """本机IPC接口：在独立线程中运行asyncio，按行收发JSON
+
+    请求为{"cmd": 命令}：status查询状态，subscribe查询状态并持续推送之后的状态变化，
+    reload重新读取配置文件，quit退出程序。status直接读取引擎的状态快照，不经过引擎线程；
+    状态变化由引擎线程通过watchers投递到asyncio线程再推送给订阅者，不需要轮询。
+    """
+
+    def __init__(self, engine, address=None, logger=None, max_buffer=IPC_MAX_BUFFER):
+        self.engine = engine
+        self.address = address or default_ipc_address()
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_buffer = max_buffer
+        self.loop = None
+        self.listening = False
+        self.ready = threading.Event()  # 开始监听或启动失败后置位
+        self.subscribers = set()  # 订阅者的StreamWriter（只在asyncio线程中访问，下同）
+        self.requests = 0
+        self.events_sent = 0
+        self.dropped_subscribers = 0
+        self._clients = {}  # StreamWriter -> 处理该连接的任务
+        self._closing = threading.Event()
+        self._stopped = None
+        self._thread = None
+
+    def start(self):
+        """在新线程中开始监听（asyncio在该线程中导入，不推迟界面启动）"""
+        self.engine.watchers.append(self.on_engine_event)
+        self._thread = threading.Thread(target=self._run, name="caps-lock-ipc", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2):
+        """停止监听并断开所有连接"""
+        if self.on_engine_event in self.engine.watchers:
+            self.engine.watchers.remove(self.on_engine_event)
+        self._closing.set()
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:  # 循环已结束
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        return {
+            'address': self.address,
+            'listening': self.listening,
+            'requests': self.requests,
+            'subscribers': len(self.subscribers),
+            'events_sent': self.events_sent,
+            'dropped_subscribers': self.dropped_subscribers,
+        }
+
+    def _run(self):
+        import asyncio
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._stopped = asyncio.Event()
+        self.loop = loop
+        try:
+            loop.run_until_complete(self._serve())
+        except Exception as e:
+            self.logger.warning(f"IPC接口运行失败: {e}")
+        finally:
+            self.listening = False
+            self.ready.set()
+            loop.close()
+
+    async def _serve(self):
+        import asyncio
+
+        try:
+            if sys.platform == 'win32':
+                def protocol_factory():
+                    return asyncio.StreamReaderProtocol(asyncio.StreamReader(limit=IPC_MAX_LINE), self._handle_client)
+                # 第一个管道实例带FILE_FLAG_FIRST_PIPE_INSTANCE，同名管道已存在时失败
+                servers = await asyncio.get_running_loop().start_serving_pipe(protocol_factory, self.address)
+            else:
+                # start_unix_server会删除已存在的套接字文件，先确认它不属于仍在运行的实例
+                connection = connect_ipc(self.address)
+                if connection is not None:
+                    connection.close()
+                    self.logger.warning(f"IPC地址已被另一个实例使用: {self.address}")
+                    return
+                servers = [await asyncio.start_unix_server(self._handle_client, self.address, limit=IPC_MAX_LINE)]
+                os.chmod(self.address, 0o600)
+        except OSError as e:
+            self.logger.warning(f"IPC接口启动失败（可能已有实例在运行）: {e}")
+            return
+        self.listening = True
+        self.ready.set()
+        self.logger.info(f"IPC接口已启动: {self.address}")
+        try:
+            if not self._closing.is_set():
+                await self._stopped.wait()
+        finally:
+            self.listening = False
+            for server in servers:
+                server.close()
+            # 关闭连接后各连接的处理任务读到EOF自行结束
+            tasks = list(self._clients.values())
+            for writer in list(self._clients):
+                writer.close()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if sys.platform != 'win32':
+                try:
+                    os.remove(self.address)
+                except OSError:
+                    pass
+
+    async def _handle_client(self, reader, writer):
+        import asyncio
+
+        self._clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command, response = self.handle_request(line, writer)
+                writer.write(self._encode(response))
+                await writer.drain()
+                if command == 'quit':
+                    self.engine.request_quit()
+                    break
+        except (OSError, ValueError) as e:  # ValueError: 请求行过长
+            self.logger.debug(f"IPC连接断开: {e}")
+        finally:
+            self.subscribers.discard(writer)
+            self._clients.pop(writer, None)
+            writer.close()
+
+    def handle_request(self, line, writer=None):
+        """处理一行请求，返回(命令, 响应)；subscribe时把writer加入订阅者"""
+        self.requests += 1
+        try:
+            command = json.loads(line).get('cmd')
+        except (ValueError, AttributeError):
+            return None, {'ok': False, 'error': '请求应为一行JSON对象，如{"cmd": "status"}'}
+        if command == 'subscribe' and writer is not None:
+            # 先加入订阅者再读取状态：之后的变化要么已反映在这次的状态中，要么会推送给它
+            self.subscribers.add(writer)
+        if command in ('status', 'subscribe'):
+            return command, dict(self.describe(self.engine.status), ok=True)
+        if command == 'reload':
+            if self.engine.config_store is None:
+                return command, {'ok': False, 'error': "未使用配置文件"}
+            self.engine.reload_config()
+            return command, {'ok': True}
+        if command == 'quit':
+            return command, {'ok': True}
+        return None, {'ok': False, 'error': f"未知命令: {command}，可用命令: {', '.join(IPC_COMMANDS)}"}
+
+    def describe(self, status):
+        """状态快照加上前台窗口标题和本实例的进程号"""
+        hwnd = status['hwnd']
+        return dict(status, title=self.engine.backend.get_window_text(hwnd) if hwnd else '', pid=os.getpid())
+
+    def on_engine_event(self, event, status):
+        """在引擎线程中调用：有订阅者时把状态变化投递到asyncio线程"""
+        if self.subscribers and self.listening:
+            try:
+                self.loop.call_soon_threadsafe(self._broadcast, event, status)
+            except RuntimeError:  # 循环已关闭
+                pass
+
+    def _broadcast(self, event, status):
+        data = self._encode(dict(self.describe(status), event=event))
+        for writer in list(self.subscribers):
+            if writer.is_closing():
+                self.subscribers.discard(writer)
+                continue
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                # 订阅者长时间不读取，断开，避免缓冲无限增长
+                self.subscribers.discard(writer)
+                self.dropped_subscribers += 1
+                writer.close()
+                continue
+            writer.write(data)
+            self.events_sent += 1
+
+    @staticmethod
+    def _encode(message):
+        return json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n'
+
 
 class CapsLockChecker:
-    def __init__(self, root):
+    def __init__(self, root, backend=None, trace_path=None, profiler=None):
+        """按"先出指示窗口和首次检测"的顺序初始化，标题栏和右键菜单在第一次用到时才创建"""
+        load_tkinter()
         self.root = root
         self.root.title("Caps Lock 状态检测")
+        self.backend = backend if backend is not None else Win32Backend()
+        self.tk_call_rate = None  # 最近一次定期统计的Tk调用频率(次/秒)
+        self.report_startup = profiler is not None
+        self.profiler = profiler if profiler is not None else StartupProfiler()
         
-        # 初始化日志功能
+        # 初始化日志功能，读取配置后按配置设置日志级别
         self.setup_logging()
         self.logger.info("应用程序启动")
+        self.config_store = ConfigStore(logger=self.logger)
+        self.read_config()
+        self.log_pipeline.apply_config(self.config)
+        self.profiler.mark("日志和配置")
         
-        self.logger.debug("初始化前 - 检查self属性")
+        # 先启动检测引擎（在独立线程中运行），首次检测不必等界面建好
+        self.notifier = TkNotifier(self.root, "<<CapsLockState>>")
+        self.engine = CapsLockEngine(self.backend, self.logger, self.notifier, self.config_store,
+                                     trace=open_trace(trace_path, self.logger))
+        self.caps_lock_on = self.engine.caps_lock_on
+        self.root.bind("<<CapsLockState>>", self.drain_engine_states)
+        self.engine.start(self.config, self.policy)
+        self.profiler.mark("启动检测引擎")
+        # 其他程序通过IPC接口查询状态、订阅状态变化、重新加载配置或退出
+        self.ipc = IpcServer(self.engine, logger=self.logger)
+        self.ipc.start()
         
         # 设置默认颜色值
         self.color_caps_on = "#fa6666"
@@ -27,18 +3479,56 @@ class CapsLockChecker:
         self.root.resizable(True, True)
         self.root.overrideredirect(True)  # 永久无边框窗口，避免overrideredirect切换导致的卡顿
         
-        # 标题栏状态和拖动控制
+        # 标题栏状态和拖动控制（标题栏和右键菜单第一次显示时才创建）
+        self.titlebar = None
+        self.right_click_menu = None
         self.titlebar_visible = False
         self.dragging = False
         self.drag_offset = (0, 0)
         self.leave_hide_timer = None  # 鼠标离开后延迟隐藏的计时器
-        self.last_mouse_move_time = 0  # 记录上次鼠标移动时间
+        # 拖动、鼠标移动和尺寸变化事件合并到显示帧处理，避免高回报率鼠标塞满主循环
+        self.frame_coalescer = FrameCoalescer(self.root.after)
+        
+        # 创建主画布，填充整个窗口，状态文本直接绘制在画布上
+        self.main_canvas = tk.Canvas(self.root, highlightthickness=0, bd=0)
+        self.main_canvas.place(x=0, y=0, relwidth=1, relheight=1)
+        self.renderer = IndicatorRenderer(self.main_canvas, coalescer=self.frame_coalescer)
+        self.root.after(TK_CALL_REPORT_INTERVAL, self.report_tk_calls)
+        self.main_canvas.bind("<Expose>", self.on_first_paint)
+        
+        # 应用配置（窗口位置、颜色）
+        self.apply_config()
+        self.profiler.mark("创建指示窗口")
+        
+        self.geometry_persister = GeometryPersister(
+            self.config_store,
+            written=tuple(self.config[key] for key in ('window_width', 'window_height', 'window_x', 'window_y')),
+            delay=self.config['geometry_save_delay'],
+            logger=self.logger
+        )
+        
+        # 绑定窗口拖动事件（标题栏隐藏时可拖动整个窗口）
+        self.root.bind("<ButtonPress-1>", self.on_window_drag_start)
+        self.root.bind("<B1-Motion>", self.on_window_drag_motion)
+        self.root.bind("<ButtonRelease-1>", self.on_drag_stop)
+        self.root.bind("<Configure>", self.on_root_configure)
+        
+        # 绑定鼠标事件
+        self.root.bind("<Motion>", self.on_mouse_motion)
+        self.root.bind("<Enter>", self.on_mouse_enter)
+        self.root.bind("<Leave>", self.on_mouse_leave)
+        
+        # 绑定ESC键关闭窗口
+        self.root.bind("<Escape>", self.on_escape)
         
-        self.logger.debug("创建标题栏前 - 检查self属性")
-        # 创建自定义标题栏
+        # 右键菜单
+        self.root.bind("<Button-3>", self.show_right_click_menu)
+        self.profiler.mark("绑定事件")
+    
+    def build_titlebar(self):
+        """创建自定义标题栏和按钮（第一次显示标题栏时调用）"""
         self.titlebar = tk.Frame(self.root, bg=self.color_titlebar, height=30)
         self.titlebar.pack_propagate(False)  # 防止标题栏高度被内部组件改变
-        self.logger.debug("创建标题栏后 - self.titlebar = %s", self.titlebar)
         
         # 添加关闭按钮
         self.close_button = tk.Label(
@@ -79,135 +3569,79 @@ class CapsLockChecker:
         # 标题栏拖动功能
         self.titlebar.bind("<ButtonPress-1>", self.on_titlebar_drag_start)
         self.titlebar.bind("<B1-Motion>", self.on_titlebar_drag_motion)
-        
-        # 绑定窗口拖动事件（标题栏隐藏时可拖动整个窗口）
-        self.root.bind("<ButtonPress-1>", self.on_window_drag_start)
-        self.root.bind("<B1-Motion>", self.on_window_drag_motion)
-        self.root.bind("<ButtonRelease-1>", self.on_drag_stop)
-        
-        # 绑定鼠标事件
-        self.root.bind("<Motion>", self.on_mouse_motion)
-        self.root.bind("<Enter>", self.on_mouse_enter)
-        self.root.bind("<Leave>", self.on_mouse_leave)
-        
-        # 绑定ESC键关闭窗口
-        self.root.bind("<Escape>", self.on_escape)
-        
-        # 创建右键菜单
+    
+    def build_right_click_menu(self):
+        """创建右键菜单（第一次右键点击时调用）"""
         self.right_click_menu = Menu(self.root, tearoff=False)
         self.right_click_menu.add_command(label="设置", command=self.show_settings_window)
         self.right_click_menu.add_command(label="刷新", command=self.refresh_config)
+        self.right_click_menu.add_command(label="统计", command=self.show_stats_window)
         self.right_click_menu.add_separator()
         self.right_click_menu.add_command(label="关闭", command=self.on_menu_close)
-        self.root.bind("<Button-3>", self.show_right_click_menu)
-        
-        # 初始化Caps Lock状态
-        self.caps_lock_on = win32api.GetKeyState(win32con.VK_CAPITAL) & 1 != 0
-        self.last_hwnd = None
-        
-        self.logger.debug("创建主框架前")
-        # 创建主框架，填充整个窗口
-        self.main_frame = tk.Frame(self.root, bg=self.color_caps_on if self.caps_lock_on else self.color_caps_off)
-        self.main_frame.place(x=0, y=0, relwidth=1, relheight=1)
-        
-        # 创建容器帧放置状态文本
-        self.label_container = tk.Frame(self.main_frame, bg=self.main_frame['bg'])
-        self.label_container.pack(expand=True, fill=tk.BOTH)
-
-        # 创建内部容器用于居中显示
-        self.inner_frame = tk.Frame(self.label_container, bg=self.main_frame['bg'])
-        self.inner_frame.pack(expand=True)
-
-        # 添加固定文本标签（"Caps Lock"）
-        self.caps_text_label = tk.Label(
-            self.inner_frame,
-            text="Caps Lock",
-            font=("Arial", 22, "bold"),
-            fg="white",
-            bg=self.main_frame['bg']
-        )
-        self.caps_text_label.pack(side=tk.LEFT, padx=(0, 5))  # 固定文本右侧留5px间距
-
-        # 添加动态状态标签（"ON"/"OFF"）
-        self.status_value_label = tk.Label(
-            self.inner_frame,
-            text="ON" if self.caps_lock_on else "OFF",
-            font=("Arial", 22, "bold"),
-            fg="white",
-            bg=self.main_frame['bg'],
-        )
-        self.status_value_label.pack(side=tk.LEFT)  # 动态状态标签紧随其后
-
-        # 设置状态标签的固定宽度，确保ON/OFF切换时Caps Lock文本不动
-        self.status_value_label.configure(width=4)  # 设置固定宽度为4个字符，足够容纳"OFF"
-
-        self.logger.debug("读取配置文件前")
-        # 读取配置文件
-        self.read_config()
-        
-        # 开始定期检查Caps Lock状态
-        self.check_caps_lock()
-        
-        self.logger.debug("应用配置前 - 检查self.titlebar属性")
-        if hasattr(self, 'titlebar'):
-            self.logger.debug("应用配置前 - self.titlebar存在: %s", self.titlebar)
-        else:
-            self.logger.error("应用配置前 - self.titlebar不存在!")
-        
-        # 应用配置
-        self.apply_config()
-        
-        # 隐藏标题栏
-        self.hide_titlebar()
+    
+    def on_first_paint(self, event):
+        """指示窗口第一次绘制完成，记录启动耗时"""
+        self.main_canvas.unbind("<Expose>")
+        self.profiler.event("首次绘制")
+        if self.engine.first_tick_at is not None:
+            self.profiler.event("首次检测完成", self.engine.first_tick_at)
+        report = self.profiler.report()
+        self.logger.info(f"启动完成: 首次绘制{report['events_ms']['首次绘制']:.0f}ms")
+        if self.report_startup:
+            self.profiler.publish(report, self.logger)
     
     def update_status(self):
-        """更新界面显示的Caps Lock状态"""
-        if self.caps_lock_on:
-            status_text = "ON"
-        else:
-            status_text = "OFF"
-
-        # 更新状态文本
-        self.status_value_label.configure(text=status_text)
+        """更新界面显示的Caps Lock状态（状态和颜色未变化时不会调用Tk）"""
+        self.renderer.render(self.caps_lock_on, self.color_caps_on, self.color_caps_off)
     
-    def check_caps_lock(self):
-        """检测Caps Lock状态变化并根据配置的软件列表自动切换"""
-        hwnd = win32gui.GetForegroundWindow()
-        window_title = win32gui.GetWindowText(hwnd)
-        is_target_software_active = any(software in window_title for software in self.config['software_list'])
-        if not self.config['software_list']:
-            self.config['software_list'] = ['CAXA']
-        current_status = win32api.GetKeyState(win32con.VK_CAPITAL) & 1 != 0
-        is_switch = hwnd != self.last_hwnd
-        if is_switch:
-            desired_status = is_target_software_active
-            if current_status != desired_status:
-                win32api.keybd_event(win32con.VK_CAPITAL, 0, win32con.KEYEVENTF_EXTENDEDKEY | 0, 0)
-                win32api.keybd_event(win32con.VK_CAPITAL, 0, win32con.KEYEVENTF_EXTENDEDKEY | win32con.KEYEVENTF_KEYUP, 0)
-                self.caps_lock_on = desired_status
+    def drain_engine_states(self, event=None):
+        """取出引擎线程推送的状态，只按最新状态刷新一次界面"""
+        latest = None
+        new_config = None
+        while True:
+            try:
+                item = self.engine.states.get_nowait()
+            except queue.Empty:
+                break
+            if item['type'] == 'quit':
+                # 通过IPC接口请求退出
+                self.close_application()
+                return
+            if item['type'] == 'config':
+                new_config = item['config']
             else:
-                self.caps_lock_on = current_status
-            self.last_hwnd = hwnd
-        else:
-            self.caps_lock_on = current_status
-        self.update_main_frame_bg()
-        self.update_status()
-        self.root.after(100, self.check_caps_lock)
-    
+                latest = item
+        if new_config is not None:
+            # 配置重新加载（自动或点击刷新）：窗口大小和位置未变化时不移动窗口
+            geometry_keys = ('window_width', 'window_height', 'window_x', 'window_y')
+            apply_geometry = any(new_config[key] != self.config[key] for key in geometry_keys)
+            self.config = new_config
+            self.apply_config(apply_geometry)
+            self.log_pipeline.apply_config(self.config)
+        if latest is not None:
+            self.caps_lock_on = latest['caps_lock_on']
+            self.update_status()
+
+    def report_tk_calls(self):
+        """定期记录界面的Tk调用频率（空闲时也记录，用于确认空闲时没有多余的重绘）"""
+        self.tk_call_rate = self.renderer.counter.rate()
+        self.logger.debug(f"界面Tk调用频率: {self.tk_call_rate:.2f}次/秒")
+        self.root.after(TK_CALL_REPORT_INTERVAL, self.report_tk_calls)
+
     def hide_titlebar(self):
         """隐藏自定义标题栏"""
         if self.titlebar_visible:
             self.titlebar.place_forget()
             self.titlebar_visible = False
-            self.update_main_frame_bg()  # 更新背景色
     
     def show_titlebar(self):
         """显示自定义标题栏"""
         if not self.titlebar_visible:
+            if self.titlebar is None:
+                self.build_titlebar()
             self.titlebar.place(x=0, y=0, relwidth=1, height=30)
             self.titlebar.lift()  # 确保标题栏在主框架上方
             self.titlebar_visible = True
-            self.update_main_frame_bg()  # 更新背景色
     
     def on_titlebar_drag_start(self, event):
         """开始拖动自定义标题栏"""
@@ -217,9 +3651,7 @@ class CapsLockChecker:
     def on_titlebar_drag_motion(self, event):
         """拖动自定义标题栏"""
         if self.dragging:
-            new_x = event.x_root - self.drag_offset[0]
-            new_y = event.y_root - self.drag_offset[1]
-            self.root.geometry(f"+{new_x}+{new_y}")
+            self.frame_coalescer.submit('drag', self.move_window, event.x_root, event.y_root)
     
     def on_window_drag_start(self, event):
         """标题栏隐藏时拖动整个窗口"""
@@ -230,25 +3662,28 @@ class CapsLockChecker:
     def on_window_drag_motion(self, event):
         """拖动整个窗口"""
         if self.dragging and not self.titlebar_visible:
-            new_x = event.x_root - self.drag_offset[0]
-            new_y = event.y_root - self.drag_offset[1]
-            self.root.geometry(f"+{new_x}+{new_y}")
+            self.frame_coalescer.submit('drag', self.move_window, event.x_root, event.y_root)
+    
+    def move_window(self, x_root, y_root):
+        """按最新的鼠标位置移动窗口（每帧最多一次）"""
+        new_x = x_root - self.drag_offset[0]
+        new_y = y_root - self.drag_offset[1]
+        self.root.geometry(f"+{new_x}+{new_y}")
+        self.renderer.counter.add()
     
     def on_drag_stop(self, event):
         """停止拖动窗口"""
         self.dragging = False
     
     def on_mouse_motion(self, event):
-        """鼠标移动事件"""
-        current_time = time.time()
-        
-        # 添加时间戳检查，限制标题栏显示的频率
-        if current_time - self.last_mouse_move_time > 0.05:  # 50ms间隔
-            self.last_mouse_move_time = current_time
-            
-            # 鼠标靠近顶部时显示标题栏
-            if not self.titlebar_visible and event.y < 30:
-                self.show_titlebar()
+        """鼠标移动事件（合并到显示帧处理）"""
+        self.frame_coalescer.submit('motion', self.handle_mouse_motion, event.y)
+    
+    def handle_mouse_motion(self, y):
+        """处理一帧内最新的鼠标位置"""
+        # 鼠标靠近顶部时显示标题栏
+        if not self.titlebar_visible and y < 30:
+            self.show_titlebar()
         
         # 取消延迟隐藏计时器
         if self.leave_hide_timer:
@@ -262,29 +3697,26 @@ class CapsLockChecker:
     
     def on_mouse_leave(self, event):
         """鼠标离开窗口时隐藏标题栏"""
+        # 离开之前的鼠标移动已无意义，避免它在离开后取消隐藏计时器
+        self.frame_coalescer.discard('motion')
         if self.titlebar_visible and not self.dragging:
             # 延迟隐藏标题栏，确保用户有足够时间操作
             self.leave_hide_timer = self.root.after(500, self.hide_titlebar)
     
     def close_application(self):
         """关闭应用程序"""
+        self.ipc.stop()
+        self.engine.stop()
+        self.notifier.stop()
         self.save_window_position()
         self.logger.info("应用程序退出")
+        self.log_pipeline.stop()
         self.root.destroy()
         
     def on_close_click(self, event):
         """关闭按钮点击事件"""
         self.close_application()
     
-    def update_main_frame_bg(self):
-        """更新主框架背景色"""
-        current_color = self.color_caps_on if self.caps_lock_on else self.color_caps_off
-        self.main_frame.configure(bg=current_color)
-        self.label_container.configure(bg=current_color)
-        self.inner_frame.configure(bg=current_color)
-        self.caps_text_label.configure(bg=current_color)
-        self.status_value_label.configure(bg=current_color)
-    
     def center_window(self):
         """将窗口居中显示在屏幕上"""
         # 强制更新窗口尺寸信息
@@ -315,8 +3747,18 @@ class CapsLockChecker:
     
     def show_right_click_menu(self, event):
         """显示右键菜单"""
+        if self.right_click_menu is None:
+            self.build_right_click_menu()
         self.right_click_menu.post(event.x_root, event.y_root)
     
+    def show_stats_window(self):
+        """显示切换延迟统计"""
+        from tkinter import messagebox
+        counter = self.renderer.counter
+        rate = "尚未统计" if self.tk_call_rate is None else f"{self.tk_call_rate:.2f}次/秒"
+        text = f"{format_stats(self.engine.stats())}\n界面Tk调用: 共{counter.total}次，最近{TK_CALL_REPORT_INTERVAL // 1000}秒 {rate}"
+        messagebox.showinfo("切换统计", text, parent=self.root)
+
     def show_settings_window(self):
         """显示设置窗口"""
         try:
@@ -332,7 +3774,7 @@ class CapsLockChecker:
         except Exception as e:
             self.logger.error(f"打开配置文件失败: {e}")
     
-    def apply_config(self):
+    def apply_config(self, apply_geometry=True):
         try:
             # 设置窗口大小和位置
             width = self.config.get("window_width", 250)
@@ -341,24 +3783,26 @@ class CapsLockChecker:
             y = self.config.get("window_y", -1)
             
             # 如果位置是有效坐标，则合并大小和位置
-            if x != -1 and y != -1:
-                self.root.geometry(f"{width}x{height}+{x}+{y}")
-            else:
-                # 设置大小并居中显示
-                self.root.geometry(f"{width}x{height}")
-                self.center_window()
+            if apply_geometry:
+                if x != -1 and y != -1:
+                    self.root.geometry(f"{width}x{height}+{x}+{y}")
+                else:
+                    # 设置大小并居中显示
+                    self.root.geometry(f"{width}x{height}")
+                    self.center_window()
             
             # 应用颜色设置
             self.color_caps_on = self.config.get("color_caps_on", "#fa6666")
             self.color_caps_off = self.config.get("color_caps_off", "#4CAF50")
             self.color_titlebar = self.config.get("color_titlebar", "#2c3e50")
             
-            # 更新标题栏颜色
-            self.titlebar.configure(bg=self.color_titlebar)
-            self.close_button.configure(bg=self.color_titlebar)
+            # 更新标题栏颜色（标题栏尚未创建时，创建时会使用当前颜色）
+            if self.titlebar is not None:
+                for widget in (self.titlebar, self.close_button, self.refresh_button, self.settings_button):
+                    widget.configure(bg=self.color_titlebar)
             
-            # 更新主框架颜色
-            self.update_main_frame_bg()
+            # 更新主画布颜色
+            self.update_status()
             
             # 设置窗口总是在最前
             self.root.wm_attributes("-topmost", self.config.get("always_on_top", 0))
@@ -366,190 +3810,218 @@ class CapsLockChecker:
             self.logger.error(f"应用配置时出错: {str(e)}", exc_info=0)
     
     def read_config(self):
-        """读取配置文件"""
-        # 默认配置
-        self.config = {
-            'color_caps_on': '#fa6666',
-            'color_caps_off': '#4CAF50',
-            'color_titlebar': '#2c3e50',
-            'window_width': 250,
-            'window_height': 150,
-            'window_x': -1,
-            'window_y': -1,
-            'always_on_top': 0,
-            'software_list': ['CAXA']  # 默认检测软件列表
-        }
-        
-        try:
-            if os.path.exists('config.txt'):
-                with open('config.txt', 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    
-                # 使用字典映射处理配置键值，提高效率
-                config_handlers = {
-                    'color_caps_on': str,
-                    'color_caps_off': str,
-                    'color_titlebar': str,
-                    'window_width': int,
-                    'window_height': int,
-                    'window_x': int,
-                    'window_y': int,
-                    'always_on_top': lambda v: v.strip().lower() in ['true', '1', 'yes', 'on'],
-                    'software_list': lambda v: [sw.strip() for sw in v.split(',')]  # 解析软件列表
-                }
-                
-                for line in lines:
-                    line = line.strip()
-                    if not line or line.startswith('#'):
-                        continue
-                    
-                    if '=' in line:
-                        key, value = line.split('=', 1)
-                        key = key.strip()
-                        value = value.strip()
-                        
-                        # 处理注释
-                        if ';' in value:
-                            value = value.split(';')[0].strip()
-                        
-                        if key in config_handlers:
-                            self.config[key] = config_handlers[key](value)
-                            
-                self.logger.info("配置文件读取成功")
-                self.logger.debug(f"配置内容: {self.config}")
-            else:
-                # 配置文件不存在，生成默认配置文件
-                self.write_config_file()
-                self.logger.info("配置文件不存在，已生成默认配置")
-        except Exception as e:
-            self.logger.error(f"读取配置文件失败: {str(e)}", exc_info=True)
-    
-    def write_config_file(self):
-        """将配置写入文件"""
-        try:
-            with open('config.txt', 'w', encoding='utf-8') as f:
-                f.write('# Caps Lock 检测器配置文件\n')
-                f.write('# 颜色设置\n')
-                f.write(f"color_caps_on = {self.config['color_caps_on']}\n")
-                f.write(f"color_caps_off = {self.config['color_caps_off']}\n")
-                f.write(f"color_titlebar = {self.config['color_titlebar']}\n")
-                f.write('\n# 窗口设置\n')
-                f.write(f"window_width = {self.config['window_width']}\n")
-                f.write(f"window_height = {self.config['window_height']}\n")
-                f.write(f"window_x = {self.config['window_x']}\n")
-                f.write(f"window_y = {self.config['window_y']}\n")
-                f.write('\n# 其他设置\n')
-                f.write(f"always_on_top = {'true' if self.config['always_on_top'] else 'false'}\n")
-                f.write(f"software_list = {','.join(self.config['software_list'])}\n")  # 写入软件列表
-            self.logger.info("默认配置文件已生成")
-        except Exception as e:
-            self.logger.error(f"写入配置文件失败: {str(e)}")
+        """启动时读取配置文件（文件未变化时直接使用缓存的解析结果），之后的刷新由refresh_config在后台进行"""
+        self.config, self.policy = self.config_store.load()
 
     def refresh_config(self):
-        """刷新配置文件"""
-        try:
-            self.logger.info("刷新配置文件")
-            self.read_config()
-            self.apply_config()
-            self.logger.info("配置文件刷新成功")
-        except Exception as e:
-            self.logger.error(f"刷新配置文件失败: {str(e)}", exc_info=True)
+        """刷新配置文件：在后台线程中读取和编译，引擎应用后通过'config'状态交给drain_engine_states刷新界面"""
+        self.logger.info("刷新配置文件")
+        self.engine.reload_config()
     
     def save_window_position(self):
-        """保存当前窗口位置和大小到配置文件"""
-        try:
-            # 获取当前窗口位置和大小
-            geo = self.root.geometry()
-            if 'x' in geo and '+' in geo:
-                # 解析宽度、高度和位置
-                size_part, pos_part = geo.split('+', 1)
-                width, height = map(int, size_part.split('x'))
-                x, y = map(int, pos_part.split('+', 1))
-                
-                # 读取最新配置
-                self.read_config()
-                
-                # 读取现有配置内容
-                existing_lines = []
-                if os.path.exists('config.txt'):
-                    with open('config.txt', 'r', encoding='utf-8') as f:
-                        existing_lines = [line.strip() for line in f if line.strip()]
-                
-                # 构建新的配置内容
-                new_lines = []
-                
-                # 创建配置项映射
-                config_map = {
-                    'color_caps_on': self.config.get('color_caps_on', '#fa6666'),
-                    'color_caps_off': self.config.get('color_caps_off', '#4CAF50'),
-                    'color_titlebar': self.config.get('color_titlebar', '#2c3e50'),
-                    'window_width': str(width),
-                    'window_height': str(height),
-                    'window_x': str(x),
-                    'window_y': str(y),
-                    'always_on_top': 'true' if self.config.get('always_on_top', False) else 'false'
-                }
-                
-                # 处理现有配置项
-                for line in existing_lines:
-                    if not line or line.startswith('#'):
-                        new_lines.append(line)
-                        continue
-                    
-                    if '=' in line:
-                        key, value = line.split('=', 1)
-                        key = key.strip()
-                        
-                        # 更新需要保存的配置项
-                        if key in config_map:
-                            # 保留原有注释
-                            if ';' in value:
-                                comment = value.split(';', 1)[1]
-                                new_lines.append(f'{key} = {config_map[key]};{comment}')
-                            else:
-                                new_lines.append(f'{key} = {config_map[key]}')
-                            
-                            # 从映射中移除已处理的项
-                            del config_map[key]
-                        else:
-                            # 保留未定义的配置项
-                            new_lines.append(line)
-                
-                # 添加剩余的配置项
-                for key, value in config_map.items():
-                    new_lines.append(f'{key} = {value}')
-                
-                # 写入配置文件
-                with open('config.txt', 'w', encoding='utf-8') as f:
-                    for line in new_lines:
-                        f.write(f'{line}\n')
-                
-                self.logger.info(f"窗口位置已保存: {geo}")
-        except Exception as e:
-            self.logger.error(f"保存窗口位置失败: {str(e)}", exc_info=True)
+        """记录当前窗口位置和大小，并立即写回配置文件（退出时调用）"""
+        self.record_geometry()
+        self.geometry_persister.flush()
+    
+    def on_root_configure(self, event):
+        """窗口移动或调整大小后记录几何信息（每帧最多读取一次）"""
+        if event.widget is self.root:
+            self.frame_coalescer.submit('geometry', self.record_geometry)
+    
+    def record_geometry(self):
+        """把当前窗口几何信息交给延迟写回"""
+        geometry = parse_geometry(self.root.geometry())
+        if geometry is not None:
+            self.geometry_persister.update(geometry)
     
     def setup_logging(self):
-        """设置日志系统"""
-        # 创建logs文件夹
-        log_folder = 'logs'
-        if not os.path.exists(log_folder):
-            os.makedirs(log_folder)
-            self.logger.info("日志文件夹创建成功")
-        
-        # 生成日志文件名
-        today = datetime.date.today()
-        log_filename = os.path.join(log_folder, 'log_{}.txt'.format(today.strftime('%Y-%m-%d')))
-        
-        # 配置日志
-        logging.basicConfig(
-            filename=log_filename,
-            level=logging.DEBUG,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            encoding='utf-8'
-        )
+        """设置异步日志管道，写文件在后台线程中进行"""
+        self.log_pipeline = LogPipeline()
+        self.log_pipeline.start()
         self.logger = logging.getLogger(__name__)
 
-if __name__ == "__main__":
+def run_headless(backend=None, trace_path=None, profiler=None):
+    """无界面模式：只运行自动切换引擎，不导入tkinter"""
+    log_pipeline = LogPipeline()
+    log_pipeline.start()
+    logger = logging.getLogger(__name__)
+    logger.info("应用程序启动（无界面模式）")
+    config_store = ConfigStore(logger=logger)
+    config, policy = config_store.load()
+    log_pipeline.apply_config(config)
+    if profiler is not None:
+        profiler.mark("日志和配置")
+
+    engine = CapsLockEngine(backend if backend is not None else Win32Backend(), logger, config_store=config_store,
+                            trace=open_trace(trace_path, logger))
+    if profiler is not None:
+        # 在首次检测之后执行
+        def report_startup():
+            profiler.mark("启动检测引擎")
+            profiler.event("首次检测完成", engine.first_tick_at)
+            profiler.publish(profiler.report(), logger)
+        engine.loop.call_soon(report_startup)
+    ipc = IpcServer(engine, logger=logger)
+    ipc.start()
+    # 信号处理函数只记录请求：engine.stop()要获取事件循环的锁，被信号打断的代码可能正持有它
+    stop_requested = []
+    for name in ('SIGINT', 'SIGTERM', 'SIGBREAK'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), lambda signum, frame: stop_requested.append(signum))
+    try:
+        # 引擎在自己的线程中运行，主线程定期醒来检查退出请求，在信号处理函数之外停止引擎
+        engine.start(config, policy)
+        while engine.thread.is_alive() and not stop_requested:
+            engine.thread.join(0.2)
+    finally:
+        ipc.stop()
+        engine.stop()
+        logger.info("应用程序退出")
+        log_pipeline.stop()
+
+
+def replay_trace(path, config, policy, logger=None):
+    """用模拟后端和虚拟时钟把诊断记录重新送入引擎，比实际运行快得多
+
+    每个前台窗口事件对比记录中的切换次数和回放时的切换次数，不一致的列入mismatches，
+    因此诊断记录可以直接作为回归用例；引擎的延迟统计反映回放时的实际处理耗时。
+    """
+    logger = logger or logging.getLogger(__name__)
+    backend = FakeBackend()
+    loop = VirtualLoop()
+    engine = CapsLockEngine(backend, logger, loop=loop)
+    engine._prepare(dict(config, metrics_interval=0), policy)
+    engine._start_sources()
+
+    decisions = []
+    records = sessions = 0
+    offset = 0.0
+    current = None
+
+    def finish():
+        if current is not None:
+            current['replayed_toggles'] = backend.toggle_count - current.pop('toggle_count')
+            decisions.append(current)
+
+    started = time.perf_counter()
+    for kind, t, hwnd, pid, flags, payload in read_trace(path):
+        records += 1
+        if kind == TRACE_SESSION:
+            # 新的一次运行：引擎从头开始，不沿用上次运行的窗口状态和手动选择
+            loop.advance(0)
+            finish()
+            current = None
+            sessions += 1
+            offset = loop.now
+            engine.last_hwnd = None
+            engine.manual_overrides.clear()
+            engine.decision_cache.reset(config['decision_cache_size'])
+            engine.process_cache.clear()
+            continue
+        if offset + t > loop.now:
+            loop.advance(offset + t - loop.now)
+        if kind == TRACE_FOREGROUND:
+            loop.advance(0)
+            finish()
+            title, process_name, window_class, ex_style = (payload.decode('utf-8', 'replace').split('\0') + ['', '', '0'])[:4]
+            backend.add_window(hwnd, title, pid, window_class, int(ex_style or 0))
+            if process_name:
+                backend.add_process(pid, process_name)
+            backend.caps_lock = bool(flags & 1)
+            current = {'t': round(loop.now, 6), 'hwnd': hwnd, 'title': title, 'caps_lock_on': bool(flags & 1),
+                       'recorded_toggles': 0, 'toggle_count': backend.toggle_count}
+            backend.set_foreground(hwnd)
+        elif kind == TRACE_KEY:
+            if not flags & 1:
+                backend.press_caps_lock()
+        elif kind == TRACE_CAPS:
+            backend.caps_lock = bool(flags & 1)
+        elif kind == TRACE_TOGGLE and current is not None:
+            current['recorded_toggles'] += 1
+    loop.advance(1)
+    finish()
+    wall = time.perf_counter() - started
+
+    stats = engine.stats()
+    return {
+        'records': records,
+        'sessions': sessions,
+        'trace_duration_s': round(loop.now, 3),
+        'replay_wall_s': round(wall, 3),
+        'speedup': round(loop.now / wall, 1) if wall > 0 else None,
+        'switches': stats['switches'],
+        'toggles': stats['toggles'],
+        'latency': stats['latency'],
+        'decisions': decisions,
+        'mismatches': [d for d in decisions if d['recorded_toggles'] != d['replayed_toggles']],
+    }
+
+
+def run_replay(path, as_json=False):
+    """按当前配置回放诊断记录并输出切换决定，结果与记录不一致时返回1"""
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.WARNING)
+    config, policy = ConfigStore(logger=logger).load()
+    report = replay_trace(path, config, policy, logger)
+    if as_json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        for decision in report['decisions']:
+            if decision['recorded_toggles'] or decision['replayed_toggles']:
+                mark = "" if decision['recorded_toggles'] == decision['replayed_toggles'] else "  <-- 与记录不一致"
+                print(f"{decision['t']:>12.3f}s  hwnd={decision['hwnd']:<10} 记录切换{decision['recorded_toggles']}次 "
+                      f"回放切换{decision['replayed_toggles']}次  {decision['title']}{mark}")
+        print(f"记录{report['records']}条（{report['sessions']}次运行），窗口切换{report['switches']}次，"
+              f"切换Caps Lock{report['toggles']}次，不一致{len(report['mismatches'])}处")
+        print(f"记录时长{report['trace_duration_s']}秒，回放耗时{report['replay_wall_s']}秒，加速{report['speedup']}倍")
+    return 1 if report['mismatches'] else 0
+
+
+def main(argv=None):
+    profiler = StartupProfiler()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Caps Lock 状态检测")
+    parser.add_argument('--headless', action='store_true', help="无界面模式，只运行自动切换引擎")
+    parser.add_argument('--trace', metavar='FILE', help="把观察到的窗口、按键事件和切换决定追加记录到FILE")
+    parser.add_argument('--replay', metavar='FILE', help="按当前配置回放诊断记录FILE并输出切换决定，不启动界面")
+    parser.add_argument('--json', action='store_true', help="回放结果以JSON格式输出")
+    parser.add_argument('--profile-startup', action='store_true', help="输出启动各阶段耗时和导入耗时")
+    parser.add_argument('--send', choices=IPC_COMMANDS, metavar='CMD',
+                        help="把命令(status/subscribe/reload/quit)交给正在运行的实例后退出")
+    args = parser.parse_args(argv)
+    profiler.mark("解析命令行")
+    if not args.profile_startup:
+        profiler = None
+
+    if args.replay:
+        sys.exit(run_replay(args.replay, args.json))
+
+    if args.send:
+        exit_code = run_ipc_client(args.send)
+        if exit_code is None:
+            print("没有正在运行的实例", file=sys.stderr)
+            exit_code = 1
+        sys.exit(exit_code)
+
+    # 已有实例在运行时不再启动第二个界面和检测循环
+    if send_ipc_command('status') is not None:
+        print("已有实例在运行，本次启动退出")
+        return
+    if profiler is not None:
+        profiler.mark("检查已运行的实例")
+
+    if args.headless:
+        run_headless(trace_path=args.trace, profiler=profiler)
+        return
+
+    load_tkinter()
     root = tk.Tk()
-    app = CapsLockChecker(root)
-    root.mainloop()
\ No newline at end of file
+    if profiler is not None:
+        profiler.mark("创建Tk根窗口")
+    app = CapsLockChecker(root, trace_path=args.trace, profiler=profiler)
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file